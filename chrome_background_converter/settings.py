@@ -99,15 +99,38 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static']
-# Use default static file storage (not compressed) for local dev
-STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+# collectstatic minifies CSS/JS, fingerprints every file and writes .gz/.br siblings;
+# WhiteNoise serves the hashed names with a one-year immutable Cache-Control and picks
+# the precompressed variant from Accept-Encoding. Without a manifest (local dev, before
+# collectstatic) the plain names are served
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': config('STATICFILES_BACKEND', default='converter.storage.ChromiStaticFilesStorage'),
+    },
+}
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-# File upload size limit (100MB)
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600
+# Uploads: the 'video' field is sniffed, hashed and spooled to disk (or piped straight
+# into ffmpeg when the trim is in the query string and the container allows it), so
+# no upload is ever held whole in memory
+FILE_UPLOAD_HANDLERS = [
+    'converter.uploadhandlers.VideoUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # Django default (2.5MB) for any other file fields
+STREAM_UPLOADS_TO_FFMPEG = config('STREAM_UPLOADS_TO_FFMPEG', default=True, cast=bool)
+
+# Resumable chunked uploads (/uploads/): sessions live on disk (ARTIFACT_DIR/sessions by
+# default) and the artifact sweeper removes them after UPLOAD_SESSION_TTL of inactivity
+UPLOAD_SESSION_DIR = config('UPLOAD_SESSION_DIR', default='') or None
+UPLOAD_SESSION_TTL = config('UPLOAD_SESSION_TTL', default=3600, cast=int)
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=5 * 1024 * 1024, cast=int)
+UPLOAD_MAX_SIZE = config('UPLOAD_MAX_SIZE', default=100 * 1024 * 1024, cast=int)
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -125,7 +148,163 @@ LOGGING = {
     },
 }
 
+# GIF conversion engine: 'ffmpeg' streams everything through one ffmpeg process;
+# 'ffmpeg_segmented' encodes time slices in parallel against one shared palette;
+# 'moviepy' decodes frames in Python and is only used as a fallback
+CONVERSION_BACKEND = config('CONVERSION_BACKEND', default='ffmpeg')
+CONVERSION_FALLBACK_BACKEND = config('CONVERSION_FALLBACK_BACKEND', default='moviepy')
+# ffmpeg_segmented: slice count (0 = one per thread admission control grants the job, and
+# never more than that; a single slice falls back to the plain ffmpeg backend; a job
+# borrows idle admission slots up to this many threads, or all cores when 0),
+# shortest slice, and the sampling rate of the palette pass
+SEGMENTED_ENCODE_SEGMENTS = config('SEGMENTED_ENCODE_SEGMENTS', default=0, cast=int)
+SEGMENTED_MIN_SEGMENT_SECONDS = config('SEGMENTED_MIN_SEGMENT_SECONDS', default=1, cast=float)
+SEGMENTED_PALETTE_FPS = config('SEGMENTED_PALETTE_FPS', default=5, cast=int)
+CONVERSION_TIMEOUT = config('CONVERSION_TIMEOUT', default=120, cast=int)
+# Resource governor for every ffmpeg child: address-space cap (0 = none), CPU-time cap
+# (0 = CONVERSION_TIMEOUT x granted cores), niceness increment and ionice class/level.
+# A run past CONVERSION_TIMEOUT gets SIGTERM, then SIGKILL FFMPEG_KILL_GRACE seconds
+# later. Sources decoding more than MAX_INPUT_PIXEL_RATE pixels/s (default 4K60) are
+# refused (0 = off)
+FFMPEG_MEMORY_LIMIT_BYTES = config('FFMPEG_MEMORY_LIMIT_BYTES', default=2 * 1024 * 1024 * 1024, cast=int)
+FFMPEG_CPU_SECONDS = config('FFMPEG_CPU_SECONDS', default=0, cast=int)
+FFMPEG_NICE = config('FFMPEG_NICE', default=10, cast=int)
+FFMPEG_IONICE_CLASS = config('FFMPEG_IONICE_CLASS', default=2, cast=int)
+FFMPEG_IONICE_LEVEL = config('FFMPEG_IONICE_LEVEL', default=7, cast=int)
+FFMPEG_KILL_GRACE = config('FFMPEG_KILL_GRACE', default=5, cast=float)
+MAX_INPUT_PIXEL_RATE = config('MAX_INPUT_PIXEL_RATE', default=3840 * 2160 * 60, cast=int)
+GIF_WIDTH = config('GIF_WIDTH', default=640, cast=int)
+GIF_HEIGHT = config('GIF_HEIGHT', default=360, cast=int)
+GIF_FPS = config('GIF_FPS', default=15, cast=int)
+# Byte budget per GIF (0 = off). A sampled planning pass then picks fps, palette size,
+# dithering and palette stats_mode predicted to fit within TARGET_SIZE_MARGIN of it
+GIF_TARGET_BYTES = config('GIF_TARGET_BYTES', default=0, cast=int)
+TARGET_SIZE_MARGIN = config('TARGET_SIZE_MARGIN', default=0.9, cast=float)
+TARGET_SIZE_SAMPLE_WINDOWS = config('TARGET_SIZE_SAMPLE_WINDOWS', default=3, cast=int)
+TARGET_SIZE_WINDOW_SECONDS = config('TARGET_SIZE_WINDOW_SECONDS', default=0.5, cast=float)
+# Post-encode GIF optimization: crop frames to their changed rectangle and make
+# unchanged pixels transparent. Colours within GIF_OPTIMIZE_FUZZ (RGB distance) of what
+# is on screen count as unchanged; GIF_OPTIMIZE_LOSSY > 0 enables lossy LZW with that
+# tolerance. Clips with more than GIF_OPTIMIZE_MAX_CHANGED of pixels changing, or whose
+# changed rectangles add up to more than GIF_OPTIMIZE_MAX_PIXELS for the Python LZW coder
+# (roughly 2.5M pixels per second; the default keeps the stage well under the encode),
+# are left alone
+GIF_OPTIMIZE = config('GIF_OPTIMIZE', default=False, cast=bool)
+GIF_OPTIMIZE_FUZZ = config('GIF_OPTIMIZE_FUZZ', default=10.0, cast=float)
+GIF_OPTIMIZE_LOSSY = config('GIF_OPTIMIZE_LOSSY', default=0, cast=int)
+GIF_OPTIMIZE_MAX_CHANGED = config('GIF_OPTIMIZE_MAX_CHANGED', default=0.5, cast=float)
+GIF_OPTIMIZE_MAX_PIXELS = config('GIF_OPTIMIZE_MAX_PIXELS', default=500_000, cast=int)
+# Seamless loops: move each trim's end by up to LOOP_SEARCH_WINDOW seconds to the frame
+# that best matches the first one. Frames are compared as LOOP_PROXY_WIDTH-wide grayscale
+# proxies; LOOP_SEARCH_BIAS is the mismatch (grey levels) a second of drift has to beat
+LOOP_SEARCH = config('LOOP_SEARCH', default=False, cast=bool)
+LOOP_SEARCH_WINDOW = config('LOOP_SEARCH_WINDOW', default=0.5, cast=float)
+LOOP_PROXY_WIDTH = config('LOOP_PROXY_WIDTH', default=64, cast=int)
+LOOP_SEARCH_BIAS = config('LOOP_SEARCH_BIAS', default=2.0, cast=float)
+# /convert/batch/: clips per request, longest clip, and the largest gap between clips
+# that is still decoded through rather than seeked over (a separate ffmpeg run)
+BATCH_MAX_CLIPS = config('BATCH_MAX_CLIPS', default=8, cast=int)
+BATCH_MAX_CLIP_SECONDS = config('BATCH_MAX_CLIP_SECONDS', default=6, cast=float)
+BATCH_MAX_GAP_SECONDS = config('BATCH_MAX_GAP_SECONDS', default=10, cast=float)
+# Trim previews of completed uploads: a small low-fps GIF per start time (the most recent
+# PREVIEW_CACHE_ENTRIES kept per upload) and a sprite sheet of up to SPRITE_MAX_TILES keyframes
+PREVIEW_WIDTH = config('PREVIEW_WIDTH', default=240, cast=int)
+PREVIEW_FPS = config('PREVIEW_FPS', default=5, cast=int)
+PREVIEW_COLORS = config('PREVIEW_COLORS', default=64, cast=int)
+PREVIEW_CACHE_ENTRIES = config('PREVIEW_CACHE_ENTRIES', default=16, cast=int)
+SPRITE_TILE_WIDTH = config('SPRITE_TILE_WIDTH', default=160, cast=int)
+SPRITE_MAX_TILES = config('SPRITE_MAX_TILES', default=100, cast=int)
+SPRITE_COLUMNS = config('SPRITE_COLUMNS', default=10, cast=int)
+# Work directory for temp uploads and converted GIFs (point it at a tmpfs for speed; keep
+# DOWNLOAD_OFFLOAD_ROOT above it). Files older than their TTL are swept, then the oldest
+# are evicted until the directory fits ARTIFACT_QUOTA_BYTES (0 = unlimited). Workers
+# sweep at most every ARTIFACT_SWEEP_INTERVAL seconds; `manage.py sweep_artifacts` runs one on demand
+ARTIFACT_DIR = config('ARTIFACT_DIR', default='') or None
+ARTIFACT_UPLOAD_TTL = config('ARTIFACT_UPLOAD_TTL', default=3600, cast=int)
+ARTIFACT_OUTPUT_TTL = config('ARTIFACT_OUTPUT_TTL', default=1800, cast=int)
+ARTIFACT_QUOTA_BYTES = config('ARTIFACT_QUOTA_BYTES', default=1024 * 1024 * 1024, cast=int)
+ARTIFACT_GRACE_SECONDS = config('ARTIFACT_GRACE_SECONDS', default=60, cast=int)
+ARTIFACT_SWEEP_INTERVAL = config('ARTIFACT_SWEEP_INTERVAL', default=60, cast=int)
+# ffprobe preflight: snap the input-side seek to a keyframe this close to the start
+PROBE_TIMEOUT = config('PROBE_TIMEOUT', default=15, cast=int)
+SEEK_SNAP_TOLERANCE = config('SEEK_SNAP_TOLERANCE', default=0.25, cast=float)
+# Content-addressed cache of converted GIFs; set the budget to 0 to disable
+RESULT_CACHE_DIR = config('RESULT_CACHE_DIR', default='') or None
+RESULT_CACHE_MAX_BYTES = config('RESULT_CACHE_MAX_BYTES', default=512 * 1024 * 1024, cast=int)
+# One-time download tokens must be visible to every worker: 'file' shares them
+# through DOWNLOAD_TOKEN_DIR on one host, 'redis' across hosts, 'local' is per-process
+DOWNLOAD_TOKEN_BACKEND = config('DOWNLOAD_TOKEN_BACKEND', default='file')
+DOWNLOAD_TOKEN_DIR = config('DOWNLOAD_TOKEN_DIR', default='') or None
+DOWNLOAD_TOKEN_TTL = config('DOWNLOAD_TOKEN_TTL', default=600, cast=int)
+# Let the front proxy send finished GIFs: '' (serve via sendfile from Django),
+# 'x-accel-redirect' (nginx internal location at DOWNLOAD_OFFLOAD_PREFIX aliased to
+# DOWNLOAD_OFFLOAD_ROOT) or 'x-sendfile' (Apache/lighttpd). The file is deleted
+# DOWNLOAD_OFFLOAD_GRACE seconds later via a record in ARTIFACT_DIR/discards/
+DOWNLOAD_OFFLOAD = config('DOWNLOAD_OFFLOAD', default='')
+DOWNLOAD_OFFLOAD_PREFIX = config('DOWNLOAD_OFFLOAD_PREFIX', default='/protected-downloads/')
+DOWNLOAD_OFFLOAD_ROOT = config('DOWNLOAD_OFFLOAD_ROOT', default='') or None
+DOWNLOAD_OFFLOAD_GRACE = config('DOWNLOAD_OFFLOAD_GRACE', default=30, cast=int)
+# Where finished GIFs wait for download: 'local' (ARTIFACT_DIR on the converting node,
+# served by Django) or 's3' (any S3-compatible bucket; needs boto3). With 's3' downloads
+# redirect to a presigned URL valid for ARTIFACT_S3_PRESIGN_TTL seconds, and files above
+# the multipart threshold upload in chunks. Set ARTIFACT_S3_ENDPOINT_URL for MinIO & co.
+# and add a lifecycle rule expiring ARTIFACT_S3_PREFIX as a backstop for unclaimed GIFs
+ARTIFACT_STORAGE = config('ARTIFACT_STORAGE', default='local')
+ARTIFACT_S3_BUCKET = config('ARTIFACT_S3_BUCKET', default='')
+ARTIFACT_S3_PREFIX = config('ARTIFACT_S3_PREFIX', default='outputs/')
+ARTIFACT_S3_ENDPOINT_URL = config('ARTIFACT_S3_ENDPOINT_URL', default='') or None
+ARTIFACT_S3_REGION = config('ARTIFACT_S3_REGION', default='') or None
+ARTIFACT_S3_ACCESS_KEY = config('ARTIFACT_S3_ACCESS_KEY', default='') or None
+ARTIFACT_S3_SECRET_KEY = config('ARTIFACT_S3_SECRET_KEY', default='') or None
+ARTIFACT_S3_PRESIGN_TTL = config('ARTIFACT_S3_PRESIGN_TTL', default=60, cast=int)
+ARTIFACT_S3_MULTIPART_THRESHOLD = config('ARTIFACT_S3_MULTIPART_THRESHOLD', default=8 * 1024 * 1024, cast=int)
+ARTIFACT_S3_MULTIPART_CHUNKSIZE = config('ARTIFACT_S3_MULTIPART_CHUNKSIZE', default=8 * 1024 * 1024, cast=int)
+
+# Route /convert/, /download/ and /jobs/<id>/events/ to native async views. Set by gunicorn_asgi.conf.py
+# (uvicorn workers); leave off under the sync/gthread WSGI profile
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# Cross-process limit on concurrent ffmpeg encodes on this host. Slots default to one
+# per core, fewer if ADMISSION_MEMORY_PER_JOB does not fit; cores are split between
+# slots as each job's -threads budget. Requests wait up to ADMISSION_WAIT_TIMEOUT in a
+# queue of ADMISSION_QUEUE_SIZE, then get 429/503 with Retry-After
+ADMISSION_CONTROL = config('ADMISSION_CONTROL', default=True, cast=bool)
+ADMISSION_DIR = config('ADMISSION_DIR', default='') or None
+ADMISSION_SLOTS = config('ADMISSION_SLOTS', default=0, cast=int)
+ADMISSION_THREADS_PER_JOB = config('ADMISSION_THREADS_PER_JOB', default=0, cast=int)
+ADMISSION_MEMORY_PER_JOB = config('ADMISSION_MEMORY_PER_JOB', default=256 * 1024 * 1024, cast=int)
+ADMISSION_QUEUE_SIZE = config('ADMISSION_QUEUE_SIZE', default=4, cast=int)
+ADMISSION_WAIT_TIMEOUT = config('ADMISSION_WAIT_TIMEOUT', default=10, cast=float)
+ADMISSION_JOB_WAIT_TIMEOUT = config('ADMISSION_JOB_WAIT_TIMEOUT', default=240, cast=float)
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=10, cast=int)
+
 # Background jobs and memory diagnostics (optional)
 USE_RQ = config('USE_RQ', default=False, cast=bool)
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+# Job backend used when USE_RQ is on: 'rq' (Redis + `manage.py conversion_worker`), or an in-process
+# 'thread' / 'process' pool for single-box deployments and tests
+JOB_BACKEND = config('JOB_BACKEND', default='rq')
+JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+JOB_TIMEOUT = config('JOB_TIMEOUT', default=300, cast=int)
+RQ_QUEUE_NAME = config('RQ_QUEUE_NAME', default='default')
+# `manage.py conversion_worker`: a worker process is replaced once its peak RSS passes
+# WORKER_MAX_RSS_BYTES (0 = never), and takes up to WORKER_PREFETCH waiting jobs per pull
+WORKER_MAX_RSS_BYTES = config('WORKER_MAX_RSS_BYTES', default=512 * 1024 * 1024, cast=int)
+WORKER_PREFETCH = config('WORKER_PREFETCH', default=1, cast=int)
+# Where running jobs publish encoder progress for /jobs/<id>/events/: 'file' (shared
+# directory, one host), 'redis' (multi-node) or 'local' (single process only)
+PROGRESS_BACKEND = config('PROGRESS_BACKEND', default='file')
+PROGRESS_DIR = config('PROGRESS_DIR', default='') or None
+PROGRESS_TTL = config('PROGRESS_TTL', default=600, cast=int)
+# An event stream or long-poll holds a worker thread: keep each one well under the
+# gunicorn timeout; EventSource reconnects and resumes from Last-Event-ID
+PROGRESS_STREAM_SECONDS = config('PROGRESS_STREAM_SECONDS', default=25, cast=int)
 ENABLE_TRACEMALLOC = config('ENABLE_TRACEMALLOC', default=False, cast=bool)
+TRACEMALLOC_FRAMES = config('TRACEMALLOC_FRAMES', default=1, cast=int)
+TRACEMALLOC_TOP = config('TRACEMALLOC_TOP', default=10, cast=int)
+# Per-stage histograms served at /metrics (Prometheus text format). Each process writes
+# a snapshot to METRICS_DIR and the endpoint merges them; set METRICS_TOKEN to require
+# "Authorization: Bearer <token>" from the scraper
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_DIR = config('METRICS_DIR', default='') or None
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
@@ -0,0 +1,282 @@
+import os
+import time
+import asyncio
+import fcntl
+import logging
+import tempfile
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Saturated(Exception):
+    """
+    Raised when no conversion slot can be had. status is 429 when the wait queue is
+    already full (rejected immediately) and 503 when a slot did not free up in time.
+    """
+
+    def __init__(self, message: str, status: int = 503, retry_after: int = 10):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def cpu_budget() -> int:
+    """CPUs this process may use: affinity mask, capped by a cgroup v2 cpu.max quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def memory_budget() -> int:
+    """Bytes of memory available to this host or container (cgroup limit when set)."""
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        memory = 0
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit() and (not memory or int(limit) < memory):
+            memory = int(limit)
+    return memory
+
+
+def plan_slots(cpus: int, memory: int, memory_per_job: int, slots: int = 0):
+    """
+    Return (slots, threads_per_job). Unless pinned, there is one slot per core,
+    fewer if memory cannot hold that many encodes. Cores are then split evenly between
+    slots so that concurrent ffmpeg processes never oversubscribe the CPU.
+    """
+    if not slots:
+        slots = cpus
+        if memory and memory_per_job:
+            slots = min(slots, memory // memory_per_job)
+    slots = max(1, slots)
+    return slots, max(1, cpus // slots)
+
+
+class Slot:
+    """A held conversion slot; the flock is released when the slot is (or its process dies)."""
+
+    def __init__(self, fd: int, index: int, threads: int):
+        self.fd = fd
+        self.index = index
+        self.threads = threads
+        # Idle slots lent to this job by widen(), released with it
+        self.extra = []
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        while self.extra:
+            os.close(self.extra.pop())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Cross-process counting semaphore for ffmpeg processes on this host, built from
+    flock()ed slot files in a shared directory. A second set of lock files bounds the
+    number of requests allowed to wait for a slot. The kernel drops the locks of a crashed
+    worker, so slots are never leaked.
+    """
+
+    def __init__(self, directory: str, slots: int, threads: int, queue_size: int = 4, wait_timeout: float = 10,
+                 job_wait_timeout: float = 240, retry_after: int = 10, poll_interval: float = 0.1):
+        self.directory = directory
+        self.slots = slots
+        self.threads = threads
+        self.queue_size = queue_size
+        self.wait_timeout = wait_timeout
+        self.job_wait_timeout = job_wait_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _try_lock(self, prefix: str, count: int):
+        for index in range(count):
+            fd = os.open(os.path.join(self.directory, f'{prefix}-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd, index
+        return None
+
+    def try_acquire(self):
+        """Take a free slot without waiting, or return None."""
+        locked = self._try_lock('slot', self.slots)
+        if locked is None:
+            return None
+        return Slot(locked[0], locked[1], self.threads)
+
+    def widen(self, slot: Slot, threads: int) -> Slot:
+        """
+        Add idle slots to a held one until it carries threads cores or none are free.
+        Never waits: a busy host leaves the job with what it was granted.
+        """
+        while slot.fd is not None and slot.threads < threads:
+            locked = self._try_lock('slot', self.slots)
+            if locked is None:
+                break
+            slot.extra.append(locked[0])
+            slot.threads += self.threads
+        return slot
+
+    def acquire(self, background: bool = False) -> Slot:
+        """
+        Wait for a slot. Request-path callers must first get a place in the bounded wait
+        queue and give up after wait_timeout. Background jobs are already queued by the job
+        backend, so they skip the queue and wait up to job_wait_timeout.
+        """
+        slot = self.try_acquire()
+        if slot is not None:
+            return slot
+
+        waiter = None
+        if not background:
+            waiter = self._try_lock('wait', self.queue_size)
+            if waiter is None:
+                raise Saturated('Too many conversions in progress, please retry shortly',
+                                status=429, retry_after=self.retry_after)
+        timeout = self.job_wait_timeout if background else self.wait_timeout
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                slot = self.try_acquire()
+                if slot is not None:
+                    return slot
+        finally:
+            if waiter is not None:
+                os.close(waiter[0])
+        logger.warning(f"No conversion slot freed up within {timeout}s")
+        raise Saturated('The converter is busy, please retry shortly', status=503, retry_after=self.retry_after)
+
+    async def acquire_async(self, background: bool = False) -> Slot:
+        """acquire() that waits on the event loop instead of blocking a thread."""
+        slot = self.try_acquire()
+        if slot is not None:
+            return slot
+
+        waiter = None
+        if not background:
+            waiter = self._try_lock('wait', self.queue_size)
+            if waiter is None:
+                raise Saturated('Too many conversions in progress, please retry shortly',
+                                status=429, retry_after=self.retry_after)
+        timeout = self.job_wait_timeout if background else self.wait_timeout
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                slot = self.try_acquire()
+                if slot is not None:
+                    return slot
+        finally:
+            if waiter is not None:
+                os.close(waiter[0])
+        logger.warning(f"No conversion slot freed up within {timeout}s")
+        raise Saturated('The converter is busy, please retry shortly', status=503, retry_after=self.retry_after)
+
+    def _is_free(self, prefix: str, index: int) -> bool:
+        fd = os.open(os.path.join(self.directory, f'{prefix}-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+        return True
+
+    def usage(self) -> dict:
+        """Best-effort snapshot of busy slots and queued waiters."""
+        return {
+            'slots': self.slots,
+            'threads_per_job': self.threads,
+            'busy': sum(not self._is_free('slot', index) for index in range(self.slots)),
+            'waiting': sum(not self._is_free('wait', index) for index in range(self.queue_size)),
+        }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide controller, or None when ADMISSION_CONTROL is off."""
+    global _controller
+    if not getattr(settings, 'ADMISSION_CONTROL', True):
+        return None
+    with _controller_lock:
+        if _controller is None:
+            slots, threads = plan_slots(
+                cpu_budget(),
+                memory_budget(),
+                getattr(settings, 'ADMISSION_MEMORY_PER_JOB', 256 * 1024 * 1024),
+                getattr(settings, 'ADMISSION_SLOTS', 0),
+            )
+            threads = getattr(settings, 'ADMISSION_THREADS_PER_JOB', 0) or threads
+            directory = getattr(settings, 'ADMISSION_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-admission')
+            _controller = AdmissionController(
+                str(directory), slots, threads,
+                queue_size=getattr(settings, 'ADMISSION_QUEUE_SIZE', 4),
+                wait_timeout=getattr(settings, 'ADMISSION_WAIT_TIMEOUT', 10),
+                job_wait_timeout=getattr(settings, 'ADMISSION_JOB_WAIT_TIMEOUT', 240),
+                retry_after=getattr(settings, 'ADMISSION_RETRY_AFTER', 10),
+            )
+            logger.info(f"Admission control: {slots} conversion slot(s), {threads} thread(s) per job")
+        return _controller
+
+
+def acquire(background: bool = False):
+    """Hold a conversion slot for the duration of a `with` block (a no-op slot when disabled)."""
+    controller = get_admission_controller()
+    if controller is None:
+        return Slot(None, 0, None)
+    return controller.acquire(background=background)
+
+
+def widen(slot: Slot, threads: int) -> Slot:
+    """Let a job that parallelises internally borrow idle slots (a no-op when disabled)."""
+    controller = get_admission_controller()
+    if controller is None or not threads:
+        return slot
+    return controller.widen(slot, threads)
+
+
+def try_acquire():
+    """A slot if one is free right now, else None (always a no-op slot when disabled)."""
+    controller = get_admission_controller()
+    if controller is None:
+        return Slot(None, 0, None)
+    return controller.try_acquire()
+
+
+async def acquire_async(background: bool = False):
+    """acquire() for async views."""
+    controller = get_admission_controller()
+    if controller is None:
+        return Slot(None, 0, None)
+    return await controller.acquire_async(background=background)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ConverterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'converter'
+
+    def ready(self):
+        if getattr(settings, 'ENABLE_TRACEMALLOC', False):
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                # Allocation sites for /metrics; costs some CPU and memory per allocation
+                tracemalloc.start(getattr(settings, 'TRACEMALLOC_FRAMES', 1))
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import importlib
+from urllib.parse import quote
+from django.conf import settings
+from . import artifacts, metrics
+
+logger = logging.getLogger(__name__)
+
+S3_SCHEME = 's3://'
+
+
+def is_remote(locator: str) -> bool:
+    """True for artifacts published to object storage rather than kept on this node's disk."""
+    return bool(locator) and locator.startswith(S3_SCHEME)
+
+
+def remove_local(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ArtifactStorage:
+    """
+    Where finished GIFs live between conversion and download. publish() takes over a
+    local file and returns the locator the download token points at.
+    """
+
+    name = ''
+    # Deferred deletes, one JSON record each; defaults to discards/ in the artifact work directory
+    pending_dir = None
+
+    def publish(self, path: str, content_type: str = 'image/gif') -> str:
+        raise NotImplementedError
+
+    def download_url(self, locator: str, filename: str, content_type: str = 'image/gif') -> str:
+        """A URL the client can fetch the artifact from directly, or None to serve it through Django."""
+        raise NotImplementedError
+
+    def head(self, locator: str) -> dict:
+        """Size and type of a published artifact: {'ContentLength': ..., 'ContentType': ...}."""
+        raise NotImplementedError
+
+    def discard(self, locator: str) -> bool:
+        raise NotImplementedError
+
+    def _pending_dir(self) -> str:
+        directory = self.pending_dir or os.path.join(artifacts.get_artifact_manager().directory, 'discards')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def schedule_discard(self, locator: str, after: float = 0):
+        """
+        Delete an artifact after seconds plus DOWNLOAD_OFFLOAD_GRACE. The delete is
+        recorded on disk rather than held in a timer, so it survives this worker
+        exiting; sweep_discards() carries it out.
+        """
+        deadline = time.time() + after + getattr(settings, 'DOWNLOAD_OFFLOAD_GRACE', 30)
+        # One record per locator: rescheduling replaces the earlier deadline
+        name = hashlib.sha256(locator.encode()).hexdigest()
+        path = os.path.join(self._pending_dir(), f'{name}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'locator': locator, 'deadline': deadline}, f)
+        os.replace(f'{path}.tmp', path)
+        # Every scheduled delete also finishes off the ones that have come due since the last
+        self.sweep_discards()
+
+    def sweep_discards(self, now: float = None) -> int:
+        """Carry out deferred deletes that are due; returns how many were done."""
+        now = time.time() if now is None else now
+        directory = self._pending_dir()
+        done = 0
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as f:
+                    pending = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if pending['deadline'] > now or not self.discard(pending['locator']):
+                continue
+            remove_local(path)
+            done += 1
+        return done
+
+
+class LocalArtifactStorage(ArtifactStorage):
+    """The GIF stays in ARTIFACT_DIR on the converting node and Django serves it."""
+
+    name = 'local'
+
+    def publish(self, path: str, content_type: str = 'image/gif') -> str:
+        return path
+
+    def download_url(self, locator: str, filename: str, content_type: str = 'image/gif'):
+        return None
+
+    def head(self, locator: str) -> dict:
+        return {'ContentLength': os.path.getsize(locator), 'ContentType': 'image/gif'}
+
+    def discard(self, locator: str) -> bool:
+        remove_local(locator)
+        return True
+
+
+class S3ArtifactStorage(ArtifactStorage):
+    """
+    GIFs uploaded to an S3-compatible bucket (AWS, MinIO, R2...) and downloaded
+    through short-lived presigned URLs, so any node can hand out any result and the
+    bytes never pass through an app server. boto3 is only needed with this backend.
+    Files above the multipart threshold are uploaded in parallel parts.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket: str, prefix: str = 'outputs/', endpoint_url: str = None, region: str = None,
+                 access_key: str = None, secret_key: str = None, presign_ttl: int = 60,
+                 multipart_threshold: int = 8 * 1024 * 1024, multipart_chunksize: int = 8 * 1024 * 1024,
+                 client=None, pending_dir: str = None):
+        if not bucket:
+            raise ValueError('ARTIFACT_S3_BUCKET is required for the s3 artifact storage')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_ttl = presign_ttl
+        self.pending_dir = pending_dir
+        self.transfer_config = None
+        if client is None:
+            try:
+                boto3 = importlib.import_module('boto3')
+                transfer = importlib.import_module('boto3.s3.transfer')
+            except Exception as exc:
+                raise RuntimeError('boto3 not available') from exc
+            client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None,
+                                  aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None)
+            self.transfer_config = transfer.TransferConfig(multipart_threshold=multipart_threshold,
+                                                          multipart_chunksize=multipart_chunksize)
+        self.client = client
+
+    def _split(self, locator: str):
+        bucket, _sep, key = locator[len(S3_SCHEME):].partition('/')
+        return bucket, key
+
+    def publish(self, path: str, content_type: str = 'image/gif') -> str:
+        key = f'{self.prefix}{uuid.uuid4().hex}{os.path.splitext(path)[1]}'
+        extra = {'ContentType': content_type}
+        with metrics.stage('artifact_upload'):
+            if self.transfer_config is not None:
+                self.client.upload_file(path, self.bucket, key, ExtraArgs=extra, Config=self.transfer_config)
+            else:
+                self.client.upload_file(path, self.bucket, key, ExtraArgs=extra)
+        # The bucket holds the only copy from here on
+        remove_local(path)
+        return f'{S3_SCHEME}{self.bucket}/{key}'
+
+    def download_url(self, locator: str, filename: str, content_type: str = 'image/gif') -> str:
+        bucket, key = self._split(locator)
+        return self.client.generate_presigned_url('get_object', ExpiresIn=self.presign_ttl, Params={
+            'Bucket': bucket,
+            'Key': key,
+            'ResponseContentType': content_type,
+            'ResponseContentDisposition': f'attachment; filename="{quote(filename)}"',
+        })
+
+    def head(self, locator: str) -> dict:
+        bucket, key = self._split(locator)
+        return self.client.head_object(Bucket=bucket, Key=key)
+
+    def discard(self, locator: str) -> bool:
+        if not is_remote(locator):
+            # A file offloaded to the front proxy before this node switched storages
+            remove_local(locator)
+            return True
+        bucket, key = self._split(locator)
+        try:
+            self.client.delete_object(Bucket=bucket, Key=key)
+        except Exception as exc:
+            # A bucket lifecycle rule on the prefix is the backstop
+            logger.warning(f"Could not delete {locator}: {exc}")
+            return False
+        return True
+
+    def schedule_discard(self, locator: str, after: float = 0):
+        """
+        Delete an object once a presigned URL handed out at the last moment has expired.
+        Publishing schedules it for the end of the token's life, so an unclaimed object
+        goes too; a claim reschedules it sooner.
+        """
+        super().schedule_discard(locator, after + self.presign_ttl)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_artifact_storage() -> ArtifactStorage:
+    """Return the process-wide storage selected by settings.ARTIFACT_STORAGE."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            name = getattr(settings, 'ARTIFACT_STORAGE', 'local')
+            if name == 'local':
+                _storage = LocalArtifactStorage()
+            elif name == 's3':
+                _storage = S3ArtifactStorage(
+                    getattr(settings, 'ARTIFACT_S3_BUCKET', ''),
+                    prefix=getattr(settings, 'ARTIFACT_S3_PREFIX', 'outputs/'),
+                    endpoint_url=getattr(settings, 'ARTIFACT_S3_ENDPOINT_URL', None),
+                    region=getattr(settings, 'ARTIFACT_S3_REGION', None),
+                    access_key=getattr(settings, 'ARTIFACT_S3_ACCESS_KEY', None),
+                    secret_key=getattr(settings, 'ARTIFACT_S3_SECRET_KEY', None),
+                    presign_ttl=getattr(settings, 'ARTIFACT_S3_PRESIGN_TTL', 60),
+                    multipart_threshold=getattr(settings, 'ARTIFACT_S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+                    multipart_chunksize=getattr(settings, 'ARTIFACT_S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024),
+                )
+            else:
+                raise ValueError(f"Unknown ARTIFACT_STORAGE: {name}")
+            logger.info(f"Using artifact storage: {name}")
+        return _storage
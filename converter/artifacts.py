@@ -0,0 +1,239 @@
+import os
+import time
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Uploaded sources waiting to be converted, and converted GIFs waiting to be downloaded
+KINDS = ('uploads', 'outputs')
+# Resumable upload sessions: one directory each (source, sprite sheet, cached previews)
+SESSIONS = 'sessions'
+
+
+def _tree_stat(path: str):
+    """(newest mtime, total bytes) of a session directory; a chunk written anywhere in it counts as activity."""
+    mtime, size = os.stat(path).st_mtime, 0
+    for directory, _dirs, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            mtime = max(mtime, stat.st_mtime)
+            size += stat.st_size
+    return mtime, size
+
+
+class ArtifactManager:
+    """
+    Owns the work directory every upload and output temp file is created in, one
+    subdirectory per kind. A file's mtime is its age: sweep() removes files older
+    than their kind's TTL, then evicts oldest first until the directory fits its
+    byte quota. Files touched within the grace period are never evicted for quota,
+    so an encode in progress keeps its output. Upload sessions under session_dir
+    (default sessions/ in the work directory) are managed as whole directories,
+    aged by their most recent write.
+    """
+
+    def __init__(self, directory: str, ttls: dict, quota_bytes: int = 0, grace: float = 60,
+                 sweep_interval: float = 60, session_dir: str = None):
+        self.directory = directory
+        self.session_dir = session_dir or os.path.join(directory, SESSIONS)
+        self.ttls = ttls
+        self.quota_bytes = quota_bytes
+        self.grace = grace
+        self.sweep_interval = sweep_interval
+        self.lock_path = os.path.join(directory, 'sweep.lock')
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        for kind in KINDS:
+            os.makedirs(self.path_for(kind), exist_ok=True)
+        os.makedirs(self.session_dir, exist_ok=True)
+
+    def path_for(self, kind: str) -> str:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown artifact kind: {kind}")
+        return os.path.join(self.directory, kind)
+
+    def create(self, kind: str, suffix: str = '') -> str:
+        """Create an empty file of kind and return its path; the caller owns it from here."""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.path_for(kind))
+        os.close(fd)
+        self.maybe_sweep()
+        return path
+
+    def temporary_file(self, kind: str, suffix: str = ''):
+        """An open NamedTemporaryFile(delete=False) of kind, for callers that stream into it."""
+        self.maybe_sweep()
+        return tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=self.path_for(kind))
+
+    def entries(self):
+        """Return (mtime, size, path, kind, links) for every artifact."""
+        found = []
+        for kind in KINDS:
+            directory = self.path_for(kind)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path, kind, stat.st_nlink))
+        for name in os.listdir(self.session_dir):
+            path = os.path.join(self.session_dir, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                mtime, size = _tree_stat(path)
+            except FileNotFoundError:
+                continue
+            found.append((mtime, size, path, SESSIONS, 1))
+        return found
+
+    def _remove(self, path: str, reason: str, dry_run: bool) -> bool:
+        if dry_run:
+            return True
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return False
+        metrics.inc('chromi_artifacts_removed_total', reason=reason)
+        return True
+
+    def sweep(self, dry_run: bool = False) -> dict:
+        """
+        Remove expired artifacts, then enforce the quota. Only one process sweeps at a
+        time; the others return {'skipped': True} instead of waiting.
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {'skipped': True}
+            try:
+                return self._sweep(time.time(), dry_run)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sweep(self, now: float, dry_run: bool) -> dict:
+        report = {'expired': 0, 'evicted': 0, 'freed_bytes': 0}
+        remaining = []
+        for mtime, size, path, kind, links in sorted(self.entries()):
+            if now - mtime > self.ttls.get(kind, 3600):
+                if self._remove(path, 'expired', dry_run):
+                    report['expired'] += 1
+                    report['freed_bytes'] += size if links == 1 else 0
+                continue
+            remaining.append((mtime, size, path, links))
+
+        if self.quota_bytes:
+            # A hardlink shared with the result cache frees nothing when removed
+            total = sum(size for _mtime, size, _path, links in remaining if links == 1)
+            for mtime, size, path, links in remaining:
+                if total <= self.quota_bytes:
+                    break
+                if links != 1 or now - mtime < self.grace:
+                    continue
+                if self._remove(path, 'quota', dry_run):
+                    report['evicted'] += 1
+                    report['freed_bytes'] += size
+                    total -= size
+
+        if report['expired'] or report['evicted']:
+            logger.info(f"Artifact sweep removed {report['expired']} expired and {report['evicted']} "
+                        f"over-quota file(s), freeing {report['freed_bytes']} bytes")
+        return report
+
+    def maybe_sweep(self):
+        """Start a sweep in a daemon thread when the last one in this process is older than the interval."""
+        with self._sweep_lock:
+            now = time.monotonic()
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        threading.Thread(target=self._sweep_quietly, daemon=True).start()
+
+    def _sweep_quietly(self):
+        try:
+            self.sweep()
+        except Exception as exc:
+            logger.warning(f"Artifact sweep failed: {exc}")
+
+    def usage(self) -> dict:
+        kinds = {kind: {'files': 0, 'bytes': 0} for kind in KINDS + (SESSIONS,)}
+        for _mtime, size, _path, kind, _links in self.entries():
+            kinds[kind]['files'] += 1
+            kinds[kind]['bytes'] += size
+        disk = shutil.disk_usage(self.directory)
+        return {
+            'directory': self.directory,
+            'quota_bytes': self.quota_bytes,
+            'total_bytes': sum(kind['bytes'] for kind in kinds.values()),
+            'kinds': kinds,
+            'disk_free_bytes': disk.free,
+        }
+
+
+def render_usage(usage: dict):
+    """Prometheus gauge lines for usage(), appended to the /metrics body."""
+    lines = [
+        '# HELP chromi_artifact_bytes Bytes held in the artifact work directory',
+        '# TYPE chromi_artifact_bytes gauge',
+    ]
+    lines += [f'chromi_artifact_bytes{{kind="{kind}"}} {values["bytes"]}' for kind, values in usage['kinds'].items()]
+    lines += [
+        '# HELP chromi_artifact_files Files held in the artifact work directory',
+        '# TYPE chromi_artifact_files gauge',
+    ]
+    lines += [f'chromi_artifact_files{{kind="{kind}"}} {values["files"]}' for kind, values in usage['kinds'].items()]
+    lines += [
+        '# HELP chromi_artifact_quota_bytes Configured artifact quota (0 = unlimited)',
+        '# TYPE chromi_artifact_quota_bytes gauge',
+        f'chromi_artifact_quota_bytes {usage["quota_bytes"]}',
+        '# HELP chromi_artifact_disk_free_bytes Free space on the artifact filesystem',
+        '# TYPE chromi_artifact_disk_free_bytes gauge',
+        f'chromi_artifact_disk_free_bytes {usage["disk_free_bytes"]}',
+    ]
+    return lines
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_artifact_manager() -> ArtifactManager:
+    """Return the process-wide artifact manager configured by the ARTIFACT_* settings."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            directory = getattr(settings, 'ARTIFACT_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-work')
+            _manager = ArtifactManager(
+                str(directory),
+                ttls={
+                    'uploads': getattr(settings, 'ARTIFACT_UPLOAD_TTL', 3600),
+                    'outputs': getattr(settings, 'ARTIFACT_OUTPUT_TTL', 1800),
+                    SESSIONS: getattr(settings, 'UPLOAD_SESSION_TTL', 3600),
+                },
+                quota_bytes=getattr(settings, 'ARTIFACT_QUOTA_BYTES', 1024 * 1024 * 1024),
+                grace=getattr(settings, 'ARTIFACT_GRACE_SECONDS', 60),
+                sweep_interval=getattr(settings, 'ARTIFACT_SWEEP_INTERVAL', 60),
+                session_dir=getattr(settings, 'UPLOAD_SESSION_DIR', None),
+            )
+        return _manager
+
+
+def create(kind: str, suffix: str = '') -> str:
+    return get_artifact_manager().create(kind, suffix)
+
+
+def temporary_file(kind: str, suffix: str = ''):
+    return get_artifact_manager().temporary_file(kind, suffix)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import platform
+import statistics
+import subprocess
+from dataclasses import dataclass, asdict
+from django.conf import settings
+from . import engine, probe
+
+logger = logging.getLogger(__name__)
+
+# Deterministic lavfi sources: a synthetic test card, a fractal zoom (busy, hard to
+# palette) and seeded noise (worst case for GIF compression)
+SOURCES = {
+    'testsrc2': 'testsrc2=size={size}:rate={rate}:duration={length}',
+    'mandelbrot': 'mandelbrot=size={size}:rate={rate},trim=duration={length}',
+    'noise': 'color=c=gray:size={size}:rate={rate}:duration={length},noise=alls=60:allf=t+u:all_seed=42',
+}
+
+# codec name -> (container extension, encoder arguments)
+CODECS = {
+    'h264': ('.mp4', ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-movflags', '+faststart']),
+    'hevc': ('.mp4', ['-c:v', 'libx265', '-preset', 'veryfast', '-crf', '28', '-tag:v', 'hvc1']),
+    'vp9': ('.webm', ['-c:v', 'libvpx-vp9', '-b:v', '1M', '-deadline', 'realtime', '-cpu-used', '8']),
+}
+
+DEFAULT_MATRIX = {
+    'sources': ['testsrc2', 'mandelbrot', 'noise'],
+    'codecs': ['h264', 'vp9'],
+    'resolutions': ['640x360', '1920x1080'],
+    'lengths': [10, 60],
+    'starts': [0, 30],
+}
+
+QUICK_MATRIX = {
+    'sources': ['testsrc2'],
+    'codecs': ['h264'],
+    'resolutions': ['640x360'],
+    'lengths': [10],
+    'starts': [0, 3],
+}
+
+
+@dataclass(frozen=True)
+class InputSpec:
+    source: str
+    codec: str
+    resolution: str
+    length: int
+    rate: int = 30
+
+    @property
+    def name(self) -> str:
+        return f'{self.source}-{self.codec}-{self.resolution}-{self.length}s'
+
+    @property
+    def extension(self) -> str:
+        return CODECS[self.codec][0]
+
+
+@dataclass(frozen=True)
+class Case:
+    input: InputSpec
+    start: int
+    engine: str
+
+    @property
+    def case_id(self) -> str:
+        # Stable across runs so reports can be diffed case by case
+        return f'{self.input.name}-start{self.start}-{self.engine}'
+
+
+def build_matrix(sources, codecs, resolutions, lengths, starts, engines):
+    """Every combination, minus trims that would start past the end of the input."""
+    cases = []
+    for source in sources:
+        for codec in codecs:
+            for resolution in resolutions:
+                for length in lengths:
+                    spec = InputSpec(source, codec, resolution, int(length))
+                    for start in starts:
+                        if int(start) >= spec.length:
+                            continue
+                        for engine_name in engines:
+                            cases.append(Case(spec, int(start), engine_name))
+    return cases
+
+
+def input_command(spec: InputSpec, output_path: str):
+    """ffmpeg command that renders spec bit-exactly, so every run converts identical bytes."""
+    _ext, encoder_args = CODECS[spec.codec]
+    graph = SOURCES[spec.source].format(size=spec.resolution, rate=spec.rate, length=spec.length)
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', graph,
+        *encoder_args,
+        '-pix_fmt', 'yuv420p',
+        '-g', str(spec.rate * 2),   # Fixed keyframe interval: seeks cost the same every run
+        '-threads', '1',            # Single-threaded encoders are deterministic
+        '-fflags', '+bitexact', '-flags:v', '+bitexact',
+        '-y', output_path,
+    ]
+
+
+def ensure_input(spec: InputSpec, directory: str) -> str:
+    """Generate (once) and return the input video for spec."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, spec.name + spec.extension)
+    if not os.path.exists(path):
+        tmp = path + '.part' + spec.extension
+        subprocess.run(input_command(spec, tmp), check=True, capture_output=True)
+        os.replace(tmp, path)
+    return path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def measure_once(case: Case, input_path: str, output_path: str) -> dict:
+    """
+    Convert in a forked child and reap it with os.wait4: CPU time and peak RSS then
+    cover exactly this conversion, including ffmpeg and any other grandchildren.
+    """
+    read_fd, write_fd = os.pipe()
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = {'ok': True}
+        try:
+            _info, plan = probe.preflight(input_path, case.start, engine.CHROME_GIF_DURATION)
+            engine.BACKENDS[case.engine]().convert(input_path, output_path, plan.start, plan.duration)
+        except Exception as exc:
+            status = {'ok': False, 'error': str(exc)[:500]}
+        os.write(write_fd, json.dumps(status).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        status = json.loads(pipe.read() or b'{"ok": false, "error": "child crashed"}')
+    _pid, _status, rusage = os.wait4(pid, 0)
+    wall = time.monotonic() - started
+    result = {
+        'wall_seconds': wall,
+        'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+        # Linux reports ru_maxrss in KiB
+        'peak_rss_bytes': rusage.ru_maxrss * 1024,
+        'gif_bytes': os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+    }
+    result.update(status)
+    return result
+
+
+def run_case(case: Case, input_path: str, work_dir: str, repeat: int = 3) -> dict:
+    """Run a case repeat times; report medians, plus the spread of wall time."""
+    output_path = os.path.join(work_dir, case.case_id + '.gif')
+    runs = []
+    for _run in range(repeat):
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        runs.append(measure_once(case, input_path, output_path))
+        if not runs[-1]['ok']:
+            break
+
+    report = {'id': case.case_id, 'input': asdict(case.input), 'start': case.start, 'engine': case.engine,
+              'runs': len(runs), 'ok': all(run['ok'] for run in runs)}
+    if not report['ok']:
+        report['error'] = next(run['error'] for run in runs if not run['ok'])
+        return report
+    for key in ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'gif_bytes'):
+        report[key] = statistics.median(run[key] for run in runs)
+    walls = [run['wall_seconds'] for run in runs]
+    report['wall_seconds_min'] = min(walls)
+    report['wall_seconds_max'] = max(walls)
+    # Same input and settings must give the same GIF; a changed hash flags an output change
+    report['gif_sha256'] = file_sha256(output_path)
+    os.remove(output_path)
+    return report
+
+
+def environment() -> dict:
+    ffmpeg_version = ''
+    if shutil.which('ffmpeg'):
+        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+        ffmpeg_version = result.stdout.splitlines()[0] if result.stdout else ''
+    width, height, fps = engine.output_params()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+        'gif': {'width': width, 'height': height, 'fps': fps},
+        'conversion_timeout': getattr(settings, 'CONVERSION_TIMEOUT', 120),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10):
+    """
+    Return one dict per metric that got worse than baseline by more than threshold
+    (a fraction), matching cases by id. Cases missing from either report are skipped.
+    """
+    previous = {case['id']: case for case in baseline.get('cases', []) if case.get('ok')}
+    regressions = []
+    for case in current.get('cases', []):
+        before = previous.get(case['id'])
+        if before is None or not case.get('ok'):
+            continue
+        for metric in ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'gif_bytes'):
+            old, new = before.get(metric), case.get(metric)
+            if old and new is not None and (new - old) / old > threshold:
+                regressions.append({'id': case['id'], 'metric': metric, 'baseline': old, 'current': new,
+                                    'change': round((new - old) / old, 4)})
+    return regressions
@@ -0,0 +1,257 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import tempfile
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from . import artifact_storage, metrics
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RangeFile:
+    """
+    Read-only view of [start, start + length) of an open file. It keeps fileno() so
+    gunicorn can still hand the range to os.sendfile, and has no tell()/seek() so
+    Django does not try to size it (we set Content-Length ourselves).
+    """
+
+    def __init__(self, fileobj, start: int, length: int):
+        fileobj.seek(start)
+        self._file = fileobj
+        self._remaining = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class ArtifactResponse(FileResponse):
+    """FileResponse that runs a callback once the server has finished sending it."""
+
+    def __init__(self, *args, on_close=None, **kwargs):
+        self.on_close = on_close
+        super().__init__(*args, **kwargs)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class AsyncArtifactResponse(StreamingHttpResponse):
+    """
+    Streams [start, start + length) of an open file descriptor to ASGI servers. Reads
+    go through a worker thread one chunk at a time, so a slow client only holds a
+    coroutine rather than a thread. The descriptor is closed and on_close run when
+    the server closes the response, including after a disconnect.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, fd: int, start: int, length: int, *args, on_close=None, **kwargs):
+        self.fd = fd
+        self.on_close = on_close
+        super().__init__(self._read_chunks(start, length), *args, **kwargs)
+        self['Content-Length'] = str(length)
+
+    async def _read_chunks(self, offset: int, remaining: int):
+        while remaining > 0:
+            data = await asyncio.to_thread(os.pread, self.fd, min(self.chunk_size, remaining), offset)
+            if not data:
+                break
+            offset += len(data)
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            fd, self.fd = self.fd, None
+            if fd is not None:
+                os.close(fd)
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+def make_etag(stat_result) -> str:
+    return quote_etag(f'{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}')
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single-range 'bytes=' header into (start, end) inclusive.
+    Returns None to serve the whole file, or 'unsatisfiable'.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+
+def is_not_modified(request, etag: str, mtime: float) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def requested_range(request, stat_result):
+    """Return the byte range to serve honouring If-Range, or None for the full file."""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range.strip() != make_etag(stat_result):
+        # The client's copy is stale: send the whole thing
+        return None
+    return parse_range(header, stat_result.st_size)
+
+
+def offload_response(path: str, filename: str, content_type: str, mode: str):
+    """Let the front proxy send the bytes (nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile)."""
+    response = HttpResponse(content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if mode == 'x-accel-redirect':
+        root = str(getattr(settings, 'DOWNLOAD_OFFLOAD_ROOT', None) or tempfile.gettempdir())
+        prefix = getattr(settings, 'DOWNLOAD_OFFLOAD_PREFIX', '/protected-downloads/')
+        relative = os.path.relpath(path, root)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative.replace(os.sep, '/')
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def schedule_removal(path: str):
+    """
+    Delete an offloaded file after DOWNLOAD_OFFLOAD_GRACE. The proxy opens the file as
+    soon as it sees the redirect header, and an unlinked file stays readable while
+    open. The delete is a record under ARTIFACT_DIR/discards/, so a worker that exits
+    first does not leak the file; the next offload or `sweep_artifacts` removes it.
+    """
+    artifact_storage.get_artifact_storage().schedule_discard(path)
+
+
+def delivers_final_byte(request, path: str) -> bool:
+    """
+    True when serve_file() would send the last byte of path: a full GET, or a range
+    that runs to the end. HEAD, 304/416 and mid-file ranges leave the file in place
+    so a one-time token is only consumed by the request that completes delivery.
+    """
+    if request.method == 'HEAD':
+        return False
+    stat_result = os.stat(path)
+    if is_not_modified(request, make_etag(stat_result), stat_result.st_mtime):
+        return False
+    byte_range = requested_range(request, stat_result)
+    if byte_range == 'unsatisfiable':
+        return False
+    return byte_range is None or byte_range[1] >= stat_result.st_size - 1
+
+
+def serve_file(request, path: str, filename: str, content_type: str = 'application/octet-stream', on_complete=None,
+               asynchronous: bool = False):
+    """
+    Serve path zero-copy: FileResponse lets the WSGI server use os.sendfile, single
+    byte ranges and conditional requests are honoured, and on_complete runs after
+    the server has finished sending the body. With asynchronous=True the body is an
+    async stream for ASGI servers, which cannot sendfile.
+    """
+    stat_result = os.stat(path)
+    etag = make_etag(stat_result)
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = requested_range(request, stat_result)
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat_result.st_size}'
+        return response
+
+    length = stat_result.st_size if byte_range is None else byte_range[1] - byte_range[0] + 1
+    on_complete = _timed(on_complete, length)
+    if asynchronous:
+        start, end = byte_range if byte_range is not None else (0, stat_result.st_size - 1)
+        response = AsyncArtifactResponse(os.open(path, os.O_RDONLY), start, end - start + 1,
+                                         content_type=content_type, status=200 if byte_range is None else 206,
+                                         on_close=on_complete)
+        if byte_range is not None:
+            response['Content-Range'] = f'bytes {start}-{end}/{stat_result.st_size}'
+    else:
+        response = _sync_file_response(path, byte_range, stat_result.st_size, content_type, on_complete)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat_result.st_mtime)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _timed(on_complete, length: int):
+    """Wrap on_complete so the download duration is recorded when the response closes."""
+    started = time.monotonic()
+
+    def done():
+        metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='download')
+        metrics.observe('chromi_download_bytes', length)
+        if on_complete is not None:
+            on_complete()
+    return done
+
+
+def _sync_file_response(path: str, byte_range, size: int, content_type: str, on_complete):
+    fileobj = open(path, 'rb')
+    if byte_range is None:
+        response = ArtifactResponse(fileobj, content_type=content_type, on_close=on_complete)
+    else:
+        start, end = byte_range
+        response = ArtifactResponse(RangeFile(fileobj, start, end - start + 1), content_type=content_type,
+                                    status=206, on_close=on_complete)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    return response
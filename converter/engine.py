@@ -0,0 +1,922 @@
+import os
+import time
+import signal
+import asyncio
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import importlib
+from dataclasses import dataclass
+from django.conf import settings
+from . import admission, artifacts, gif, governor, metrics, probe, sizing
+
+logger = logging.getLogger(__name__)
+
+
+# Chrome requires background GIFs to be exactly this long
+CHROME_GIF_DURATION = 6
+
+
+class ConversionError(Exception):
+    """Raised when a backend cannot produce a GIF from the given input."""
+
+
+def output_params():
+    """Return the (width, height, fps) every backend encodes at."""
+    return (
+        getattr(settings, 'GIF_WIDTH', 640),
+        getattr(settings, 'GIF_HEIGHT', 360),
+        getattr(settings, 'GIF_FPS', 15),
+    )
+
+
+# Output presets for batch clips; 'chrome' is the GIF_WIDTH/GIF_HEIGHT/GIF_FPS default.
+# settings.CONVERSION_PRESETS replaces this table; missing keys fall back to the defaults.
+PRESETS = {
+    'chrome': {},
+    'small': {'width': 480, 'height': 270, 'fps': 12},
+    'hd': {'width': 1280, 'height': 720, 'fps': 15},
+}
+
+
+def presets() -> dict:
+    return getattr(settings, 'CONVERSION_PRESETS', None) or PRESETS
+
+
+def preset_params(name: str):
+    """Return the (width, height, fps) of a named preset."""
+    table = presets()
+    if name not in table:
+        raise ConversionError(f"Unknown preset: {name}")
+    width, height, fps = output_params()
+    preset = table[name]
+    return preset.get('width', width), preset.get('height', height), preset.get('fps', fps)
+
+
+@dataclass(frozen=True)
+class Clip:
+    """One GIF of a batch: a trim of the shared source, encoded with a preset."""
+    start: float
+    duration: float
+    preset: str = 'chrome'
+
+
+def group_clips(clips, max_gap: float):
+    """
+    Split clips into runs worth decoding together: sorted by start, a clip joins the
+    current group unless it begins more than max_gap seconds after the group ends
+    (decoding the gap would cost more than a second seek). Returns lists of indexes.
+    """
+    groups = []
+    end = None
+    for index in sorted(range(len(clips)), key=lambda i: clips[i].start):
+        clip = clips[index]
+        if groups and clip.start <= end + max_gap:
+            groups[-1].append(index)
+            end = max(end, clip.start + clip.duration)
+        else:
+            groups.append([index])
+            end = clip.start + clip.duration
+    return groups
+
+
+def _parse_seconds(value: str):
+    try:
+        return int(value) / 1_000_000
+    except (TypeError, ValueError):
+        return None
+
+
+def _ffmpeg_error(returncode: int, stderr: str) -> ConversionError:
+    """The ConversionError for a failed ffmpeg run, naming the governor limit that stopped it, if any."""
+    reason = governor.check_exit(returncode, stderr)
+    if reason is not None:
+        return ConversionError(f"FFmpeg exceeded its {reason} limit (return code {returncode})")
+    return ConversionError(f"FFmpeg failed with return code {returncode}: {stderr}")
+
+
+class ProgressParser:
+    """
+    Incremental parser for ffmpeg `-progress` key=value lines. feed() returns one
+    dict per completed report block: frame, fps, speed (x realtime), out_time
+    (seconds), percent and done. While palettegen is still consuming the input no
+    frame has been written yet, which is reported as phase 'palette' rather than 0%.
+    """
+
+    def __init__(self, duration: float = None):
+        self.duration = duration
+        self.block = {}
+
+    def feed(self, line):
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        if key != 'progress':
+            self.block[key] = value
+            return None
+
+        block, self.block = self.block, {}
+        frame = int(block.get('frame') or 0)
+        out_time = _parse_seconds(block.get('out_time_us') or block.get('out_time_ms')) or 0.0
+        speed = block.get('speed', '').rstrip('x').strip()
+        report = {
+            'phase': 'encoding' if frame else 'palette',
+            'frame': frame,
+            'fps': float(block.get('fps') or 0),
+            'speed': float(speed) if speed and speed != 'N/A' else None,
+            'out_time': round(out_time, 3),
+            'done': value == 'end',
+        }
+        if self.duration:
+            report['percent'] = 100.0 if report['done'] else round(min(99.9, out_time / self.duration * 100), 1)
+        return report
+
+
+def parse_progress(lines, duration: float = None):
+    """Yield a ProgressParser report for each complete block in lines."""
+    parser = ProgressParser(duration)
+    for line in lines:
+        report = parser.feed(line)
+        if report is not None:
+            yield report
+
+
+class ConversionBackend:
+    """Interface for turning a trimmed segment of a video into a looping GIF."""
+
+    name = ''
+
+    def is_available(self) -> bool:
+        raise NotImplementedError
+
+    def wanted_threads(self) -> int:
+        """Cores the backend can keep busy beyond one admission slot's share, or 0."""
+        return 0
+
+    def convert(self, input_path: str, output_path: str, start_seconds: int, duration: int, progress=None,
+                threads: int = None, encoding: sizing.Encoding = None):
+        """
+        Encode the GIF. progress, if given, is called with parse_progress() dicts;
+        threads is the CPU budget admission control granted this job; encoding
+        overrides fps and palette settings (target-size mode).
+        """
+        raise NotImplementedError
+
+
+class FFmpegBackend(ConversionBackend):
+    """
+    Streaming ffmpeg pipeline: decode, scale and palettegen/paletteuse happen inside
+    a single ffmpeg process, so no frames are ever held in Python memory.
+    """
+
+    name = 'ffmpeg'
+
+    def is_available(self) -> bool:
+        return shutil.which('ffmpeg') is not None
+
+    def build_command(self, input_path: str, output_path: str, start_seconds: float, duration: float,
+                      threads: int = None, encoding: sizing.Encoding = None):
+        width, height, fps = output_params()
+        encoding = encoding or sizing.Encoding(fps)
+        cmd = [
+            'ffmpeg',
+            '-nostats',
+            '-progress', 'pipe:1',      # Machine-readable key=value progress on stdout
+        ]
+        if threads:
+            # Stay within the cores admission control granted; ffmpeg defaults to all of them
+            cmd += ['-filter_threads', str(threads), '-threads', str(threads)]
+        return cmd + [
+            '-ss', str(start_seconds),  # Input-side seek: demuxer jumps to the preceding keyframe
+            '-i', input_path,
+            '-t', str(duration),        # Duration in seconds
+            '-vf', f'fps={encoding.fps},scale={width}:{height}:flags=lanczos,split[s0][s1];'
+                   f'[s0]{encoding.palettegen}[p];[s1][p]{encoding.paletteuse}',
+            '-loop', '0',               # Loop forever (Chrome requirement)
+            '-y',                       # Overwrite output file
+            output_path
+        ]
+
+    def convert(self, input_path: str, output_path: str, start_seconds: float, duration: float, progress=None,
+                threads: int = None, encoding: sizing.Encoding = None):
+        if not self.is_available():
+            raise ConversionError("FFmpeg not found on system")
+
+        cmd = self.build_command(input_path, output_path, start_seconds, duration, threads=threads, encoding=encoding)
+        self._run(cmd, os.path.dirname(input_path), duration, progress, threads=threads)
+
+    def build_batch_command(self, input_path: str, clips, output_paths, threads: int = None):
+        """
+        One ffmpeg run for several clips: the span covering them is decoded once, then
+        split into a trim, scale and palettegen/paletteuse chain per clip, each mapped
+        to its own output.
+        """
+        origin = min(clip.start for clip in clips)
+        span = max(clip.start + clip.duration for clip in clips) - origin
+        chains = [f'[0:v]split={len(clips)}' + ''.join(f'[in{index}]' for index in range(len(clips)))]
+        for index, clip in enumerate(clips):
+            width, height, fps = preset_params(clip.preset)
+            chains.append(
+                f'[in{index}]trim=start={clip.start - origin:.3f}:duration={clip.duration:.3f},setpts=PTS-STARTPTS,'
+                f'fps={fps},scale={width}:{height}:flags=lanczos,split[a{index}][b{index}];'
+                f'[a{index}]palettegen[p{index}];[b{index}][p{index}]paletteuse[out{index}]'
+            )
+        cmd = ['ffmpeg', '-nostats', '-progress', 'pipe:1']
+        if threads:
+            cmd += ['-filter_threads', str(threads), '-threads', str(threads)]
+        cmd += [
+            '-ss', str(origin),
+            '-t', str(span),            # Input option: nothing past the last clip is decoded
+            '-i', input_path,
+            '-filter_complex', ';'.join(chains),
+        ]
+        for index, path in enumerate(output_paths):
+            cmd += ['-map', f'[out{index}]', '-loop', '0', '-y', path]
+        return cmd
+
+    def convert_batch(self, input_path: str, clips, output_paths, progress=None, threads: int = None):
+        """Encode every clip from one decode of the span they cover."""
+        if not self.is_available():
+            raise ConversionError("FFmpeg not found on system")
+        span = max(clip.start + clip.duration for clip in clips) - min(clip.start for clip in clips)
+        cmd = self.build_batch_command(input_path, clips, output_paths, threads=threads)
+        self._run(cmd, os.path.dirname(input_path), span, progress, threads=threads)
+
+    def _run(self, cmd, cwd: str, duration: float, progress=None, threads: int = None):
+        """
+        Run one ffmpeg command under the conversion timeout and the resource governor,
+        relaying its progress.
+        """
+        timeout = getattr(settings, 'CONVERSION_TIMEOUT', 120)
+        logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+
+        # stderr goes to a file so it can never fill up and stall ffmpeg while we read stdout
+        with tempfile.TemporaryFile() as stderr_file:
+            with governor.Governed(cmd, timeout, threads, stdout=subprocess.PIPE, stderr=stderr_file,
+                                   cwd=cwd) as governed:
+                started = time.monotonic()
+                last = None
+                for last in parse_progress(governed.process.stdout, duration):
+                    if progress is not None:
+                        progress(last)
+                returncode = governed.wait()
+                metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='ffmpeg')
+
+            if governed.timed_out:
+                logger.error("FFmpeg conversion timed out")
+                raise ConversionError(f"Video conversion timed out after {timeout} seconds")
+            if returncode != 0:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode(errors='replace')
+                logger.error(f"FFmpeg stderr: {stderr}")
+                raise _ffmpeg_error(returncode, stderr)
+
+        if last is not None:
+            speed = f"{last['speed']}x" if last.get('speed') is not None else 'n/a'
+            logger.info(f"FFmpeg encoded {last['frame']} frames in {time.monotonic() - started:.2f}s "
+                        f"({last['fps']} fps, {speed} realtime)")
+        return last
+
+    async def convert_async(self, input_path: str, output_path: str, start_seconds: float, duration: float,
+                            progress=None, threads: int = None, encoding: sizing.Encoding = None):
+        """
+        convert() for the event loop: no thread is held while ffmpeg runs. If the
+        awaiting task is cancelled (e.g. the client disconnected) ffmpeg is killed.
+        """
+        if not self.is_available():
+            raise ConversionError("FFmpeg not found on system")
+
+        timeout = getattr(settings, 'CONVERSION_TIMEOUT', 120)
+        cmd = self.build_command(input_path, output_path, start_seconds, duration, threads=threads, encoding=encoding)
+        logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+
+        with tempfile.TemporaryFile() as stderr_file:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file,
+                cwd=os.path.dirname(input_path)
+            )
+            governor.govern(process.pid, threads)
+            parser = ProgressParser(duration)
+            started = time.monotonic()
+            sample = None
+
+            async def pump():
+                nonlocal sample
+                async for line in process.stdout:
+                    report = parser.feed(line)
+                    if report is None:
+                        continue
+                    # asyncio reaps the child itself, so sample CPU and peak RSS while it runs
+                    sample = metrics.sample_process(process.pid) or sample
+                    if progress is not None:
+                        progress(report)
+                return await process.wait()
+
+            try:
+                returncode = await asyncio.wait_for(pump(), timeout)
+            except asyncio.TimeoutError:
+                logger.error("FFmpeg conversion timed out")
+                metrics.inc('chromi_ffmpeg_limited_total', reason='timeout')
+                await governor.stop_async(process)
+                raise ConversionError(f"Video conversion timed out after {timeout} seconds")
+            except asyncio.CancelledError:
+                logger.info(f"Conversion of {input_path} cancelled, stopping ffmpeg")
+                raise
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+            metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='ffmpeg')
+            if sample is not None:
+                metrics.observe('chromi_ffmpeg_cpu_seconds', sample[0])
+                metrics.observe('chromi_ffmpeg_peak_rss_bytes', sample[1])
+            if returncode != 0:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode(errors='replace')
+                logger.error(f"FFmpeg stderr: {stderr}")
+                raise _ffmpeg_error(returncode, stderr)
+
+
+class StreamingConversion:
+    """
+    ffmpeg reading the source video from stdin, so encoding overlaps the upload and
+    the source never touches disk. Only valid for containers that can be decoded
+    from a pipe (WebM, or MP4/MOV with the moov atom first).
+    """
+
+    def __init__(self, start_seconds: float, duration: float, slot: admission.Slot = None):
+        self.output_path = artifacts.create('outputs', '.gif')
+        # The admission slot is held until ffmpeg exits (wait() or abort())
+        self.slot = slot
+        # stderr goes to a file: a full stderr pipe would block ffmpeg while we block on stdin
+        self._stderr = tempfile.TemporaryFile()
+        threads = slot.threads if slot is not None else None
+        cmd = FFmpegBackend().build_command('pipe:0', self.output_path, start_seconds, duration, threads=threads)
+        logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+        governor.govern(self.process.pid, threads)
+        self.started = time.monotonic()
+        self._input_open = True
+
+    def write(self, data: bytes):
+        if not self._input_open:
+            return
+        try:
+            self.process.stdin.write(data)
+        except BrokenPipeError:
+            # ffmpeg has read everything it needs for the trim (or failed); wait() tells which
+            self._input_open = False
+
+    def close_input(self):
+        if self._input_open:
+            self._input_open = False
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def wait(self):
+        """Wait for ffmpeg to finish and validate the GIF it wrote."""
+        self.close_input()
+        timeout = getattr(settings, 'CONVERSION_TIMEOUT', 120)
+        try:
+            returncode = self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            metrics.inc('chromi_ffmpeg_limited_total', reason='timeout')
+            governor.stop(self.process)
+            self.abort()
+            raise ConversionError(f"Video conversion timed out after {timeout} seconds")
+        # Spans the upload too, since ffmpeg was reading it as it arrived
+        metrics.observe('chromi_stage_seconds', time.monotonic() - self.started, stage='ffmpeg_stream')
+
+        try:
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode(errors='replace')
+            self._stderr.close()
+            if returncode != 0:
+                logger.error(f"FFmpeg stderr: {stderr}")
+                raise _ffmpeg_error(returncode, stderr)
+            if not os.path.exists(self.output_path) or os.path.getsize(self.output_path) == 0:
+                raise ConversionError("Conversion did not create a valid output file")
+            # The optimizer's decode and LZW pass still count against the admission slot
+            post_process(self.output_path, threads=self.slot.threads if self.slot is not None else None)
+        finally:
+            self._release_slot()
+        metrics.observe('chromi_output_bytes', os.path.getsize(self.output_path))
+        metrics.inc('chromi_conversions_total', outcome='ok')
+        logger.info(f"ffmpeg streaming conversion successful. Output file size: {os.path.getsize(self.output_path)} bytes")
+        return self.output_path
+
+    def _release_slot(self):
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+
+    def abort(self):
+        self._input_open = False
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self._release_slot()
+        try:
+            self._stderr.close()
+        except Exception:
+            pass
+
+    def discard_output(self):
+        try:
+            os.remove(self.output_path)
+        except OSError:
+            pass
+
+
+class SegmentedFFmpegBackend(ConversionBackend):
+    """
+    Multi-core ffmpeg encode. One fast palettegen pass samples the whole clip, then
+    time slices are encoded by parallel ffmpeg processes that all map onto that
+    shared palette. gif.stitch() joins the slices into one looping GIF without
+    re-encoding. The colours match across seams because every slice uses the same
+    palette, and frame timing matches because each slice is cut on exact frame counts.
+    """
+
+    name = 'ffmpeg_segmented'
+
+    def is_available(self) -> bool:
+        return shutil.which('ffmpeg') is not None
+
+    def wanted_threads(self) -> int:
+        # With one thread per slot (the default) a single slot could never be sliced
+        return getattr(settings, 'SEGMENTED_ENCODE_SEGMENTS', 0) or admission.cpu_budget()
+
+    def plan_segments(self, duration: float, threads: int = None, fps: int = None):
+        """
+        Return [(first_frame, frame_count)] slices: SEGMENTED_ENCODE_SEGMENTS or one per
+        granted core, never more slices than cores and none shorter than the minimum.
+        """
+        fps = fps or output_params()[2]
+        total = max(1, round(duration * fps))
+        granted = threads or admission.cpu_budget()
+        count = min(getattr(settings, 'SEGMENTED_ENCODE_SEGMENTS', 0) or granted, granted)
+        min_frames = max(1, round(getattr(settings, 'SEGMENTED_MIN_SEGMENT_SECONDS', 1) * fps))
+        count = max(1, min(count, total // min_frames))
+        bounds = [total * index // count for index in range(count + 1)]
+        return [(bounds[index], bounds[index + 1] - bounds[index]) for index in range(count)]
+
+    def palette_command(self, input_path: str, palette_path: str, start_seconds: float, duration: float,
+                        threads: int = None, encoding: sizing.Encoding = None):
+        width, height, fps = output_params()
+        encoding = encoding or sizing.Encoding(fps)
+        # A handful of frames per second is plenty to find the clip's colours
+        sample_fps = min(encoding.fps, getattr(settings, 'SEGMENTED_PALETTE_FPS', 5))
+        cmd = ['ffmpeg', '-nostats', '-progress', 'pipe:1']
+        if threads:
+            cmd += ['-threads', str(threads)]
+        return cmd + [
+            '-ss', str(start_seconds),
+            '-i', input_path,
+            '-t', str(duration),
+            '-vf', f'fps={sample_fps},scale={width}:{height}:flags=lanczos,{encoding.palettegen}',
+            '-frames:v', '1', '-update', '1',
+            '-y', palette_path,
+        ]
+
+    def segment_command(self, input_path: str, palette_path: str, output_path: str, start_seconds: float,
+                        first_frame: int, frame_count: int, threads: int = 1, encoding: sizing.Encoding = None):
+        width, height, fps = output_params()
+        encoding = encoding or sizing.Encoding(fps)
+        return [
+            'ffmpeg', '-nostats', '-progress', 'pipe:1',
+            '-filter_threads', str(threads), '-threads', str(threads),
+            '-ss', str(start_seconds + first_frame / encoding.fps),
+            '-i', input_path,
+            '-i', palette_path,
+            '-lavfi', f'[0:v]fps={encoding.fps},scale={width}:{height}:flags=lanczos[v];[v][1:v]{encoding.paletteuse}',
+            '-frames:v', str(frame_count),  # Exact slice length, so the stitched GIF has every frame once
+            '-loop', '0',
+            '-y', output_path,
+        ]
+
+    def _run_parallel(self, commands, cwd: str, deadline: float, on_report=None, threads: int = None):
+        """
+        Run ffmpeg commands concurrently, each governed with threads cores;
+        on_report(index, report) receives each one's progress. A failure or the
+        deadline stops all of them.
+        """
+        processes = []
+        stderr_files = []
+        readers = []
+
+        def kill_all():
+            for process in processes:
+                if process.returncode is None:
+                    try:
+                        os.kill(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+        def pump(index, process):
+            for report in parse_progress(process.stdout):
+                if on_report is not None:
+                    on_report(index, report)
+
+        watchdog = governor.Watchdog(deadline - time.monotonic())
+        failure = None
+        try:
+            for index, cmd in enumerate(commands):
+                logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+                stderr_files.append(tempfile.TemporaryFile())
+                processes.append(subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                                  stderr=stderr_files[-1], cwd=cwd))
+                governor.govern(processes[-1].pid, threads)
+                watchdog.watch(processes[-1])
+                readers.append(threading.Thread(target=pump, args=(index, processes[-1]), daemon=True))
+                readers[-1].start()
+            watchdog.start()
+            for index, process in enumerate(processes):
+                returncode = governor.reap(process)
+                if returncode != 0 and failure is None:
+                    failure = index
+                    kill_all()
+            for reader in readers:
+                reader.join()
+        finally:
+            watchdog.cancel()
+            kill_all()
+            for process in processes:
+                if process.returncode is None:
+                    process.wait()
+                process.stdout.close()
+
+            if watchdog.expired.is_set():
+                logger.error("FFmpeg conversion timed out")
+            elif failure is not None:
+                stderr_files[failure].seek(0)
+                stderr = stderr_files[failure].read().decode(errors='replace')
+            for stderr_file in stderr_files:
+                stderr_file.close()
+
+        if watchdog.expired.is_set():
+            raise ConversionError(f"Video conversion timed out after {getattr(settings, 'CONVERSION_TIMEOUT', 120)} seconds")
+        if failure is not None:
+            logger.error(f"FFmpeg stderr: {stderr}")
+            raise _ffmpeg_error(processes[failure].returncode, stderr)
+
+    def convert(self, input_path: str, output_path: str, start_seconds: float, duration: float, progress=None,
+                threads: int = None, encoding: sizing.Encoding = None):
+        if not self.is_available():
+            raise ConversionError("FFmpeg not found on system")
+
+        encoding = encoding or sizing.Encoding(output_params()[2])
+        fps = encoding.fps
+        deadline = time.monotonic() + getattr(settings, 'CONVERSION_TIMEOUT', 120)
+        segments = self.plan_segments(duration, threads, fps)
+        if len(segments) < 2:
+            # One slice would only add a palette pass in front of the plain encode
+            logger.info(f"Segmented FFmpeg: a single slice ({threads or 'all'} thread(s) granted), "
+                        f"encoding with the plain ffmpeg backend")
+            return FFmpegBackend().convert(input_path, output_path, start_seconds, duration, progress=progress,
+                                           threads=threads, encoding=encoding)
+        total_frames = sum(count for _first, count in segments)
+        threads_per_segment = max(1, (threads or admission.cpu_budget()) // len(segments))
+        cwd = os.path.dirname(input_path)
+
+        with tempfile.TemporaryDirectory(prefix='chromi-segments-') as work_dir:
+            palette_path = os.path.join(work_dir, 'palette.png')
+            started = time.monotonic()
+            palette_progress = None
+            if progress is not None:
+                def palette_progress(_index, report):
+                    progress(dict(report, phase='palette', frame=0, percent=0.0, done=False))
+            self._run_parallel([self.palette_command(input_path, palette_path, start_seconds, duration, threads,
+                                                     encoding)],
+                               cwd, deadline, palette_progress, threads=threads)
+            metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='ffmpeg_palette')
+
+            started = time.monotonic()
+            frames = [0] * len(segments)
+            lock = threading.Lock()
+
+            def segment_progress(index, report):
+                with lock:
+                    frames[index] = min(report['frame'], segments[index][1])
+                    done = sum(frames)
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    progress({
+                        'phase': 'encoding',
+                        'frame': done,
+                        'fps': round(done / elapsed, 2),
+                        'speed': round(done / fps / elapsed, 3),
+                        'out_time': round(done / fps, 3),
+                        'done': False,
+                        'percent': round(min(99.9, done / total_frames * 100), 1),
+                    })
+
+            parts = [os.path.join(work_dir, f'part-{index:03d}.gif') for index in range(len(segments))]
+            self._run_parallel(
+                [self.segment_command(input_path, palette_path, part, start_seconds, first, count, threads_per_segment,
+                                      encoding)
+                 for part, (first, count) in zip(parts, segments)],
+                cwd, deadline, segment_progress if progress is not None else None, threads=threads_per_segment,
+            )
+            metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='ffmpeg_segments')
+
+            with metrics.stage('gif_stitch'):
+                try:
+                    frame_count = gif.stitch(parts, output_path)
+                except (OSError, gif.GifError) as exc:
+                    raise ConversionError(f"Could not stitch GIF segments: {exc}")
+
+        if progress is not None:
+            progress({'phase': 'encoding', 'frame': frame_count, 'fps': 0.0, 'speed': None,
+                      'out_time': round(frame_count / fps, 3), 'done': True, 'percent': 100.0})
+        logger.info(f"Segmented FFmpeg encoded {frame_count} frames in {len(segments)} slice(s) "
+                    f"with {threads_per_segment} thread(s) each")
+
+
+class MoviePyBackend(ConversionBackend):
+    """
+    Fallback for hosts without an ffmpeg binary on PATH. MoviePy decodes frames into
+    NumPy arrays, so it is slower and far more memory hungry than FFmpegBackend.
+    """
+
+    name = 'moviepy'
+
+    def is_available(self) -> bool:
+        try:
+            importlib.import_module('moviepy.editor')
+        except Exception:
+            return False
+        return True
+
+    def convert(self, input_path: str, output_path: str, start_seconds: int, duration: int, progress=None,
+                threads: int = None, encoding: sizing.Encoding = None):
+        # MoviePy has no incremental progress hook worth exposing; callers only see the end
+        try:
+            editor = importlib.import_module('moviepy.editor')
+        except Exception as exc:
+            raise ConversionError("MoviePy not available") from exc
+
+        width, height, fps = output_params()
+        if encoding is not None:
+            # Palette knobs are ffmpeg filters; MoviePy can only honour the frame rate
+            fps = encoding.fps
+        video = None
+        trimmed_video = None
+        try:
+            video = editor.VideoFileClip(input_path, audio=False)
+
+            if start_seconds >= video.duration:
+                raise ConversionError('Start time exceeds video duration')
+
+            end_seconds = min(start_seconds + duration, video.duration)
+            # Trim first and downscale early to keep decoded frames small
+            trimmed_video = video.subclip(start_seconds, end_seconds)
+            trimmed_video = trimmed_video.resize(newsize=(width, height))
+            trimmed_video.write_gif(output_path, fps=fps, program='ffmpeg', logger=None)
+        finally:
+            try:
+                if trimmed_video is not None:
+                    trimmed_video.close()
+            except Exception:
+                pass
+            try:
+                if video is not None:
+                    video.close()
+            except Exception:
+                pass
+
+
+BACKENDS = {
+    FFmpegBackend.name: FFmpegBackend,
+    SegmentedFFmpegBackend.name: SegmentedFFmpegBackend,
+    MoviePyBackend.name: MoviePyBackend,
+}
+
+
+def get_backend(name: str = None) -> ConversionBackend:
+    """Return the configured backend, or the fallback when the primary one is unavailable."""
+    name = name or getattr(settings, 'CONVERSION_BACKEND', FFmpegBackend.name)
+    if name not in BACKENDS:
+        raise ConversionError(f"Unknown conversion backend: {name}")
+    backend = BACKENDS[name]()
+    if backend.is_available():
+        return backend
+
+    fallback_name = getattr(settings, 'CONVERSION_FALLBACK_BACKEND', MoviePyBackend.name)
+    if fallback_name and fallback_name != name and fallback_name in BACKENDS:
+        fallback = BACKENDS[fallback_name]()
+        if fallback.is_available():
+            logger.warning(f"Conversion backend '{name}' unavailable, falling back to '{fallback_name}'")
+            return fallback
+    return backend
+
+
+def post_process(output_path: str, threads: int = None):
+    """
+    Optional GIF_OPTIMIZE stage after a successful encode: crop frames to what changed
+    and reuse transparency (gifopt). Callers run it inside the conversion's admission
+    slot. Never fails a conversion; the encoder's GIF is kept.
+    """
+    if not getattr(settings, 'GIF_OPTIMIZE', False):
+        return None
+    try:
+        # NumPy is only imported once a stage that needs it is switched on
+        gifopt = importlib.import_module('converter.gifopt')
+        with metrics.stage('gif_optimize'):
+            return gifopt.optimize(output_path, threads=threads)
+    except Exception as exc:
+        logger.warning(f"GIF optimization skipped: {exc}")
+        return None
+
+
+def plan_loop(input_path: str, start_seconds: float, duration: float, info: probe.VideoInfo = None,
+              fps: int = None, threads: int = None) -> float:
+    """
+    With LOOP_SEARCH on, the trim length nearest duration whose end flows back into
+    its first frame (looping.find_loop_duration). Like post_process() it never fails a
+    conversion: without ffmpeg, or if the search fails, duration is kept.
+    """
+    if not getattr(settings, 'LOOP_SEARCH', False) or not FFmpegBackend().is_available():
+        return duration
+    width, height, default_fps = output_params()
+    try:
+        looping = importlib.import_module('converter.looping')
+        return looping.find_loop_duration(input_path, start_seconds, duration, width, height, fps or default_fps,
+                                          video_duration=info.duration if info is not None else None,
+                                          threads=threads)
+    except Exception as exc:
+        logger.warning(f"Loop search skipped: {exc}")
+        return duration
+
+
+def target_bytes_setting() -> int:
+    """The configured GIF byte budget; 0 keeps the fixed GIF_FPS/palette settings."""
+    return getattr(settings, 'GIF_TARGET_BYTES', 0)
+
+
+def plan_encoding(input_path: str, start_seconds: float, duration: float, target_bytes: int, threads: int = None):
+    """(encoding, estimated_bytes) for a byte budget, or (None, None) when there is none or no ffmpeg."""
+    if not target_bytes or not FFmpegBackend().is_available():
+        return None, None
+    width, height, fps = output_params()
+    return sizing.plan(input_path, start_seconds, duration, target_bytes, width, height, fps, threads=threads)
+
+
+def convert(input_path: str, output_path: str, start_seconds: int, duration: int, backend: str = None, progress=None,
+            background: bool = False, target_bytes: int = None):
+    """
+    Convert a trimmed segment of input_path into a looping GIF at output_path.
+    Raises probe.ProbeError before any encode starts if the trim is impossible, and
+    admission.Saturated if no conversion slot frees up (background jobs wait longer).
+    progress, if given, receives parse_progress() reports while the backend encodes.
+    With a byte budget (target_bytes, default GIF_TARGET_BYTES) fps and palette
+    settings are planned from a sampled pass and recorded in the GIF.
+    """
+    info, plan = probe.preflight(input_path, start_seconds, duration)
+    engine = get_backend(backend)
+    target_bytes = target_bytes_setting() if target_bytes is None else target_bytes
+    with metrics.stage('admission'):
+        slot = admission.widen(admission.acquire(background=background), engine.wanted_threads())
+    with slot:
+        try:
+            trim = plan_loop(input_path, plan.start, plan.duration, info, threads=slot.threads)
+            encoding, estimated = plan_encoding(input_path, plan.start, trim, target_bytes, threads=slot.threads)
+            engine.convert(input_path, output_path, plan.start, trim, progress=progress, threads=slot.threads,
+                           encoding=encoding)
+        except ConversionError:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            raise
+        except Exception as e:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            logger.error(f"{engine.name} conversion error: {str(e)}")
+            raise ConversionError(f"Video conversion failed: {str(e)}")
+
+        # Check if output file was created and has content
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            raise ConversionError("Conversion did not create a valid output file")
+        post_process(output_path, threads=slot.threads)
+
+    if encoding is not None:
+        sizing.record(output_path, encoding, target_bytes, estimated)
+    metrics.observe('chromi_output_bytes', os.path.getsize(output_path))
+    metrics.inc('chromi_conversions_total', outcome='ok')
+    logger.info(f"{engine.name} conversion successful. Output file size: {os.path.getsize(output_path)} bytes")
+    return output_path
+
+
+def convert_batch(input_path: str, clips, output_paths, progress=None, background: bool = False):
+    """
+    Convert several clips of input_path, one GIF per clip at the matching entry of
+    output_paths, from a single probe and admission slot. Clips close together are
+    encoded by one ffmpeg run that decodes their span once (BATCH_MAX_GAP_SECONDS).
+    Raises probe.ProbeError before any encode if a clip starts past the end.
+    progress receives parse_progress() reports with percent over the whole batch.
+    """
+    backend = FFmpegBackend()
+    if not backend.is_available():
+        # Fanning one decode out to several outputs needs ffmpeg's filter graph
+        raise ConversionError("Batch conversion needs FFmpeg")
+    for clip in clips:
+        preset_params(clip.preset)
+
+    info = None
+    if shutil.which('ffprobe'):
+        with metrics.stage('probe'):
+            info = probe.probe_video(input_path)
+    planned = []
+    for clip in clips:
+        if info is not None:
+            plan = probe.plan_seek(info, clip.start, clip.duration)
+            clip = Clip(plan.start, plan.duration, clip.preset)
+        planned.append(clip)
+
+    with metrics.stage('admission'):
+        slot = admission.acquire(background=background)
+    with slot:
+        planned = [Clip(clip.start, plan_loop(input_path, clip.start, clip.duration, info,
+                                              fps=preset_params(clip.preset)[2], threads=slot.threads), clip.preset)
+                   for clip in planned]
+        groups = group_clips(planned, getattr(settings, 'BATCH_MAX_GAP_SECONDS', 10))
+        spans = [max(planned[i].start + planned[i].duration for i in group) - min(planned[i].start for i in group)
+                 for group in groups]
+        total = sum(spans) or 1.0
+        done = 0.0
+        for group, span in zip(groups, spans):
+            group_progress = None
+            if progress is not None:
+                def group_progress(report, done=done, span=span):
+                    encoded = done + min(report['out_time'], span)
+                    progress(dict(report, out_time=round(encoded, 3), done=False,
+                                  percent=round(min(99.9, encoded / total * 100), 1)))
+            try:
+                backend.convert_batch(input_path, [planned[i] for i in group], [output_paths[i] for i in group],
+                                      progress=group_progress, threads=slot.threads)
+            except ConversionError:
+                metrics.inc('chromi_conversions_total', outcome='error')
+                raise
+            done += span
+
+        for path in output_paths:
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                metrics.inc('chromi_conversions_total', outcome='error')
+                raise ConversionError("Conversion did not create a valid output file")
+        for path in output_paths:
+            post_process(path, threads=slot.threads)
+    for path in output_paths:
+        metrics.observe('chromi_output_bytes', os.path.getsize(path))
+        metrics.inc('chromi_conversions_total', outcome='ok')
+    logger.info(f"Batch of {len(clips)} clip(s) converted in {len(groups)} ffmpeg run(s)")
+    return output_paths
+
+
+async def convert_async(input_path: str, output_path: str, start_seconds: int, duration: int, progress=None,
+                        background: bool = False, target_bytes: int = None):
+    """
+    convert() for async views. ffprobe and the admission wait run off the event loop
+    and ffmpeg runs as an asyncio subprocess. Backends without an async path run
+    in a worker thread.
+    """
+    engine = get_backend()
+    if not isinstance(engine, FFmpegBackend):
+        return await asyncio.to_thread(convert, input_path, output_path, start_seconds, duration,
+                                       progress=progress, background=background, target_bytes=target_bytes)
+
+    info, plan = await asyncio.to_thread(probe.preflight, input_path, start_seconds, duration)
+    target_bytes = target_bytes_setting() if target_bytes is None else target_bytes
+    with metrics.stage('admission'):
+        slot = await admission.acquire_async(background=background)
+    with slot:
+        try:
+            trim = await asyncio.to_thread(plan_loop, input_path, plan.start, plan.duration, info,
+                                           threads=slot.threads)
+            encoding, estimated = await asyncio.to_thread(plan_encoding, input_path, plan.start, trim, target_bytes,
+                                                          threads=slot.threads)
+            await engine.convert_async(input_path, output_path, plan.start, trim, progress=progress,
+                                       threads=slot.threads, encoding=encoding)
+        except ConversionError:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            raise
+        except subprocess.SubprocessError as e:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            raise ConversionError(f"Size planning failed: {str(e)}")
+
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            metrics.inc('chromi_conversions_total', outcome='error')
+            raise ConversionError("Conversion did not create a valid output file")
+        await asyncio.to_thread(post_process, output_path, threads=slot.threads)
+
+    if encoding is not None:
+        sizing.record(output_path, encoding, target_bytes, estimated)
+    metrics.observe('chromi_output_bytes', os.path.getsize(output_path))
+    metrics.inc('chromi_conversions_total', outcome='ok')
+    logger.info(f"{engine.name} conversion successful. Output file size: {os.path.getsize(output_path)} bytes")
+    return output_path
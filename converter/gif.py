@@ -0,0 +1,328 @@
+import os
+import struct
+from dataclasses import dataclass, field
+
+
+class GifError(ValueError):
+    """Raised for data that is not a GIF this module can parse."""
+
+
+@dataclass
+class Frame:
+    """One image block, kept encoded: Graphic Control Extension, descriptor, local palette, LZW data."""
+    control: bytes
+    descriptor: bytes
+    color_table: bytes
+    data: bytes
+
+    @property
+    def rect(self):
+        """(left, top, width, height) of the frame on the logical screen."""
+        return struct.unpack('<4H', self.descriptor[1:9])
+
+    @property
+    def min_code_size(self) -> int:
+        return self.data[0]
+
+    def codes(self) -> bytes:
+        """The frame's LZW codes with the sub-block framing removed."""
+        return _sub_blocks_data(self.data, 1)
+
+    @property
+    def delay(self) -> int:
+        """Display time in centiseconds (0 without a Graphic Control Extension)."""
+        return struct.unpack('<H', self.control[4:6])[0] if self.control else 0
+
+    @property
+    def disposal(self) -> int:
+        return (self.control[3] >> 2) & 0x07 if self.control else 0
+
+    @property
+    def transparent_index(self):
+        return self.control[6] if self.control and self.control[3] & 0x01 else None
+
+    def encode(self) -> bytes:
+        return self.control + self.descriptor + self.color_table + self.data
+
+
+@dataclass
+class Gif:
+    width: int
+    height: int
+    flags: int
+    background: int
+    aspect: int
+    color_table: bytes
+    frames: list = field(default_factory=list)
+    loop: int = None
+    comment: bytes = None
+
+    def encode(self) -> bytes:
+        out = [b'GIF89a', struct.pack('<2H3B', self.width, self.height, self.flags, self.background, self.aspect),
+               self.color_table]
+        if self.comment is not None:
+            out.append(comment_block(self.comment))
+        if self.loop is not None:
+            out.append(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        out.extend(frame.encode() for frame in self.frames)
+        out.append(b'\x3b')
+        return b''.join(out)
+
+
+def _table_size(flags: int) -> int:
+    return 3 * (2 << (flags & 0x07)) if flags & 0x80 else 0
+
+
+def _sub_blocks_end(data: bytes, pos: int) -> int:
+    """Offset just past the terminator of the data sub-block chain starting at pos."""
+    while True:
+        if pos >= len(data):
+            raise GifError('Truncated GIF data')
+        size = data[pos]
+        pos += 1 + size
+        if size == 0:
+            return pos
+
+
+def _sub_blocks_data(data: bytes, pos: int) -> bytes:
+    chunks = []
+    while data[pos]:
+        chunks.append(data[pos + 1:pos + 1 + data[pos]])
+        pos += 1 + data[pos]
+    return b''.join(chunks)
+
+
+def comment_block(text: bytes) -> bytes:
+    """A Comment Extension holding text, split into 255-byte sub-blocks."""
+    chunks = [text[offset:offset + 255] for offset in range(0, len(text), 255)]
+    return b'\x21\xfe' + b''.join(bytes([len(chunk)]) + chunk for chunk in chunks) + b'\x00'
+
+
+def sub_blocks(data: bytes) -> bytes:
+    """data as a chain of 255-byte sub-blocks plus the terminator."""
+    return b''.join(bytes([len(data[offset:offset + 255])]) + data[offset:offset + 255]
+                    for offset in range(0, len(data), 255)) + b'\x00'
+
+
+def control_block(delay: int, disposal: int = 1, transparent: int = None) -> bytes:
+    """A Graphic Control Extension."""
+    flags = (disposal << 2) | (1 if transparent is not None else 0)
+    return b'\x21\xf9\x04' + struct.pack('<BHB', flags, delay, transparent or 0) + b'\x00'
+
+
+def image_block(left: int, top: int, width: int, height: int, min_code_size: int, codes: bytes,
+                control: bytes = b'') -> Frame:
+    """A frame using the global palette, from LZW codes as returned by lzw_encode()."""
+    return Frame(control, b'\x2c' + struct.pack('<4HB', left, top, width, height, 0), b'',
+                 bytes([min_code_size]) + sub_blocks(codes))
+
+
+def lzw_encode(pixels, min_code_size: int, lossy: int = 0, distance=None) -> bytes:
+    """
+    GIF-flavoured LZW of a sequence of palette indices. With lossy > 0 and a palette
+    distance matrix, a pixel that would break the current run may be swapped for a
+    colour within lossy of it that continues a known string (gifsicle-style lossy LZW).
+    """
+    clear = 1 << min_code_size
+    end = clear + 1
+    out = bytearray()
+    bits = 0
+    nbits = 0
+    width = min_code_size + 1
+    next_code = end + 1
+    table = {}
+    children = {} if lossy else None
+
+    def reset():
+        nonlocal width, next_code
+        table.clear()
+        if children is not None:
+            children.clear()
+        width = min_code_size + 1
+        next_code = end + 1
+
+    def emit(code):
+        nonlocal bits, nbits, width
+        bits |= code << nbits
+        nbits += width
+        while nbits >= 8:
+            out.append(bits & 0xff)
+            bits >>= 8
+            nbits -= 8
+        # The decoder widens codes once its table reaches the current limit
+        if next_code >= (1 << width) and width < 12:
+            width += 1
+
+    pixels = bytes(pixels)
+    emit(clear)
+    if not pixels:
+        emit(end)
+        return bytes(out) + (bytes([bits]) if nbits else b'')
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix << 8) | pixel
+        code = table.get(key)
+        if code is None and lossy:
+            for child_pixel, child_code in children.get(prefix, ()):
+                if distance[pixel, child_pixel] <= lossy:
+                    code = child_code
+                    break
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code >= 4095:
+            emit(clear)
+            reset()
+        else:
+            table[key] = next_code
+            if children is not None:
+                children.setdefault(prefix, []).append((pixel, next_code))
+            next_code += 1
+        prefix = pixel
+    emit(prefix)
+    emit(end)
+    if nbits:
+        out.append(bits & 0xff)
+    return bytes(out)
+
+
+def lzw_decode(data: bytes, min_code_size: int, pixel_count: int) -> bytes:
+    """Decode GIF LZW data (sub-blocks already joined) into palette indices."""
+    clear = 1 << min_code_size
+    end = clear + 1
+    out = bytearray()
+    table = [bytes([index]) for index in range(clear)] + [b'', b'']
+    width = min_code_size + 1
+    bits = 0
+    nbits = 0
+    previous = None
+    for byte in data:
+        bits |= byte << nbits
+        nbits += 8
+        while nbits >= width:
+            code = bits & ((1 << width) - 1)
+            bits >>= width
+            nbits -= width
+            if code == clear:
+                del table[end + 1:]
+                width = min_code_size + 1
+                previous = None
+                continue
+            if code == end:
+                return bytes(out[:pixel_count])
+            if previous is None:
+                entry = table[code]
+            else:
+                if code < len(table):
+                    entry = table[code]
+                    added = previous + entry[:1]
+                elif code == len(table):
+                    entry = added = previous + previous[:1]
+                else:
+                    raise GifError('Corrupt LZW data')
+                if len(table) < 4096:
+                    table.append(added)
+                    if len(table) == (1 << width) and width < 12:
+                        width += 1
+            out += entry
+            previous = entry
+    return bytes(out[:pixel_count])
+
+
+def parse(data: bytes) -> Gif:
+    """
+    Split a GIF into its screen, global palette and still-encoded frames. Nothing
+    is decompressed, so this costs a single pass over the bytes.
+    """
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise GifError('Not a GIF file')
+    width, height, flags, background, aspect = struct.unpack('<2H3B', data[6:13])
+    pos = 13 + _table_size(flags)
+    gif = Gif(width, height, flags, background, aspect, data[13:pos])
+    control = b''
+    while pos < len(data):
+        introducer = data[pos]
+        if introducer == 0x3b:
+            return gif
+        if introducer == 0x21:
+            label = data[pos + 1]
+            end = _sub_blocks_end(data, pos + 2)
+            if label == 0xf9:
+                control = data[pos:end]
+            elif label == 0xff and data[pos + 3:pos + 14] == b'NETSCAPE2.0':
+                gif.loop = struct.unpack('<H', data[pos + 16:pos + 18])[0]
+            elif label == 0xfe and gif.comment is None:
+                gif.comment = _sub_blocks_data(data, pos + 2)
+            # Other application extensions carry nothing we keep
+            pos = end
+        elif introducer == 0x2c:
+            descriptor = data[pos:pos + 10]
+            table_end = pos + 10 + _table_size(descriptor[9])
+            end = _sub_blocks_end(data, table_end + 1)
+            gif.frames.append(Frame(control, descriptor, data[pos + 10:table_end], data[table_end:end]))
+            control = b''
+            pos = end
+        else:
+            raise GifError(f'Unexpected block 0x{introducer:02x} at offset {pos}')
+    raise GifError('GIF has no trailer')
+
+
+def read(path: str) -> Gif:
+    with open(path, 'rb') as f:
+        return parse(f.read())
+
+
+def insert_comment(path: str, text: bytes):
+    """Add a comment right after the header and global palette, leaving every other byte as is."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise GifError('Not a GIF file')
+    head = 13 + _table_size(data[10])
+    tmp = f'{path}.comment.tmp'
+    with open(tmp, 'wb') as f:
+        # Comment extensions need GIF89a
+        f.write(b'GIF89a' + data[6:head] + comment_block(text) + data[head:])
+    os.replace(tmp, path)
+
+
+def read_comment(path: str, limit: int = 64 * 1024):
+    """The first comment before the first frame, reading at most limit bytes, or None."""
+    with open(path, 'rb') as f:
+        data = f.read(limit)
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise GifError('Not a GIF file')
+    pos = 13 + _table_size(data[10])
+    try:
+        while pos < len(data) and data[pos] == 0x21:
+            if data[pos + 1] == 0xfe:
+                return _sub_blocks_data(data, pos + 2)
+            pos = _sub_blocks_end(data, pos + 2)
+    except (GifError, IndexError):
+        pass
+    return None
+
+
+def stitch(paths, output_path: str, loop: int = 0):
+    """
+    Concatenate the frames of several GIFs with the same screen size into one GIF,
+    without re-encoding. Segments whose global palette differs from the first one
+    keep it as a local palette on each of their frames.
+    """
+    parts = [read(path) for path in paths]
+    if not parts:
+        raise GifError('Nothing to stitch')
+    first = parts[0]
+    result = Gif(first.width, first.height, first.flags, first.background, first.aspect, first.color_table, loop=loop)
+    for part in parts:
+        if (part.width, part.height) != (first.width, first.height):
+            raise GifError(f'Cannot stitch a {part.width}x{part.height} GIF onto {first.width}x{first.height}')
+        for frame in part.frames:
+            if part.color_table != first.color_table and not frame.color_table:
+                descriptor = frame.descriptor[:9] + bytes([(frame.descriptor[9] & 0x78) | 0x80 | (part.flags & 0x07)])
+                frame = Frame(frame.control, descriptor, part.color_table, frame.data)
+            result.frames.append(frame)
+    with open(output_path, 'wb') as f:
+        f.write(result.encode())
+    return len(result.frames)
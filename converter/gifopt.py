@@ -0,0 +1,230 @@
+import os
+import shutil
+import logging
+import subprocess
+import numpy as np
+from django.conf import settings
+from . import gif, governor
+
+logger = logging.getLogger(__name__)
+
+# Frames are converted from RGB to palette indices this many at a time
+DECODE_BATCH = 16
+
+
+def palette_array(color_table: bytes):
+    return np.frombuffer(color_table, dtype=np.uint8).reshape(-1, 3)
+
+
+def distance_matrix(palette):
+    """Euclidean RGB distance between every pair of palette entries."""
+    colors = palette.astype(np.float32)
+    return np.sqrt(((colors[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2))
+
+
+def _deinterlace(rows, height: int):
+    order = np.concatenate([np.arange(start, height, step) for start, step in ((0, 8), (4, 8), (2, 4), (1, 2))])
+    result = np.empty_like(rows)
+    result[order] = rows
+    return result
+
+
+def composite_frames(parsed: gif.Gif):
+    """
+    Decode and composite every frame in palette-index space, honouring transparency
+    and disposal. Only used when no ffmpeg binary is available; needs every frame
+    to use the global palette.
+    """
+    canvas = np.full((parsed.height, parsed.width), parsed.background, dtype=np.uint8)
+    frames = np.empty((len(parsed.frames), parsed.height, parsed.width), dtype=np.uint8)
+    for index, frame in enumerate(parsed.frames):
+        left, top, width, height = frame.rect
+        pixels = gif.lzw_decode(frame.codes(), frame.min_code_size, width * height)
+        if len(pixels) != width * height:
+            raise gif.GifError(f'Frame {index} is truncated')
+        rows = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width)
+        if frame.descriptor[9] & 0x40:
+            rows = _deinterlace(rows, height)
+        previous = canvas.copy() if frame.disposal == 3 else None
+        region = canvas[top:top + height, left:left + width]
+        rows = rows[:region.shape[0], :region.shape[1]]
+        if frame.transparent_index is None:
+            region[...] = rows
+        else:
+            np.copyto(region, rows, where=rows != frame.transparent_index)
+        frames[index] = canvas
+        if frame.disposal == 2:
+            region[...] = parsed.background
+        elif previous is not None:
+            canvas = previous
+    return frames
+
+
+def ffmpeg_frames(path: str, parsed: gif.Gif, palette, threads: int = None):
+    """
+    Composited frames decoded by ffmpeg as RGB, mapped back onto the global palette.
+    The decode is governed and bounded by CONVERSION_TIMEOUT like any other ffmpeg run.
+    """
+    keys = (palette[:, 0].astype(np.uint32) << 16) | (palette[:, 1].astype(np.uint32) << 8) | palette[:, 2]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    frame_bytes = parsed.width * parsed.height * 3
+    frames = np.empty((len(parsed.frames), parsed.height, parsed.width), dtype=np.uint8)
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-i', path, '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+           'pipe:1']
+    count = 0
+    with governor.Governed(cmd, threads=threads, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as governed:
+        process = governed.process
+        while True:
+            data = process.stdout.read(frame_bytes * DECODE_BATCH)
+            if not data:
+                break
+            rgb = np.frombuffer(data, dtype=np.uint8).reshape(-1, parsed.height, parsed.width, 3)
+            if count + len(rgb) > len(frames):
+                raise gif.GifError('ffmpeg decoded more frames than the GIF has')
+            key = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+            position = np.minimum(np.searchsorted(sorted_keys, key), len(sorted_keys) - 1)
+            if not np.array_equal(sorted_keys[position], key):
+                raise gif.GifError('Decoded colours are not all in the global palette')
+            frames[count:count + len(rgb)] = order[position]
+            count += len(rgb)
+        governed.wait()
+    if governed.timed_out:
+        raise gif.GifError(f'ffmpeg decode timed out after {governed.timeout} seconds')
+    if count != len(frames):
+        raise gif.GifError(f'ffmpeg decoded {count} of {len(frames)} frames')
+    return frames
+
+
+def stabilize(frames, distance, fuzz: float):
+    """
+    In place: pixels whose colour is within fuzz of what is already on screen keep the
+    previous value, so dither noise and sensor grain stop counting as change.
+    """
+    for index in range(1, len(frames)):
+        previous, current = frames[index - 1], frames[index]
+        np.copyto(current, previous, where=distance[current, previous] <= fuzz)
+    return frames
+
+
+def bounding_boxes(changed):
+    """(has_change, y0, y1, x0, x1) arrays for a (frames, height, width) change mask."""
+    rows = changed.any(axis=2)
+    cols = changed.any(axis=1)
+    has_change = rows.any(axis=1)
+    height, width = rows.shape[1], cols.shape[1]
+    y0 = rows.argmax(axis=1)
+    y1 = height - rows[:, ::-1].argmax(axis=1)
+    x0 = cols.argmax(axis=1)
+    x1 = width - cols[:, ::-1].argmax(axis=1)
+    return has_change, y0, y1, x0, x1
+
+
+def optimize(path: str, fuzz: float = None, lossy: int = None, max_changed: float = None, max_pixels: int = None,
+             threads: int = None) -> dict:
+    """
+    Rewrite the GIF at path so each frame after the first only carries the rectangle
+    that changed, with unchanged pixels inside it made transparent, optionally with
+    lossy LZW. Change detection, bounding boxes and palette bookkeeping run as NumPy
+    operations over all frames; only the shrunken rectangles go through LZW. The file
+    is only replaced when the result is smaller. Returns stats, with 'skipped' saying
+    why when nothing was written.
+    """
+    fuzz = getattr(settings, 'GIF_OPTIMIZE_FUZZ', 10.0) if fuzz is None else fuzz
+    lossy = getattr(settings, 'GIF_OPTIMIZE_LOSSY', 0) if lossy is None else lossy
+    max_changed = getattr(settings, 'GIF_OPTIMIZE_MAX_CHANGED', 0.5) if max_changed is None else max_changed
+    max_pixels = getattr(settings, 'GIF_OPTIMIZE_MAX_PIXELS', 500_000) if max_pixels is None else max_pixels
+
+    before = os.path.getsize(path)
+    parsed = gif.read(path)
+    stats = {'before': before, 'after': before, 'frames': len(parsed.frames)}
+    if not parsed.color_table or len(parsed.frames) < 2:
+        return dict(stats, skipped='single frame or no global palette')
+    if any(frame.color_table for frame in parsed.frames):
+        return dict(stats, skipped='frames use local palettes')
+
+    palette = palette_array(parsed.color_table)
+    if shutil.which('ffmpeg'):
+        frames = ffmpeg_frames(path, parsed, palette, threads=threads)
+    else:
+        frames = composite_frames(parsed)
+    distance = distance_matrix(palette)
+    if fuzz:
+        stabilize(frames, distance, fuzz)
+
+    changed = frames[1:] != frames[:-1]
+    stats['changed'] = round(float(changed.mean()), 4)
+    if stats['changed'] > max_changed:
+        # Busy footage: little to gain, and encoding full frames in Python is slow
+        return dict(stats, skipped='too much motion')
+    has_change, y0, y1, x0, x1 = bounding_boxes(changed)
+    first = parsed.frames[0]
+    # The encoder's full-size first frame is kept as is unless lossy LZW should rework it
+    reuse_first = (not lossy and first.rect == (0, 0, parsed.width, parsed.height)
+                   and not first.descriptor[9] & 0x40)
+    # What the Python LZW coder would have to get through: every rectangle, plus the first frame
+    stats['pixels'] = int(((y1 - y0) * (x1 - x0))[has_change].sum())
+    if not reuse_first:
+        stats['pixels'] += parsed.width * parsed.height
+    if max_pixels and stats['pixels'] > max_pixels:
+        return dict(stats, skipped='too many pixels to encode')
+
+    # Any palette slot no frame uses can serve as the transparent colour
+    color_table = parsed.color_table
+    unused = np.flatnonzero(np.bincount(frames.ravel(), minlength=len(palette))[:len(palette)] == 0)
+    if len(unused):
+        transparent = int(unused[0])
+    elif len(palette) < 256:
+        transparent = len(palette)
+        color_table += bytes(len(color_table))
+    else:
+        transparent = None
+    table_bits = max(1, (len(color_table) // 3 - 1).bit_length())
+    min_code_size = max(2, table_bits)
+    # Codes only carry over under the same code size; a palette grown for transparency may change it
+    reuse_first = reuse_first and first.min_code_size == min_code_size
+
+    lossy_distance = None
+    if lossy:
+        lossy_distance = np.pad(distance, (0, len(color_table) // 3 - len(palette)), constant_values=np.inf)
+        if transparent is not None:
+            lossy_distance[transparent, :] = np.inf
+            lossy_distance[:, transparent] = np.inf
+
+    delays = [frame.delay for frame in parsed.frames]
+    # [delay, left, top, width, height, codes, uses_transparency]
+    if reuse_first:
+        first_codes = first.codes()
+    else:
+        first_codes = gif.lzw_encode(frames[0].tobytes(), min_code_size, lossy, lossy_distance)
+    blocks = [[delays[0], 0, 0, parsed.width, parsed.height, first_codes, False]]
+    for index in range(1, len(frames)):
+        step = index - 1
+        if not has_change[step]:
+            # Nothing moved: show the previous frame for longer instead
+            blocks[-1][0] += delays[index]
+            continue
+        top, bottom, left, right = y0[step], y1[step], x0[step], x1[step]
+        region = frames[index, top:bottom, left:right].copy()
+        if transparent is not None:
+            region[~changed[step, top:bottom, left:right]] = transparent
+        codes = gif.lzw_encode(region.tobytes(), min_code_size, lossy, lossy_distance)
+        blocks.append([delays[index], int(left), int(top), int(right - left), int(bottom - top), codes,
+                       transparent is not None])
+
+    result = gif.Gif(parsed.width, parsed.height, 0x80 | (parsed.flags & 0x70) | (table_bits - 1),
+                     parsed.background, parsed.aspect, color_table, loop=parsed.loop if parsed.loop is not None else 0)
+    for delay, left, top, width, height, codes, uses_transparency in blocks:
+        control = gif.control_block(delay, disposal=1, transparent=transparent if uses_transparency else None)
+        result.frames.append(gif.image_block(left, top, width, height, min_code_size, codes, control))
+    data = result.encode()
+    stats['frames'] = len(result.frames)
+    if len(data) >= before:
+        return dict(stats, skipped='no gain')
+
+    tmp = f'{path}.opt.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    logger.info(f"Optimized GIF from {before} to {len(data)} bytes ({stats['changed']:.1%} of pixels changing)")
+    return dict(stats, after=len(data))
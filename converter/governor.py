@@ -0,0 +1,207 @@
+import os
+import signal
+import shutil
+import asyncio
+import logging
+import resource
+import tempfile
+import threading
+import subprocess
+from django.conf import settings
+from . import admission, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def kill_grace() -> float:
+    """Seconds between SIGTERM and SIGKILL for an ffmpeg that outlived its deadline."""
+    return getattr(settings, 'FFMPEG_KILL_GRACE', 5)
+
+
+def cpu_seconds_limit(threads: int = None) -> int:
+    """RLIMIT_CPU for one ffmpeg: FFMPEG_CPU_SECONDS, or the timeout's worth of every granted core."""
+    limit = getattr(settings, 'FFMPEG_CPU_SECONDS', 0)
+    if limit:
+        return int(limit)
+    return int(getattr(settings, 'CONVERSION_TIMEOUT', 120) * (threads or admission.cpu_budget()))
+
+
+def govern(pid: int, threads: int = None):
+    """
+    Confine a freshly started ffmpeg: cap its address space (FFMPEG_MEMORY_LIMIT_BYTES)
+    and CPU time, then lower its CPU and I/O priority so requests on the same box stay
+    responsive. Limits are applied with prlimit() from the parent rather than in a
+    preexec_fn, which is unsafe in threaded servers. Best effort: a limit the platform
+    does not support is logged and skipped.
+    """
+    memory = getattr(settings, 'FFMPEG_MEMORY_LIMIT_BYTES', 2 * 1024 * 1024 * 1024)
+    cpu = cpu_seconds_limit(threads)
+    nice = getattr(settings, 'FFMPEG_NICE', 10)
+    try:
+        if memory:
+            resource.prlimit(pid, resource.RLIMIT_AS, (memory, memory))
+        if cpu:
+            # SIGXCPU at the soft limit; the hard limit is the SIGKILL backstop
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu, cpu + int(kill_grace()) + 1))
+        if nice:
+            os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + nice))
+    except ProcessLookupError:
+        # Already finished
+        return
+    except (OSError, AttributeError) as exc:
+        logger.warning(f"Could not apply resource limits to ffmpeg {pid}: {exc}")
+
+    io_class = getattr(settings, 'FFMPEG_IONICE_CLASS', 2)
+    if io_class and shutil.which('ionice'):
+        cmd = ['ionice', '-c', str(io_class), '-p', str(pid)]
+        if io_class == 2:
+            cmd[3:3] = ['-n', str(getattr(settings, 'FFMPEG_IONICE_LEVEL', 7))]
+        subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+
+
+def limit_reason(returncode: int, stderr: str):
+    """Which governor limit, if any, ended an ffmpeg run: 'cpu', 'memory' or None."""
+    if returncode == -signal.SIGXCPU:
+        return 'cpu'
+    if returncode and 'Cannot allocate memory' in stderr:
+        return 'memory'
+    return None
+
+
+def check_exit(returncode: int, stderr: str):
+    """Count a limit-induced failure in chromi_ffmpeg_limited_total and return its reason."""
+    reason = limit_reason(returncode, stderr)
+    if reason is not None:
+        logger.warning(f"FFmpeg stopped by its {reason} limit")
+        metrics.inc('chromi_ffmpeg_limited_total', reason=reason)
+    return reason
+
+
+class Watchdog:
+    """
+    Wall-clock deadline for a set of ffmpeg processes. When it expires they get
+    SIGTERM, so ffmpeg can stop and release its buffers; anything still running
+    kill_grace() seconds later gets SIGKILL.
+    """
+
+    def __init__(self, timeout: float, grace: float = None):
+        self.grace = kill_grace() if grace is None else grace
+        self.processes = []
+        self.expired = threading.Event()
+        self._timers = [threading.Timer(max(0.0, timeout), self._expire)]
+        self._timers[0].daemon = True
+
+    def watch(self, process):
+        self.processes.append(process)
+
+    def start(self):
+        self._timers[0].start()
+
+    def cancel(self):
+        for timer in self._timers:
+            timer.cancel()
+
+    def _expire(self):
+        self.expired.set()
+        metrics.inc('chromi_ffmpeg_limited_total', reason='timeout')
+        self._signal(signal.SIGTERM)
+        escalate = threading.Timer(self.grace, self._signal, args=(signal.SIGKILL,))
+        escalate.daemon = True
+        self._timers.append(escalate)
+        escalate.start()
+
+    def _signal(self, signum):
+        for process in self.processes:
+            if process.returncode is None:
+                try:
+                    os.kill(process.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+
+def reap(process):
+    """Popen.wait() via os.wait4, recording the child's own CPU time and peak RSS in the metrics."""
+    _pid, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    metrics.observe_rusage(rusage)
+    return process.returncode
+
+
+class Governed:
+    """
+    One ffmpeg started with Popen(cmd, **kwargs), confined with govern() and under a
+    Watchdog of timeout seconds (CONVERSION_TIMEOUT by default). Use as a context
+    manager: wait() reaps it, and leaving the block kills it if it is still running.
+    """
+
+    def __init__(self, cmd, timeout: float = None, threads: int = None, **kwargs):
+        self.timeout = getattr(settings, 'CONVERSION_TIMEOUT', 120) if timeout is None else timeout
+        kwargs.setdefault('stdin', subprocess.DEVNULL)
+        self.process = subprocess.Popen(cmd, **kwargs)
+        govern(self.process.pid, threads)
+        self.watchdog = Watchdog(self.timeout)
+        self.watchdog.watch(self.process)
+        self.watchdog.start()
+
+    @property
+    def timed_out(self) -> bool:
+        return self.watchdog.expired.is_set()
+
+    def wait(self) -> int:
+        return reap(self.process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.watchdog.cancel()
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.process.stdout is not None:
+            self.process.stdout.close()
+
+
+def run(cmd, timeout: float = None, threads: int = None, check: bool = False, cwd: str = None):
+    """
+    subprocess.run(cmd, capture_output=True) for ffmpeg under the governor. Output is
+    spooled to temporary files, so neither pipe can fill up and stall the child.
+    Raises subprocess.TimeoutExpired when the watchdog fired.
+    """
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        with Governed(cmd, timeout, threads, stdout=stdout_file, stderr=stderr_file, cwd=cwd) as governed:
+            returncode = governed.wait()
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout, stderr = stdout_file.read(), stderr_file.read()
+    if governed.timed_out:
+        raise subprocess.TimeoutExpired(cmd, governed.timeout, stdout, stderr)
+    if returncode != 0:
+        check_exit(returncode, stderr.decode(errors='replace'))
+        if check:
+            raise subprocess.CalledProcessError(returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+def stop(process, grace: float = None):
+    """SIGTERM a Popen, then SIGKILL it if it has not exited within the grace period."""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=kill_grace() if grace is None else grace)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def stop_async(process, grace: float = None):
+    """stop() for an asyncio subprocess."""
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), kill_grace() if grace is None else grace)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
@@ -0,0 +1,179 @@
+import time
+import uuid
+import logging
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from django.conf import settings
+from . import progress
+
+logger = logging.getLogger(__name__)
+
+# Dotted path of the conversion task; resolved lazily so the web process never
+# imports the heavy conversion dependencies just to enqueue a job.
+CONVERT_TASK = 'converter.tasks.convert_video_task'
+BATCH_TASK = 'converter.tasks.convert_batch_task'
+
+
+def _resolve(func_path: str):
+    module_name, func_name = func_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def _run_task(func_path: str, args):
+    """Entry point executed inside a pool worker (thread or child process)."""
+    return _resolve(func_path)(*args)
+
+
+class JobBackend:
+    """Interface for queueing conversion jobs and reading back their state."""
+
+    def enqueue(self, func_path: str, *args, job_id: str = None) -> str:
+        """Queue func_path(*args) and return its job id (job_id if one was given)."""
+        raise NotImplementedError
+
+    def status(self, job_id: str):
+        """Return a dict with at least 'id' and 'status', or None if unknown."""
+        raise NotImplementedError
+
+
+class RQJobBackend(JobBackend):
+    """Queue jobs on Redis through RQ; `manage.py conversion_worker` (or a plain `rq worker`) executes them."""
+
+    def __init__(self, redis_url: str, queue_name: str = 'default', job_timeout: int = 300):
+        try:
+            redis_module = importlib.import_module('redis')
+            self._rq = importlib.import_module('rq')
+            self._rq_job = importlib.import_module('rq.job')
+        except Exception as exc:
+            raise RuntimeError('RQ/Redis not available') from exc
+        self.connection = getattr(redis_module, 'Redis').from_url(redis_url)
+        self.queue = self._rq.Queue(queue_name, connection=self.connection)
+        self.job_timeout = job_timeout
+
+    def enqueue(self, func_path: str, *args, job_id: str = None) -> str:
+        job = self.queue.enqueue(func_path, args=args, job_id=job_id, job_timeout=self.job_timeout)
+        return job.id
+
+    def status(self, job_id: str):
+        Job = getattr(self._rq_job, 'Job')
+        try:
+            job = Job.fetch(job_id, connection=self.connection)
+        except Exception:
+            return None
+
+        response = {
+            'id': job.id,
+            'status': job.get_status(),
+        }
+        # Include result or meta if present
+        if job.is_finished and job.result:
+            response['result'] = job.result
+        if getattr(job, 'meta', None) and 'converted_url' in job.meta:
+            response['converted_url'] = job.meta['converted_url']
+        return response
+
+
+class PoolJobBackend(JobBackend):
+    """
+    Run jobs in an in-process thread or process pool.
+    Meant for single-box deployments and tests: job state lives in this process only.
+    """
+
+    def __init__(self, max_workers: int = 2, use_processes: bool = False, result_ttl: int = 600):
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=max_workers)
+        self.result_ttl = result_ttl
+        self._futures = {}
+        self._finished_at = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, func_path: str, *args, job_id: str = None) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        future = self.executor.submit(_run_task, func_path, args)
+        with self._lock:
+            self._prune()
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _f: self._mark_finished(job_id))
+        return job_id
+
+    def _mark_finished(self, job_id: str):
+        with self._lock:
+            self._finished_at[job_id] = time.monotonic()
+
+    def _prune(self):
+        # Forget results nobody polled for within result_ttl; caller holds the lock
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id, finished_at in list(self._finished_at.items()):
+            if finished_at < cutoff:
+                self._finished_at.pop(job_id, None)
+                self._futures.pop(job_id, None)
+
+    def status(self, job_id: str):
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            return None
+
+        response = {'id': job_id}
+        if future.running():
+            response['status'] = 'started'
+        elif not future.done():
+            response['status'] = 'queued'
+        elif future.exception() is not None:
+            response['status'] = 'failed'
+            response['result'] = {'success': False, 'error': str(future.exception())}
+        else:
+            result = future.result()
+            response['status'] = 'finished'
+            if result:
+                response['result'] = result
+                if result.get('converted_url'):
+                    response['converted_url'] = result['converted_url']
+        return response
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_job_backend() -> JobBackend:
+    """Return the process-wide job backend selected by settings.JOB_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = getattr(settings, 'JOB_BACKEND', 'rq')
+            workers = getattr(settings, 'JOB_WORKERS', 2)
+            if name == 'rq':
+                _backend = RQJobBackend(
+                    getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'),
+                    queue_name=getattr(settings, 'RQ_QUEUE_NAME', 'default'),
+                    job_timeout=getattr(settings, 'JOB_TIMEOUT', 300),
+                )
+            elif name == 'thread':
+                _backend = PoolJobBackend(max_workers=workers)
+            elif name == 'process':
+                _backend = PoolJobBackend(max_workers=workers, use_processes=True)
+            else:
+                raise ValueError(f"Unknown JOB_BACKEND: {name}")
+            logger.info(f"Using job backend: {name}")
+        return _backend
+
+
+def enqueue_conversion(upload_path: str, start_seconds: int, duration: int, content_hash: str = None) -> str:
+    """Queue a conversion of an already-saved upload and return the job id."""
+    output_basename = str(uuid.uuid4())
+    # The id is chosen here so the task can publish progress under the id clients poll
+    job_id = str(uuid.uuid4())
+    progress.publish_queued(job_id)
+    return get_job_backend().enqueue(CONVERT_TASK, upload_path, output_basename, start_seconds, duration, content_hash,
+                                     job_id, job_id=job_id)
+
+
+def enqueue_batch(upload_path: str, clips, content_hash: str = None) -> str:
+    """Queue a batch conversion of an already-saved upload and return the job id."""
+    job_id = str(uuid.uuid4())
+    progress.publish_queued(job_id)
+    # Plain lists keep the arguments serializable for every backend
+    specs = [[clip.start, clip.duration, clip.preset] for clip in clips]
+    return get_job_backend().enqueue(BATCH_TASK, upload_path, specs, content_hash, job_id, job_id=job_id)
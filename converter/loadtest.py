@@ -0,0 +1,263 @@
+import os
+import json
+import math
+import time
+import uuid
+import socket
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+
+# Responses that mean the server shed or lost the request rather than rejecting it
+TIMEOUT_STATUSES = (429, 502, 503, 504)
+
+
+class FlowError(Exception):
+    def __init__(self, stage: str, message: str, status: int = None, timed_out: bool = False):
+        super().__init__(f'{stage}: {message}')
+        self.stage = stage
+        self.status = status
+        self.timed_out = timed_out
+
+
+@dataclass
+class FlowResult:
+    ok: bool
+    started: float
+    latency: float
+    stages: dict = field(default_factory=dict)
+    error: str = ''
+    stage: str = ''
+    status: int = None
+    timed_out: bool = False
+
+
+def percentile(values, fraction: float):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def latency_summary(values) -> dict:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': max(values) if values else None,
+    }
+
+
+def summarize(results, elapsed: float) -> dict:
+    ok = [result for result in results if result.ok]
+    failed = [result for result in results if not result.ok]
+    stages = {}
+    for result in ok:
+        for stage, seconds in result.stages.items():
+            stages.setdefault(stage, []).append(seconds)
+    errors = {}
+    for result in failed:
+        key = f'{result.stage}:{result.status or "error"}'
+        errors[key] = errors.get(key, 0) + 1
+    total = len(results)
+    return {
+        'flows': total,
+        'succeeded': len(ok),
+        'elapsed_seconds': elapsed,
+        'throughput_per_second': len(ok) / elapsed if elapsed else 0.0,
+        'error_rate': len(failed) / total if total else 0.0,
+        'timeout_rate': sum(1 for result in failed if result.timed_out) / total if total else 0.0,
+        'latency_seconds': latency_summary([result.latency for result in ok]),
+        'stage_latency_seconds': {stage: latency_summary(values) for stage, values in sorted(stages.items())},
+        'errors': errors,
+    }
+
+
+def encode_multipart(fields: dict, files: dict):
+    """Return (body, content_type) for fields {name: value} and files {name: (filename, bytes, type)}."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One simulated browser: its own cookie jar (for the CSRF cookie) and timeout."""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self) -> str:
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, stage: str, method: str, path: str, body: bytes = None, headers: dict = None):
+        headers = dict(headers or {})
+        if method != 'GET':
+            headers['X-CSRFToken'] = self.csrf_token()
+            headers['Referer'] = self.base_url + '/'
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            raise FlowError(stage, exc.read()[:200].decode(errors='replace'), status=exc.code,
+                            timed_out=exc.code in TIMEOUT_STATUSES)
+        except (socket.timeout, TimeoutError) as exc:
+            raise FlowError(stage, f'client timeout: {exc}', timed_out=True)
+        except (urllib.error.URLError, ConnectionError) as exc:
+            raise FlowError(stage, str(exc))
+
+    def json(self, stage: str, method: str, path: str, body: bytes = None, headers: dict = None):
+        status, data = self.request(stage, method, path, body, headers)
+        return status, json.loads(data or b'{}')
+
+
+def run_flow(base_url: str, video_path: str, mode: str = 'chunked', start_time: str = '00:00:00',
+             timeout: float = 180) -> FlowResult:
+    """
+    One user: load the page (CSRF cookie), upload, convert, wait for async jobs and
+    download the GIF. mode is 'chunked' (resumable /uploads/ API, as the UI does) or
+    'multipart' (a single POST /convert/ with the file).
+    """
+    client = Client(base_url, timeout)
+    started = time.monotonic()
+    stages = {}
+
+    def timed(stage, func):
+        stage_started = time.monotonic()
+        value = func()
+        stages[stage] = time.monotonic() - stage_started
+        return value
+
+    try:
+        with open(video_path, 'rb') as f:
+            data = f.read()
+        filename = os.path.basename(video_path)
+        timed('page', lambda: client.request('page', 'GET', '/'))
+
+        if mode == 'chunked':
+            def upload():
+                _status, session = client.json('upload', 'POST', '/uploads/',
+                                               json.dumps({'filename': filename, 'size': len(data)}).encode(),
+                                               {'Content-Type': 'application/json'})
+                chunk_size = session['chunk_size']
+                for index in range(session['chunk_count']):
+                    client.request('upload', 'PUT', f"/uploads/{session['upload_id']}/chunks/{index}/",
+                                   data[index * chunk_size:(index + 1) * chunk_size],
+                                   {'Content-Type': 'application/octet-stream'})
+                client.json('upload', 'POST', f"/uploads/{session['upload_id']}/complete/")
+                return session['upload_id']
+
+            upload_id = timed('upload', upload)
+            body, content_type = encode_multipart({'upload_id': upload_id, 'start_time': start_time}, {})
+            status, result = timed('convert', lambda: client.json('convert', 'POST', '/convert/', body,
+                                                                  {'Content-Type': content_type}))
+        else:
+            body, content_type = encode_multipart({'start_time': start_time},
+                                                  {'video': (filename, data, 'video/mp4')})
+            status, result = timed('convert', lambda: client.json(
+                'convert', 'POST', f'/convert/?start_time={start_time}', body, {'Content-Type': content_type}))
+
+        if status == 202:
+            def wait_for_job():
+                deadline = time.monotonic() + timeout
+                after = 0
+                while time.monotonic() < deadline:
+                    _status, state = client.json('job', 'GET', f"{result['events_url']}?after={after}")
+                    after = state.get('seq', after)
+                    if state.get('state') == 'finished':
+                        return state['converted_url']
+                    if state.get('state') == 'failed':
+                        raise FlowError('job', state.get('error', 'job failed'))
+                raise FlowError('job', 'job did not finish in time', timed_out=True)
+            converted_url = timed('job', wait_for_job)
+        else:
+            converted_url = result['converted_url']
+
+        _status, gif = timed('download', lambda: client.request('download', 'GET', converted_url))
+        if not gif.startswith(b'GIF'):
+            raise FlowError('download', 'response is not a GIF')
+    except FlowError as exc:
+        return FlowResult(False, started, time.monotonic() - started, stages, str(exc), exc.stage, exc.status,
+                          exc.timed_out)
+    except Exception as exc:
+        return FlowResult(False, started, time.monotonic() - started, stages, str(exc), 'client')
+    return FlowResult(True, started, time.monotonic() - started, stages)
+
+
+def child_pids(parent: int):
+    """Pids whose parent is parent, from /proc (gunicorn workers of a master)."""
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            pids.append(int(name))
+    return pids
+
+
+def rss_bytes(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Samples the RSS of every worker of a gunicorn master until stopped."""
+
+    def __init__(self, master_pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.samples = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for pid in child_pids(self.master_pid):
+                rss = rss_bytes(pid)
+                if rss is not None:
+                    self.samples.setdefault(pid, []).append(rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self) -> dict:
+        workers = {str(pid): {'peak_bytes': max(values), 'mean_bytes': sum(values) / len(values)}
+                   for pid, values in self.samples.items()}
+        peaks = [worker['peak_bytes'] for worker in workers.values()]
+        return {
+            'workers_seen': len(workers),
+            'peak_worker_bytes': max(peaks) if peaks else None,
+            'total_peak_bytes': sum(peaks) if peaks else None,
+            'per_worker': workers,
+        }
@@ -0,0 +1,85 @@
+import time
+import logging
+import numpy as np
+from django.conf import settings
+from . import governor, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def proxy_size(width: int, height: int, proxy_width: int):
+    """(width, height) of the grayscale proxy, with the output GIF's aspect ratio."""
+    return proxy_width, max(2, round(proxy_width * height / width / 2) * 2)
+
+
+def search_command(input_path: str, start_seconds: float, window_start: float, window_end: float, fps: int,
+                   proxy_width: int, proxy_height: int):
+    """
+    One ffmpeg run with two input-side seeks: the first output frame of the trim,
+    then every output frame (at fps) of the window around the requested end. Both
+    become tiny grayscale frames on a rawvideo pipe; nothing in between is decoded.
+    """
+    scale = f'scale={proxy_width}:{proxy_height}:flags=area,setsar=1,format=gray'
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-threads', '1',
+        '-ss', str(start_seconds), '-i', input_path,
+        '-ss', str(window_start), '-t', str(window_end - window_start), '-i', input_path,
+        '-filter_complex', f'[0:v]trim=end_frame=1,{scale}[first];[1:v]fps={fps},{scale}[tail];'
+                           f'[first][tail]concat=n=2:v=1:a=0[out]',
+        '-map', '[out]', '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1',
+    ]
+
+
+def score_candidates(first, candidates):
+    """Mean absolute pixel difference between the first frame and each candidate, in one batched pass."""
+    return np.abs(candidates.astype(np.int16) - first.astype(np.int16)).mean(axis=(1, 2))
+
+
+def best_end(scores, times, target: float, bias: float):
+    """
+    Index of the candidate to cut before. Scores are mismatch per grey level; bias
+    adds that much per second away from the requested end, so near-ties keep the
+    requested length.
+    """
+    return int(np.argmin(scores + bias * np.abs(np.asarray(times) - target)))
+
+
+def find_loop_duration(input_path: str, start_seconds: float, duration: float, width: int, height: int, fps: int,
+                       video_duration: float = None, threads: int = None) -> float:
+    """
+    The trim length, within LOOP_SEARCH_WINDOW of duration, whose next frame looks
+    most like the first one, so the GIF wraps around without a visible jump.
+    Returns duration unchanged when there is no room to search.
+    """
+    window = getattr(settings, 'LOOP_SEARCH_WINDOW', 0.5)
+    proxy_width, proxy_height = proxy_size(width, height, getattr(settings, 'LOOP_PROXY_WIDTH', 64))
+    target = start_seconds + duration
+    # Never shorter than half the request, never past the end of the source
+    window_start = max(start_seconds + duration / 2, target - window)
+    window_end = target + window
+    if video_duration:
+        window_end = min(window_end, video_duration)
+    if window_end - window_start < 1 / fps:
+        return duration
+
+    started = time.monotonic()
+    cmd = search_command(input_path, start_seconds, window_start, window_end, fps, proxy_width, proxy_height)
+    logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+    result = governor.run(cmd, threads=threads)
+    if result.returncode != 0:
+        raise RuntimeError(f"Loop search failed: {result.stderr.decode(errors='replace')[:500]}")
+    frame_bytes = proxy_width * proxy_height
+    count = len(result.stdout) // frame_bytes
+    if count < 2:
+        return duration
+    frames = np.frombuffer(result.stdout, dtype=np.uint8, count=count * frame_bytes).reshape(count, proxy_height,
+                                                                                         proxy_width)
+    times = window_start + np.arange(count - 1) / fps
+    scores = score_candidates(frames[0], frames[1:])
+    best = best_end(scores, times, target, getattr(settings, 'LOOP_SEARCH_BIAS', 2.0))
+    metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='loop_search')
+
+    looped = round(float(times[best]) - start_seconds, 3)
+    logger.info(f"Loop search: {looped:.3f}s instead of {duration}s, best of {len(scores)} candidates "
+                f"(mismatch {scores[best]:.1f})")
+    return looped
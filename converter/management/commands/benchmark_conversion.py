@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand, CommandError
+from converter import benchmark, engine
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the conversion engines on deterministic lavfi-generated inputs and "
+        "report wall time, CPU time, peak RSS and GIF size per case as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quick', action='store_true', help='Small matrix for a fast smoke run')
+        parser.add_argument('--sources', type=_csv, help=f"Comma list of {', '.join(benchmark.SOURCES)}")
+        parser.add_argument('--codecs', type=_csv, help=f"Comma list of {', '.join(benchmark.CODECS)}")
+        parser.add_argument('--resolutions', type=_csv, help='Comma list like 640x360,1920x1080')
+        parser.add_argument('--lengths', type=_csv, help='Input lengths in seconds')
+        parser.add_argument('--starts', type=_csv, help='Trim start offsets in seconds')
+        parser.add_argument('--engines', type=_csv, default=list(engine.BACKENDS),
+                            help='Conversion backends to compare (default: all available)')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per case; medians are reported')
+        parser.add_argument('--input-dir', default=os.path.join(tempfile.gettempdir(), 'chromi-bench-inputs'),
+                            help='Where generated inputs are cached between runs')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--compare', help='Baseline report to check for regressions')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Relative slowdown/growth that counts as a regression (default 0.10)')
+
+    def handle(self, *args, **options):
+        if not shutil.which('ffmpeg'):
+            raise CommandError('ffmpeg is required to generate benchmark inputs')
+
+        matrix = dict(benchmark.QUICK_MATRIX if options['quick'] else benchmark.DEFAULT_MATRIX)
+        for key in matrix:
+            if options[key]:
+                matrix[key] = options[key]
+        unknown = [name for name in matrix['sources'] if name not in benchmark.SOURCES]
+        unknown += [name for name in matrix['codecs'] if name not in benchmark.CODECS]
+        unknown += [name for name in options['engines'] if name not in engine.BACKENDS]
+        if unknown:
+            raise CommandError(f"Unknown source/codec/engine: {', '.join(unknown)}")
+
+        engines = []
+        for name in options['engines']:
+            if engine.BACKENDS[name]().is_available():
+                engines.append(name)
+            else:
+                self.stderr.write(f"Skipping unavailable engine: {name}")
+
+        cases = benchmark.build_matrix(matrix['sources'], matrix['codecs'], matrix['resolutions'],
+                                       matrix['lengths'], matrix['starts'], engines)
+        work_dir = tempfile.mkdtemp(prefix='chromi-bench-')
+        results = []
+        try:
+            for index, case in enumerate(cases, 1):
+                try:
+                    input_path = benchmark.ensure_input(case.input, options['input_dir'])
+                except Exception as exc:
+                    # e.g. an ffmpeg build without libx265
+                    self.stderr.write(f"[{index}/{len(cases)}] {case.case_id}: cannot generate input: {exc}")
+                    continue
+                report = benchmark.run_case(case, input_path, work_dir, repeat=options['repeat'])
+                results.append(report)
+                if report['ok']:
+                    self.stderr.write(
+                        f"[{index}/{len(cases)}] {case.case_id}: {report['wall_seconds']:.2f}s wall, "
+                        f"{report['cpu_seconds']:.2f}s cpu, {report['peak_rss_bytes'] / 2 ** 20:.0f} MiB rss, "
+                        f"{report['gif_bytes'] / 1024:.0f} KiB gif"
+                    )
+                else:
+                    self.stderr.write(f"[{index}/{len(cases)}] {case.case_id}: failed: {report['error']}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        document = {
+            'version': 1,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'environment': benchmark.environment(),
+            'matrix': matrix,
+            'repeat': options['repeat'],
+            'cases': results,
+        }
+        body = json.dumps(document, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                regressions = benchmark.compare(json.load(f), document, options['threshold'])
+            for item in regressions:
+                self.stderr.write(
+                    f"REGRESSION {item['id']} {item['metric']}: {item['baseline']:.4g} -> {item['current']:.4g} "
+                    f"({item['change']:+.1%})"
+                )
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
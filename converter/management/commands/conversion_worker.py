@@ -0,0 +1,38 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from converter import worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a pool of prewarmed RQ conversion workers. The conversion stack is imported "
+        "once and shared by forked children, which run jobs in-process and are replaced "
+        "once their memory high-water mark passes WORKER_MAX_RSS_BYTES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'JOB_WORKERS', 2),
+                            help='Worker processes (default JOB_WORKERS)')
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help='Queue to listen on, repeatable (default RQ_QUEUE_NAME)')
+        parser.add_argument('--max-rss', type=int, default=getattr(settings, 'WORKER_MAX_RSS_BYTES', 0),
+                            help='Recycle a worker above this many bytes of peak RSS (0 = never)')
+        parser.add_argument('--prefetch', type=int, default=getattr(settings, 'WORKER_PREFETCH', 1),
+                            help='Jobs a worker takes per pull when they are already waiting')
+        parser.add_argument('--burst', action='store_true',
+                            help='Run one worker in this process until the queues are empty, then exit')
+
+    def handle(self, *args, **options):
+        queues = options['queues'] or [getattr(settings, 'RQ_QUEUE_NAME', 'default')]
+        worker.prewarm()
+        if options['burst']:
+            worker.run_worker(queues, options['max_rss'], options['prefetch'], burst=True)
+            return
+
+        pool = worker.WorkerPool(options['processes'], worker.run_worker,
+                                 args=(queues, options['max_rss'], options['prefetch']))
+        signal.signal(signal.SIGTERM, pool.stop)
+        signal.signal(signal.SIGINT, pool.stop)
+        self.stdout.write(f"Starting {options['processes']} conversion worker(s) on {', '.join(queues)}")
+        pool.run()
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from converter import benchmark, loadtest
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the app under a gunicorn profile and drive concurrent upload -> convert -> "
+        "download flows against it. Reports p50/p95/p99 latency, throughput, error and "
+        "timeout rates and RSS per worker as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', default=os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+                            help='Gunicorn config file to boot (default: gunicorn.conf.py)')
+        parser.add_argument('--app', help='WSGI/ASGI application path (default: chosen from the profile worker class)')
+        parser.add_argument('--gunicorn-arg', action='append', default=[], dest='gunicorn_args',
+                            help='Extra gunicorn CLI option, e.g. --gunicorn-arg=--workers=4 (repeatable)')
+        parser.add_argument('--env', action='append', default=[], help='KEY=VALUE for the server environment')
+        parser.add_argument('--url', help='Target an already running deployment instead of booting one')
+        parser.add_argument('--concurrency', type=int, default=4, help='Simultaneous users')
+        parser.add_argument('--flows', type=int, default=20, help='Total flows to run')
+        parser.add_argument('--mode', choices=('chunked', 'multipart'), default='chunked')
+        parser.add_argument('--video', help='Source video to upload (default: generated with lavfi)')
+        parser.add_argument('--resolution', default='1280x720', help='Generated video resolution')
+        parser.add_argument('--length', type=int, default=20, help='Generated video length in seconds')
+        parser.add_argument('--start-time', default='00:00:05')
+        parser.add_argument('--timeout', type=float, default=180, help='Client timeout per request in seconds')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        video = options['video'] or self.generate_video(options)
+        server = None
+        base_url = options['url']
+        try:
+            if not base_url:
+                server, base_url = self.boot(options)
+            sampler = loadtest.RssSampler(server.pid) if server else None
+            if sampler:
+                sampler.start()
+
+            self.stderr.write(f"Running {options['flows']} {options['mode']} flows, "
+                              f"{options['concurrency']} at a time, against {base_url}")
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                futures = [
+                    pool.submit(loadtest.run_flow, base_url, video, options['mode'], options['start_time'],
+                                options['timeout'])
+                    for _flow in range(options['flows'])
+                ]
+                results = [future.result() for future in futures]
+            elapsed = time.monotonic() - started
+
+            report = {
+                'target': base_url,
+                'profile': None if options['url'] else options['profile'],
+                'gunicorn_args': options['gunicorn_args'],
+                'env': options['env'],
+                'mode': options['mode'],
+                'concurrency': options['concurrency'],
+                'video': {'path': video, 'bytes': os.path.getsize(video)},
+                'summary': loadtest.summarize(results, elapsed),
+            }
+            if sampler:
+                sampler.stop()
+                report['rss'] = sampler.summary()
+        finally:
+            if server is not None:
+                self.shutdown(server)
+
+        summary = report['summary']
+        latency = summary['latency_seconds']
+        if latency['count']:
+            self.stderr.write(
+                f"{summary['succeeded']}/{summary['flows']} ok, {summary['throughput_per_second']:.2f} flows/s, "
+                f"p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s p99 {latency['p99']:.2f}s, "
+                f"errors {summary['error_rate']:.1%}, timeouts {summary['timeout_rate']:.1%}"
+            )
+        else:
+            self.stderr.write(f"All {summary['flows']} flows failed: {summary['errors']}")
+        body = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+    def generate_video(self, options) -> str:
+        spec = benchmark.InputSpec('testsrc2', 'h264', options['resolution'], options['length'])
+        try:
+            return benchmark.ensure_input(spec, os.path.join(tempfile.gettempdir(), 'chromi-bench-inputs'))
+        except (OSError, subprocess.CalledProcessError) as exc:
+            raise CommandError(f"Could not generate a test video (is ffmpeg installed?): {exc}")
+
+    def boot(self, options):
+        profile = options['profile']
+        app = options['app']
+        if not app:
+            with open(profile) as f:
+                asgi = 'UvicornWorker' in f.read() or any('uvicorn' in arg for arg in options['gunicorn_args'])
+            app = 'chrome_background_converter.asgi:application' if asgi else 'chrome_background_converter.wsgi:application'
+
+        env = dict(os.environ)
+        for item in options['env']:
+            key, _sep, value = item.partition('=')
+            env[key] = value
+        port = _free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        cmd = [sys.executable, '-m', 'gunicorn', app, '-c', profile, '--bind', f'127.0.0.1:{port}',
+               *options['gunicorn_args']]
+        self.stderr.write(f"Booting: {' '.join(cmd)}")
+        server = subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {server.returncode} during startup")
+            try:
+                with urllib.request.urlopen(base_url + '/health/', timeout=1):
+                    return server, base_url
+            except OSError:
+                time.sleep(0.2)
+        self.shutdown(server)
+        raise CommandError('gunicorn did not become healthy within 30 seconds')
+
+    def shutdown(self, server):
+        if server.poll() is None:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
@@ -0,0 +1,25 @@
+import json
+from django.core.management.base import BaseCommand
+from converter import artifact_storage, artifacts
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove temp uploads and converted GIFs past their TTL, evict the oldest until the "
+        "work directory fits ARTIFACT_QUOTA_BYTES, delete object-storage GIFs whose download "
+        "window has closed, and report the work directory's usage as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without removing it')
+        parser.add_argument('--usage-only', action='store_true', help='Only report usage, do not sweep')
+
+    def handle(self, *args, **options):
+        manager = artifacts.get_artifact_manager()
+        report = {}
+        if not options['usage_only']:
+            report['sweep'] = manager.sweep(dry_run=options['dry_run'])
+            if not options['dry_run']:
+                report['sweep']['discarded'] = artifact_storage.get_artifact_storage().sweep_discards()
+        report['usage'] = manager.usage()
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import tempfile
+import threading
+import linecache
+import tracemalloc
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** exp for exp in range(16, 32, 2))  # 64 KiB .. 1 GiB
+
+# name -> (type, help, buckets)
+METRICS = {
+    'chromi_stage_seconds': ('histogram', 'Wall time per pipeline stage', SECONDS_BUCKETS),
+    'chromi_ffmpeg_cpu_seconds': ('histogram', 'User + system CPU time of each ffmpeg process', SECONDS_BUCKETS),
+    'chromi_ffmpeg_peak_rss_bytes': ('histogram', 'Peak resident set size of each ffmpeg process', BYTES_BUCKETS),
+    'chromi_output_bytes': ('histogram', 'Size of each converted GIF', BYTES_BUCKETS),
+    'chromi_download_bytes': ('histogram', 'Bytes sent per download response', BYTES_BUCKETS),
+    'chromi_conversions_total': ('counter', 'Conversions by outcome', None),
+    'chromi_previews_total': ('counter', 'Trim preview GIFs by outcome', None),
+    'chromi_artifacts_removed_total': ('counter', 'Temp uploads and outputs removed by the sweeper, by reason', None),
+    'chromi_worker_recycles_total': ('counter', 'Conversion worker processes replaced, by reason', None),
+    'chromi_ffmpeg_limited_total': ('counter', 'ffmpeg runs refused or stopped by the resource governor, by limit', None),
+}
+
+
+def _label_key(labels: dict) -> str:
+    return json.dumps(sorted(labels.items()))
+
+
+class Registry:
+    """
+    Histograms and counters for this process. Every gunicorn worker and RQ worker
+    keeps its own registry and periodically writes a snapshot to METRICS_DIR; the
+    /metrics endpoint merges all snapshots, so whichever worker answers the scrape
+    reports the whole host.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'{self.pid}-{uuid.uuid4().hex[:8]}.json')
+        self._series = {}
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def observe(self, name: str, value: float, **labels):
+        _kind, _help, buckets = METRICS[name]
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(buckets)}
+            entry['count'] += 1
+            entry['sum'] += value
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    entry['buckets'][index] += 1
+        self._maybe_flush()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            data = json.dumps(self._series)
+            self._flushed = time.monotonic()
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as exc:
+            logger.warning(f"Could not write metrics snapshot: {exc}")
+
+    def collect(self, max_age: float = 86400):
+        """Merge the snapshots of every process on the host, dropping long-dead ones."""
+        self.flush()
+        merged = {}
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.json'):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, series in snapshot.items():
+                target = merged.setdefault(metric, {})
+                for key, value in series.items():
+                    if isinstance(value, dict):
+                        entry = target.setdefault(key, {'count': 0, 'sum': 0.0, 'buckets': [0] * len(value['buckets'])})
+                        entry['count'] += value['count']
+                        entry['sum'] += value['sum']
+                        entry['buckets'] = [a + b for a, b in zip(entry['buckets'], value['buckets'])]
+                    else:
+                        target[key] = target.get(key, 0) + value
+        return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def render(merged: dict) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key, value in sorted(merged.get(name, {}).items()):
+            labels = [tuple(pair) for pair in json.loads(key)]
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            for bound, count in zip(buckets, value['buckets']):
+                lines.append(f'{name}_bucket{_format_labels(labels + [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels + [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+    lines.extend(render_tracemalloc())
+    return '\n'.join(lines) + '\n'
+
+
+def render_tracemalloc(limit: int = None):
+    """Top allocation sites of the answering process, when ENABLE_TRACEMALLOC started tracing."""
+    if not tracemalloc.is_tracing():
+        return []
+    limit = limit or getattr(settings, 'TRACEMALLOC_TOP', 10)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        '# HELP chromi_tracemalloc_bytes Python heap traced by tracemalloc in this process',
+        '# TYPE chromi_tracemalloc_bytes gauge',
+        f'chromi_tracemalloc_bytes{{kind="current"}} {current}',
+        f'chromi_tracemalloc_bytes{{kind="peak"}} {peak}',
+        '# HELP chromi_tracemalloc_top_bytes Largest allocation sites (file:line) in this process',
+        '# TYPE chromi_tracemalloc_top_bytes gauge',
+    ]
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+    ))
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        labels = [('site', f'{frame.filename}:{frame.lineno}')]
+        lines.append(f'chromi_tracemalloc_top_bytes{_format_labels(labels)} {stat.size}')
+    return lines
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> Registry:
+    """This process's registry; a forked child (process job pool) gets its own."""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.pid != os.getpid():
+            directory = getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-metrics')
+            if _registry is None:
+                atexit.register(_flush_at_exit)
+            _registry = Registry(str(directory))
+        return _registry
+
+
+def _flush_at_exit():
+    if _registry is not None and _registry.pid == os.getpid():
+        _registry.flush()
+
+
+def observe(name: str, value: float, **labels):
+    """Record value in histogram name. Metrics must never break a conversion."""
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    try:
+        get_registry().observe(name, value, **labels)
+    except Exception as exc:
+        logger.warning(f"Could not record metric {name}: {exc}")
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    try:
+        get_registry().inc(name, amount, **labels)
+    except Exception as exc:
+        logger.warning(f"Could not record metric {name}: {exc}")
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as chromi_stage_seconds{stage=name}."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe('chromi_stage_seconds', time.monotonic() - started, stage=name)
+
+
+def observe_rusage(rusage):
+    """Record CPU time and peak RSS of a finished child from its struct rusage (os.wait4)."""
+    observe('chromi_ffmpeg_cpu_seconds', rusage.ru_utime + rusage.ru_stime)
+    # Linux reports ru_maxrss in KiB
+    observe('chromi_ffmpeg_peak_rss_bytes', rusage.ru_maxrss * 1024)
+
+
+def sample_process(pid: int):
+    """
+    (cpu_seconds, peak_rss_bytes) of a running process from /proc, or None. Used for
+    children reaped by asyncio, whose rusage we never get to see.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            hwm = next((int(line.split()[1]) for line in f if line.startswith('VmHWM:')), 0)
+    except (OSError, ValueError, IndexError):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    # utime and stime are fields 14 and 15; fields[] starts at field 3
+    return (int(fields[11]) + int(fields[12])) / ticks, hwm * 1024
@@ -0,0 +1,52 @@
+def minify_css(source: str) -> str:
+    """
+    Drop comments and collapse whitespace, also around { } ; , and after :. Strings
+    are copied untouched; nothing that changes meaning (selectors, calc()) is rewritten.
+    """
+    out = []
+    i, n = 0, len(source)
+    while i < n:
+        ch = source[i]
+        if ch in '"\'':
+            end = i + 1
+            while end < n and source[end] != ch:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif ch.isspace():
+            while i < n and source[i].isspace():
+                i += 1
+            if out and out[-1][-1] not in '{};,: ' and i < n and source[i] not in '{};,':
+                out.append(' ')
+        else:
+            if ch in '{};,' and out and out[-1] == ' ':
+                out.pop()
+            if ch == '}' and out and out[-1] == ';':
+                out.pop()
+            out.append(ch)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def minify_js(source: str) -> str:
+    """
+    Line-based and deliberately conservative: strips indentation, blank lines and
+    whole-line // comments but keeps every line break, so automatic semicolon
+    insertion sees the same program. Lines inside template literals are kept as-is.
+    """
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        toggles = (line.count('`') - line.count('\\`')) % 2
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.lstrip() if toggles else line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        if toggles:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
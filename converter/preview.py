@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import shutil
+import logging
+import subprocess
+from django.conf import settings
+from . import admission, engine, governor, metrics, probe
+
+logger = logging.getLogger(__name__)
+
+
+def preview_size():
+    """(width, height) of preview GIFs: PREVIEW_WIDTH wide, with the final GIF's aspect ratio."""
+    width, height, _fps = engine.output_params()
+    preview_width = getattr(settings, 'PREVIEW_WIDTH', 240)
+    return preview_width, max(2, round(preview_width * height / width / 2) * 2)
+
+
+def tile_size(info: probe.VideoInfo, tile_width: int):
+    """(width, height) of one sprite tile, keeping the source's displayed aspect ratio."""
+    width, height = info.width, info.height
+    if info.rotation in (90, 270):
+        width, height = height, width
+    if not width or not height:
+        return tile_width, max(2, round(tile_width * 9 / 16 / 2) * 2)
+    return tile_width, max(2, round(tile_width * height / width / 2) * 2)
+
+
+def sprite_plan(keyframes, max_tiles: int):
+    """(step, times): every step-th keyframe, so the sheet has at most max_tiles tiles."""
+    step = max(1, math.ceil(len(keyframes) / max_tiles))
+    return step, keyframes[::step]
+
+
+def sprite_command(input_path: str, output_path: str, step: int, tile_width: int, tile_height: int, columns: int,
+                   rows: int):
+    """
+    Only keyframes are decoded (-skip_frame nokey), so the cost is one intra frame per
+    GOP however long the video is. Every step-th one is scaled and tiled into one JPEG.
+    """
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-threads', '1',
+        '-skip_frame', 'nokey',
+        '-i', input_path,
+        '-vf', f"select='not(mod(n,{step}))',scale={tile_width}:{tile_height}:flags=fast_bilinear,"
+               f"tile={columns}x{rows}",
+        '-vsync', '0',
+        '-frames:v', '1',
+        '-q:v', '5',
+        '-y', output_path,
+    ]
+
+
+def preview_command(input_path: str, output_path: str, start_seconds: float, duration: float):
+    """A cheap single-threaded GIF: few frames, small, a reduced palette and no dithering."""
+    width, height = preview_size()
+    fps = getattr(settings, 'PREVIEW_FPS', 5)
+    colors = getattr(settings, 'PREVIEW_COLORS', 64)
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-threads', '1', '-filter_threads', '1',
+        '-ss', str(start_seconds),
+        '-t', str(duration),
+        '-i', input_path,
+        '-vf', f'fps={fps},scale={width}:{height}:flags=fast_bilinear,split[s0][s1];'
+               f'[s0]palettegen=max_colors={colors}[p];[s1][p]paletteuse=dither=none',
+        '-loop', '0',
+        '-y', output_path,
+    ]
+
+
+def _run(cmd, output_path: str, stage: str):
+    """Run cmd writing to a temp name next to output_path, then move the result into place."""
+    if not shutil.which('ffmpeg'):
+        raise engine.ConversionError("FFmpeg not found on system")
+    base, ext = os.path.splitext(output_path)
+    tmp = f'{base}.{os.getpid()}.tmp{ext}'
+    cmd = [tmp if arg == output_path else arg for arg in cmd]
+    logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+    with metrics.stage('admission'):
+        slot = admission.acquire()
+    try:
+        with slot, metrics.stage(stage):
+            result = governor.run(cmd, threads=slot.threads)
+        if result.returncode != 0 or not os.path.exists(tmp) or os.path.getsize(tmp) == 0:
+            stderr = result.stderr.decode(errors='replace')
+            logger.error(f"FFmpeg stderr: {stderr}")
+            raise engine.ConversionError(f"FFmpeg failed with return code {result.returncode}: {stderr}")
+        os.replace(tmp, output_path)
+    except subprocess.TimeoutExpired:
+        raise engine.ConversionError("Preview timed out")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def thumbnails(session) -> dict:
+    """
+    Sprite sheet metadata for a completed upload, building sprite.jpg in the upload's
+    directory on first use. tile i of the sheet shows the keyframe at times[i].
+    """
+    meta_path = os.path.join(session.directory, 'sprite.json')
+    sprite_path = os.path.join(session.directory, 'sprite.jpg')
+    try:
+        with open(meta_path) as f:
+            sheet = json.load(f)
+        if os.path.exists(sprite_path):
+            return sheet
+    except (OSError, ValueError):
+        pass
+
+    if not shutil.which('ffprobe'):
+        raise engine.ConversionError("Thumbnails need ffprobe")
+    info = probe.probe_video(session.data_path)
+    probe.check_pixel_rate(info)
+    keyframes = probe.all_keyframes(session.data_path) or [0.0]
+    step, times = sprite_plan(keyframes, getattr(settings, 'SPRITE_MAX_TILES', 100))
+    tile_width, tile_height = tile_size(info, getattr(settings, 'SPRITE_TILE_WIDTH', 160))
+    columns = min(len(times), getattr(settings, 'SPRITE_COLUMNS', 10))
+    rows = math.ceil(len(times) / columns)
+    _run(sprite_command(session.data_path, sprite_path, step, tile_width, tile_height, columns, rows), sprite_path,
+         'sprite')
+
+    sheet = {'duration': info.duration, 'tile_width': tile_width, 'tile_height': tile_height,
+             'columns': columns, 'rows': rows, 'times': times}
+    tmp = f'{meta_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(sheet, f)
+    os.replace(tmp, meta_path)
+    return sheet
+
+
+def sprite_path(session) -> str:
+    return os.path.join(session.directory, 'sprite.jpg')
+
+
+def preview(session, start_seconds: float, duration: float) -> str:
+    """
+    Path of a low-res preview GIF of the trim, encoded on first request and kept in
+    the upload's directory (the PREVIEW_CACHE_ENTRIES most recent per upload).
+    Raises probe.ProbeError for impossible trims, like a real conversion would.
+    """
+    _info, plan = probe.preflight(session.data_path, start_seconds, duration)
+    directory = os.path.join(session.directory, 'previews')
+    os.makedirs(directory, exist_ok=True)
+    # The seek plan is the key, so requests that snap to the same keyframe share a preview
+    path = os.path.join(directory, f'{round(plan.start * 1000)}-{round(plan.duration * 1000)}.gif')
+    if os.path.exists(path):
+        os.utime(path)
+        metrics.inc('chromi_previews_total', outcome='cache_hit')
+        return path
+
+    _run(preview_command(session.data_path, path, plan.start, plan.duration), path, 'preview')
+    metrics.inc('chromi_previews_total', outcome='ok')
+    _prune(directory, getattr(settings, 'PREVIEW_CACHE_ENTRIES', 16))
+    return path
+
+
+def _prune(directory: str, keep: int):
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.gif') and '.tmp' not in name:
+            try:
+                entries.append((os.path.getmtime(os.path.join(directory, name)), name))
+            except FileNotFoundError:
+                continue
+    for _mtime, name in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
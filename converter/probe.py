@@ -0,0 +1,181 @@
+import json
+import shutil
+import logging
+import subprocess
+from dataclasses import dataclass, field
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeError(ValueError):
+    """Raised when the input cannot be converted with the requested trim."""
+
+
+@dataclass
+class VideoInfo:
+    duration: float
+    codec: str = ''
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    rotation: int = 0
+    keyframes: list = field(default_factory=list)
+
+    @property
+    def display_size(self):
+        """Width and height after applying the rotation ffmpeg auto-rotates by."""
+        if self.rotation % 180:
+            return self.height, self.width
+        return self.width, self.height
+
+
+@dataclass
+class SeekPlan:
+    start: float
+    duration: float
+    strategy: str
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        num, _, den = rate.partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _run_ffprobe(args):
+    timeout = getattr(settings, 'PROBE_TIMEOUT', 15)
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error'] + args, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise ProbeError("Probing the video timed out")
+    if result.returncode != 0:
+        logger.error(f"ffprobe stderr: {result.stderr}")
+        raise ProbeError("Could not read the video file")
+    return result.stdout
+
+
+def probe_video(path: str) -> VideoInfo:
+    """Read duration, codec, resolution and rotation of the first video stream."""
+    output = _run_ffprobe([
+        '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=codec_name,width,height,avg_frame_rate,duration'
+                         ':stream_tags=rotate:stream_side_data=rotation',
+        '-of', 'json',
+        path,
+    ])
+    data = json.loads(output or '{}')
+    streams = data.get('streams') or []
+    if not streams:
+        raise ProbeError("No video stream found in the uploaded file")
+    stream = streams[0]
+
+    duration = stream.get('duration') or (data.get('format') or {}).get('duration')
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        raise ProbeError("Could not determine the video duration")
+
+    rotation = (stream.get('tags') or {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            rotation = side_data['rotation']
+
+    return VideoInfo(
+        duration=duration,
+        codec=stream.get('codec_name', ''),
+        width=int(stream.get('width') or 0),
+        height=int(stream.get('height') or 0),
+        fps=_parse_rate(stream.get('avg_frame_rate', '0/1')),
+        rotation=int(float(rotation)) % 360,
+    )
+
+
+def _packet_keyframes(path: str, options: list) -> list:
+    """Keyframe timestamps from packet flags (no decoding), sorted."""
+    output = _run_ffprobe(['-select_streams', 'v:0', *options, '-show_entries', 'packet=pts_time,flags',
+                           '-of', 'csv=p=0', path])
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(keyframes)
+
+
+def keyframes_near(path: str, start: float, window: float) -> list:
+    """
+    Return keyframe timestamps in [start - window, start + window].
+    Reads packet flags only (no decoding) and only around the requested start,
+    so the cost does not grow with the length of the upload.
+    """
+    return _packet_keyframes(path, ['-read_intervals', f"{max(0.0, start - window)}%{start + window}"])
+
+
+def all_keyframes(path: str) -> list:
+    """Every keyframe timestamp in the file, from packet flags only."""
+    return _packet_keyframes(path, [])
+
+
+def check_pixel_rate(info: VideoInfo):
+    """
+    Refuse inputs whose decode alone would swamp the box (e.g. 8K, or 4K at 120 fps):
+    pixels per second of source above MAX_INPUT_PIXEL_RATE cost the same to decode
+    whatever size the GIF is. The default admits phone footage up to 4K60.
+    """
+    limit = getattr(settings, 'MAX_INPUT_PIXEL_RATE', 3840 * 2160 * 60)
+    rate = info.width * info.height * info.fps
+    if limit and rate > limit:
+        metrics.inc('chromi_ffmpeg_limited_total', reason='pixel_rate')
+        raise ProbeError(f'Video is too demanding to convert ({info.width}x{info.height} at {info.fps:g} fps); '
+                         f'please upload a lower resolution or frame rate')
+
+
+def plan_seek(info: VideoInfo, start_seconds: float, duration: float) -> SeekPlan:
+    """
+    Choose an input-side seek for the encode. ffmpeg jumps to the keyframe before
+    `-ss` in the demuxer and only decodes one GOP, so cost stays flat whatever the
+    offset. When a keyframe sits within SEEK_SNAP_TOLERANCE of the requested start we
+    snap to it, which skips decoding the leading frames entirely.
+    """
+    if start_seconds >= info.duration:
+        raise ProbeError('Start time exceeds video duration')
+    check_pixel_rate(info)
+
+    tolerance = getattr(settings, 'SEEK_SNAP_TOLERANCE', 0.25)
+    start = float(start_seconds)
+    strategy = 'input'
+    if info.keyframes:
+        nearest = min(info.keyframes, key=lambda t: abs(t - start))
+        if abs(nearest - start) <= tolerance and nearest < info.duration:
+            start = nearest
+            strategy = 'keyframe'
+
+    return SeekPlan(start=start, duration=min(float(duration), info.duration - start), strategy=strategy)
+
+
+def preflight(path: str, start_seconds: float, duration: float):
+    """
+    Probe the input before any encode starts. Returns (VideoInfo, SeekPlan), or
+    (None, plain input seek) when ffprobe is not installed.
+    """
+    if not shutil.which('ffprobe'):
+        return None, SeekPlan(start=float(start_seconds), duration=float(duration), strategy='input')
+
+    with metrics.stage('probe'):
+        info = probe_video(path)
+        window = getattr(settings, 'SEEK_SNAP_TOLERANCE', 0.25)
+        if start_seconds > 0 and start_seconds < info.duration:
+            info.keyframes = keyframes_near(path, start_seconds, window)
+    plan = plan_seek(info, start_seconds, duration)
+    logger.info(
+        f"Probed {info.codec} {info.width}x{info.height} rot={info.rotation} "
+        f"duration={info.duration:.2f}s; seek={plan.strategy} start={plan.start:.3f}s"
+    )
+    return info, plan
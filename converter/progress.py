@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+import importlib
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# States after which a job's progress never changes again
+TERMINAL_STATES = ('finished', 'failed')
+
+
+class ProgressStore:
+    """
+    Latest progress snapshot per job, written by whichever process runs the job and
+    read by the web workers. Every publish() bumps `seq`, so readers can wait for
+    "anything newer than what I have" instead of re-polling the job backend.
+    """
+
+    def __init__(self, ttl: int = 600, poll_interval: float = 0.25):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def _read(self, job_id: str):
+        raise NotImplementedError
+
+    def _write(self, job_id: str, state: dict):
+        raise NotImplementedError
+
+    def get(self, job_id: str):
+        """Return the latest snapshot for job_id, or None if unknown or expired."""
+        return self._read(job_id)
+
+    def publish(self, job_id: str, **fields) -> dict:
+        # Each job has a single writer, so read-modify-write needs no locking
+        state = self._read(job_id) or {'job_id': job_id, 'seq': 0}
+        state.update(fields)
+        state['seq'] += 1
+        state['updated'] = time.time()
+        self._write(job_id, state)
+        return state
+
+    def wait(self, job_id: str, after: int = 0, timeout: float = 25):
+        """Block until the snapshot's seq exceeds after (or timeout) and return the latest snapshot."""
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self._read(job_id)
+            if state is not None and (state['seq'] > after or state.get('state') in TERMINAL_STATES):
+                return state
+            if time.monotonic() >= deadline:
+                return state
+            time.sleep(self.poll_interval)
+
+
+class LocalProgressStore(ProgressStore):
+    """In-process store for tests and the thread job backend."""
+
+    def __init__(self, ttl: int = 600, poll_interval: float = 0.05):
+        super().__init__(ttl, poll_interval)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _read(self, job_id: str):
+        with self._lock:
+            entry = self._states.get(job_id)
+        if entry is None or entry[1] < time.time():
+            return None
+        return dict(entry[0])
+
+    def _write(self, job_id: str, state: dict):
+        with self._lock:
+            self._states[job_id] = (dict(state), time.time() + self.ttl)
+
+
+class FileProgressStore(ProgressStore):
+    """Snapshots as small JSON files shared by every worker (and `rq worker`) on the host."""
+
+    def __init__(self, directory: str, ttl: int = 600, poll_interval: float = 0.25, prune_every: int = 50):
+        super().__init__(ttl, poll_interval)
+        self.directory = directory
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        # Job ids come from URLs; never let them escape the progress directory
+        return os.path.join(self.directory, os.path.basename(job_id) + '.json')
+
+    def _read(self, job_id: str):
+        path = self._path(job_id)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, job_id: str, state: dict):
+        path = self._path(job_id)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+class RedisProgressStore(ProgressStore):
+    """Snapshots in Redis, for jobs running on other nodes."""
+
+    def __init__(self, redis_url: str, ttl: int = 600, poll_interval: float = 0.25, prefix: str = 'chromi:progress:'):
+        super().__init__(ttl, poll_interval)
+        try:
+            redis_module = importlib.import_module('redis')
+        except Exception as exc:
+            raise RuntimeError('Redis not available') from exc
+        self.connection = getattr(redis_module, 'Redis').from_url(redis_url)
+        self.prefix = prefix
+
+    def _read(self, job_id: str):
+        value = self.connection.get(self.prefix + job_id)
+        return json.loads(value) if value is not None else None
+
+    def _write(self, job_id: str, state: dict):
+        self.connection.set(self.prefix + job_id, json.dumps(state), ex=self.ttl)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_progress_store() -> ProgressStore:
+    """Return the process-wide store selected by settings.PROGRESS_BACKEND."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            name = getattr(settings, 'PROGRESS_BACKEND', 'file')
+            ttl = getattr(settings, 'PROGRESS_TTL', 600)
+            if name == 'file':
+                directory = getattr(settings, 'PROGRESS_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-progress')
+                _store = FileProgressStore(str(directory), ttl=ttl)
+            elif name == 'redis':
+                _store = RedisProgressStore(getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+            elif name == 'local':
+                _store = LocalProgressStore(ttl=ttl)
+            else:
+                raise ValueError(f"Unknown PROGRESS_BACKEND: {name}")
+        return _store
+
+
+class JobProgress:
+    """
+    Progress callback for one job: pass it to engine.convert() and it publishes
+    ffmpeg's frame count, speed and encoded time. A failing store never fails the job.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started = time.monotonic()
+        self.last = {}
+
+    def publish(self, **fields):
+        try:
+            get_progress_store().publish(self.job_id, elapsed=round(time.monotonic() - self.started, 2), **fields)
+        except Exception as exc:
+            logger.warning(f"Could not publish progress for job {self.job_id}: {exc}")
+
+    def __call__(self, report: dict):
+        self.last = report
+        self.publish(state=report['phase'], **{k: v for k, v in report.items() if k not in ('phase', 'done')})
+
+    def finished(self, **fields):
+        self.publish(state='finished', percent=100.0, **fields)
+        if self.last:
+            speed = f"{self.last['speed']}x" if self.last.get('speed') is not None else 'n/a'
+            logger.info(f"Job {self.job_id} encoded {self.last['frame']} frames in "
+                        f"{time.monotonic() - self.started:.2f}s ({speed} realtime)")
+
+    def failed(self, error: str):
+        self.publish(state='failed', error=error)
+
+
+def publish_queued(job_id: str):
+    """Record a freshly enqueued job so event streams have something to report."""
+    try:
+        get_progress_store().publish(job_id, state='queued', percent=0.0)
+    except Exception as exc:
+        logger.warning(f"Could not publish progress for job {job_id}: {exc}")
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+import importlib
+from django.conf import settings
+from . import artifact_storage
+
+logger = logging.getLogger(__name__)
+
+
+def _remove_artifact(path: str):
+    if artifact_storage.is_remote(path):
+        artifact_storage.get_artifact_storage().discard(path)
+        return
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+class TokenRegistry:
+    """
+    Maps one-time download tokens to artifact locators (a local path, or an
+    s3:// URL with the s3 artifact storage). claim() is atomic: of any
+    number of concurrent callers across processes, exactly one gets the path.
+    """
+
+    def __init__(self, ttl: int = 600):
+        self.ttl = ttl
+
+    def issue(self, path: str, ttl: int = None) -> str:
+        token = str(uuid.uuid4())
+        self.put(token, path, ttl or self.ttl)
+        return token
+
+    def put(self, token: str, path: str, ttl: int):
+        raise NotImplementedError
+
+    def peek(self, token: str):
+        """Return the path for token without consuming it, or None."""
+        raise NotImplementedError
+
+    def claim(self, token: str):
+        """Consume token and return its path, or None if unknown, expired or already claimed."""
+        raise NotImplementedError
+
+
+class LocalTokenRegistry(TokenRegistry):
+    """In-process stand-in for tests and single-process development servers."""
+
+    def __init__(self, ttl: int = 600):
+        super().__init__(ttl)
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def put(self, token: str, path: str, ttl: int):
+        with self._lock:
+            self._tokens[token] = (path, time.time() + ttl)
+
+    def peek(self, token: str):
+        with self._lock:
+            entry = self._tokens.get(token)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def claim(self, token: str):
+        with self._lock:
+            entry = self._tokens.pop(token, None)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+
+class FileTokenRegistry(TokenRegistry):
+    """
+    Tokens as small JSON files in a directory shared by every worker on the host.
+    Claiming renames the token file, which the kernel guarantees only one caller wins.
+    """
+
+    def __init__(self, directory: str, ttl: int = 600, prune_every: int = 50):
+        super().__init__(ttl)
+        self.directory = directory
+        self.prune_every = prune_every
+        self._issued = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, token: str) -> str:
+        # Tokens come from URLs; never let them escape the registry directory
+        return os.path.join(self.directory, os.path.basename(token) + '.json')
+
+    def _read(self, path: str):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, token: str, path: str, ttl: int):
+        token_path = self._path(token)
+        tmp = f"{token_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'path': path, 'expires': time.time() + ttl}, f)
+        os.replace(tmp, token_path)
+
+        self._issued += 1
+        if self._issued % self.prune_every == 0:
+            self.prune()
+
+    def peek(self, token: str):
+        entry = self._read(self._path(token))
+        if entry is None or entry['expires'] < time.time():
+            return None
+        return entry['path']
+
+    def claim(self, token: str):
+        token_path = self._path(token)
+        claimed_path = f"{token_path}.{uuid.uuid4().hex}.claimed"
+        try:
+            os.rename(token_path, claimed_path)
+        except FileNotFoundError:
+            return None
+        entry = self._read(claimed_path)
+        try:
+            os.remove(claimed_path)
+        except OSError:
+            pass
+        if entry is None:
+            return None
+        if entry['expires'] < time.time():
+            _remove_artifact(entry['path'])
+            return None
+        return entry['path']
+
+    def prune(self):
+        """Drop expired tokens and the artifacts nobody came back to download."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            entry = self._read(os.path.join(self.directory, name))
+            if entry is None or entry['expires'] >= now:
+                continue
+            path = self.claim(name[:-len('.json')])
+            _remove_artifact(path)
+
+
+class RedisTokenRegistry(TokenRegistry):
+    """Tokens in Redis, shared by every worker on every node."""
+
+    def __init__(self, redis_url: str, ttl: int = 600, prefix: str = 'chromi:dl:'):
+        super().__init__(ttl)
+        try:
+            redis_module = importlib.import_module('redis')
+        except Exception as exc:
+            raise RuntimeError('Redis not available') from exc
+        self.connection = getattr(redis_module, 'Redis').from_url(redis_url)
+        self.prefix = prefix
+
+    def put(self, token: str, path: str, ttl: int):
+        self.connection.set(self.prefix + token, path, ex=ttl)
+
+    def peek(self, token: str):
+        value = self.connection.get(self.prefix + token)
+        return value.decode() if value is not None else None
+
+    def claim(self, token: str):
+        # GET + DEL inside MULTI/EXEC so only one client sees the value
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.get(self.prefix + token)
+        pipe.delete(self.prefix + token)
+        value, _deleted = pipe.execute()
+        return value.decode() if value is not None else None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_token_registry() -> TokenRegistry:
+    """Return the process-wide registry selected by settings.DOWNLOAD_TOKEN_BACKEND."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            name = getattr(settings, 'DOWNLOAD_TOKEN_BACKEND', 'file')
+            ttl = getattr(settings, 'DOWNLOAD_TOKEN_TTL', 600)
+            if name == 'file':
+                directory = getattr(settings, 'DOWNLOAD_TOKEN_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-tokens')
+                _registry = FileTokenRegistry(str(directory), ttl=ttl)
+            elif name == 'redis':
+                _registry = RedisTokenRegistry(getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+            elif name == 'local':
+                _registry = LocalTokenRegistry(ttl=ttl)
+            else:
+                raise ValueError(f"Unknown DOWNLOAD_TOKEN_BACKEND: {name}")
+        return _registry
+
+
+def issue_download(path: str) -> str:
+    """Publish path to the artifact storage, register it for a one-time download and return its URL."""
+    tokens = get_token_registry()
+    store = artifact_storage.get_artifact_storage()
+    locator = store.publish(path)
+    if artifact_storage.is_remote(locator):
+        # Deleted even if the token expires unclaimed, which no registry reports back
+        store.schedule_discard(locator, after=tokens.ttl)
+    token = tokens.issue(locator)
+    return f"/download/{token}/"
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+from . import engine, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(content_hash: str, start_seconds: float, duration: float, preset: str = None) -> str:
+    """
+    Key a result by the source bytes plus every parameter that changes the output.
+    Trim values are normalized so '5', 5 and 5.0 map to the same entry. Batch clips
+    pass their preset and get keys of their own (batches ignore GIF_TARGET_BYTES).
+    """
+    width, height, fps = engine.preset_params(preset) if preset else engine.output_params()
+    params = {
+        'source': content_hash,
+        'start': round(float(start_seconds), 3),
+        'duration': round(float(duration), 3),
+        'width': width,
+        'height': height,
+        'fps': fps,
+        'backend': getattr(settings, 'CONVERSION_BACKEND', 'ffmpeg'),
+        'target_bytes': engine.target_bytes_setting(),
+    }
+    if preset:
+        params['preset'] = preset
+    if getattr(settings, 'LOOP_SEARCH', False):
+        params['loop_search'] = [getattr(settings, 'LOOP_SEARCH_WINDOW', 0.5), getattr(settings, 'LOOP_SEARCH_BIAS', 2.0)]
+    if getattr(settings, 'GIF_OPTIMIZE', False):
+        params['optimize'] = [getattr(settings, 'GIF_OPTIMIZE_FUZZ', 10.0), getattr(settings, 'GIF_OPTIMIZE_LOSSY', 0)]
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def _link_or_copy(src: str, dest: str):
+    """Atomically place a hardlink (or, across filesystems, a copy) of src at dest."""
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of converted GIFs with a byte budget.
+    Entries are evicted least-recently-used first (hits refresh the mtime), and
+    callers hand out hardlinks so a one-time download never deletes the cached copy.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_dir = os.path.join(directory, 'locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.gif')
+
+    def get(self, key: str):
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def copy_to(self, key: str, dest: str) -> bool:
+        """Place the cached result for key at dest. Returns False on a miss."""
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            _link_or_copy(path, dest)
+        except FileNotFoundError:
+            # Evicted between get() and link
+            return False
+        return True
+
+    def put(self, key: str, src: str):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link_or_copy(src, path)
+        self.evict()
+
+    @contextmanager
+    def lock(self, key: str):
+        """
+        Exclusive lock per key across threads and processes, so identical in-flight
+        requests wait for the first encode instead of running their own.
+        """
+        lock_path = os.path.join(self.lock_dir, f'{key}.lock')
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def alock(self, key: str, poll_interval: float = 0.1):
+        """lock() for async callers: polls instead of blocking the event loop in flock()."""
+        lock_path = os.path.join(self.lock_dir, f'{key}.lock')
+        with open(lock_path, 'a') as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_interval)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def entries(self):
+        """Return (mtime, size, path) for every cached result."""
+        found = []
+        for root, _dirs, files in os.walk(self.directory):
+            if root == self.lock_dir:
+                continue
+            for name in files:
+                if not name.endswith('.gif'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def usage(self) -> int:
+        return sum(size for _mtime, size, _path in self.entries())
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits its byte budget."""
+        entries = sorted(self.entries())
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logger.info(f"Evicted cached result {os.path.basename(path)} ({size} bytes)")
+            except FileNotFoundError:
+                pass
+        self._prune_locks()
+
+    def _prune_locks(self, max_age: int = 3600):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                with open(path, 'a') as lock_file:
+                    # Only remove locks nobody holds right now
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache, or None when RESULT_CACHE_MAX_BYTES is 0."""
+    global _cache
+    max_bytes = getattr(settings, 'RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    if not max_bytes:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            directory = getattr(settings, 'RESULT_CACHE_DIR', None) or os.path.join(tempfile.gettempdir(), 'chromi-cache')
+            _cache = ResultCache(str(directory), max_bytes)
+        return _cache
+
+
+def convert_cached(input_path: str, output_path: str, start_seconds: float, duration: float, content_hash: str = None,
+                   progress=None, background: bool = False) -> bool:
+    """
+    Like engine.convert, but served from the result cache when the same source was
+    already converted with the same parameters. Returns True on a cache hit.
+    """
+    result_cache = get_result_cache()
+    if result_cache is None or not content_hash:
+        engine.convert(input_path, output_path, start_seconds, duration, progress=progress, background=background)
+        return False
+
+    key = cache_key(content_hash, start_seconds, duration)
+    if result_cache.copy_to(key, output_path):
+        logger.info(f"Result cache hit for {key[:12]}")
+        metrics.inc('chromi_conversions_total', outcome='cache_hit')
+        return True
+
+    with result_cache.lock(key):
+        # An identical request may have finished while we waited for the lock
+        if result_cache.copy_to(key, output_path):
+            logger.info(f"Result cache hit for {key[:12]} after waiting on in-flight encode")
+            metrics.inc('chromi_conversions_total', outcome='cache_hit')
+            return True
+        engine.convert(input_path, output_path, start_seconds, duration, progress=progress, background=background)
+        result_cache.put(key, output_path)
+    return False
+
+
+async def convert_cached_async(input_path: str, output_path: str, start_seconds: float, duration: float,
+                               content_hash: str = None) -> bool:
+    """convert_cached() for async views."""
+    result_cache = get_result_cache()
+    if result_cache is None or not content_hash:
+        await engine.convert_async(input_path, output_path, start_seconds, duration)
+        return False
+
+    key = cache_key(content_hash, start_seconds, duration)
+    if result_cache.copy_to(key, output_path):
+        logger.info(f"Result cache hit for {key[:12]}")
+        metrics.inc('chromi_conversions_total', outcome='cache_hit')
+        return True
+
+    async with result_cache.alock(key):
+        if result_cache.copy_to(key, output_path):
+            logger.info(f"Result cache hit for {key[:12]} after waiting on in-flight encode")
+            metrics.inc('chromi_conversions_total', outcome='cache_hit')
+            return True
+        await engine.convert_async(input_path, output_path, start_seconds, duration)
+        result_cache.put(key, output_path)
+    return False
+
+
+def convert_batch_cached(input_path: str, clips, output_paths, content_hash: str = None, progress=None,
+                         background: bool = False):
+    """
+    engine.convert_batch() for the clips not already in the result cache; returns
+    one cache-hit flag per clip. Clips are not locked against identical in-flight
+    batches (taking several flocks in varying order could deadlock), so a race costs
+    at most a duplicate encode.
+    """
+    result_cache = get_result_cache()
+    if result_cache is None or not content_hash:
+        engine.convert_batch(input_path, clips, output_paths, progress=progress, background=background)
+        return [False] * len(clips)
+
+    keys = [cache_key(content_hash, clip.start, clip.duration, clip.preset) for clip in clips]
+    hits = [result_cache.copy_to(key, path) for key, path in zip(keys, output_paths)]
+    for _hit in filter(None, hits):
+        metrics.inc('chromi_conversions_total', outcome='cache_hit')
+    misses = [index for index, hit in enumerate(hits) if not hit]
+    if misses:
+        engine.convert_batch(input_path, [clips[index] for index in misses], [output_paths[index] for index in misses],
+                             progress=progress, background=background)
+        for index in misses:
+            result_cache.put(keys[index], output_paths[index])
+    logger.info(f"Batch of {len(clips)} clip(s): {len(clips) - len(misses)} served from the result cache")
+    return hits
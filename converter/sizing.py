@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import tempfile
+from dataclasses import dataclass, asdict
+from django.conf import settings
+from . import gif, governor, metrics
+
+logger = logging.getLogger(__name__)
+
+# Marks the GIF comment that records how a budgeted GIF was encoded
+COMMENT_PREFIX = b'chromi-encoding:'
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """The knobs that trade GIF size for quality, rendered as ffmpeg filter options."""
+    fps: int
+    colors: int = 256
+    dither: str = 'sierra2_4a'
+    stats_mode: str = 'full'
+
+    @property
+    def palettegen(self) -> str:
+        if (self.colors, self.stats_mode) == (256, 'full'):
+            return 'palettegen'
+        return f'palettegen=max_colors={self.colors}:stats_mode={self.stats_mode}'
+
+    @property
+    def paletteuse(self) -> str:
+        options = []
+        if self.dither != 'sierra2_4a':
+            options.append(f'dither={self.dither}')
+        if self.dither == 'bayer':
+            options.append('bayer_scale=3')
+        if self.stats_mode == 'diff':
+            # Only re-quantize the rectangle that changed; pairs with per-change palette stats
+            options.append('diff_mode=rectangle')
+        return 'paletteuse' + ('=' + ':'.join(options) if options else '')
+
+
+def ladder(fps: int):
+    """Candidate encodings from best looking to smallest, never above the configured fps."""
+    steps = [
+        (fps, 256, 'sierra2_4a', 'full'),
+        (fps, 256, 'bayer', 'diff'),
+        (fps, 128, 'bayer', 'diff'),
+        (12, 128, 'bayer', 'diff'),
+        (10, 64, 'bayer', 'diff'),
+        (10, 32, 'none', 'diff'),
+        (8, 32, 'none', 'diff'),
+    ]
+    candidates = []
+    for step_fps, colors, dither, stats_mode in steps:
+        encoding = Encoding(min(step_fps, fps), colors, dither, stats_mode)
+        if encoding not in candidates:
+            candidates.append(encoding)
+    return candidates
+
+
+def sample_command(input_path: str, start_seconds: float, duration: float, candidates, output_paths,
+                   width: int, height: int, windows: int, window_seconds: float):
+    """
+    One ffmpeg run that decodes the trim once, keeps `windows` short runs of
+    consecutive frames spread over it, and encodes those runs with every candidate
+    through split outputs. Frames are dropped to the highest candidate fps and to the
+    windows before scaling, so only sampled frames are scaled. The windows are
+    spliced back to back, so with stats_mode=diff the jump between two windows counts
+    as a change, like a scene cut; that errs towards larger estimates.
+    """
+    period = duration / windows
+    window = f"select='lt(mod(t,{period:.3f}),{window_seconds})'"
+    top_fps = max(encoding.fps for encoding in candidates)
+    branches = [f'[0:v]fps={top_fps},{window},scale={width}:{height}:flags=lanczos,split={len(candidates)}'
+                + ''.join(f'[in{index}]' for index in range(len(candidates)))]
+    for index, encoding in enumerate(candidates):
+        # fps fills the gaps between windows with repeated frames; selecting again drops them
+        rate = f'fps={encoding.fps},{window},' if encoding.fps < top_fps else ''
+        branches.append(
+            f"[in{index}]{rate}split[a{index}][b{index}];"
+            f"[a{index}]{encoding.palettegen}[p{index}];[b{index}][p{index}]{encoding.paletteuse}[out{index}]"
+        )
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+           '-ss', str(start_seconds), '-t', str(duration), '-i', input_path,
+           '-filter_complex', ';'.join(branches)]
+    for index, path in enumerate(output_paths):
+        cmd += ['-map', f'[out{index}]', '-loop', '0', '-y', path]
+    return cmd
+
+
+def estimate_bytes(sample: gif.Gif, sample_size: int, encoding: Encoding, duration: float) -> int:
+    """
+    Scale the sample GIF to the full trim: fixed header bytes plus the mean frame size
+    times the frame count. The first frame of each window is a full frame, so the
+    estimate errs on the large side.
+    """
+    header = len(gif.Gif(sample.width, sample.height, sample.flags, sample.background, sample.aspect,
+                         sample.color_table, loop=0).encode())
+    per_frame = (sample_size - header) / max(1, len(sample.frames))
+    return int(header + per_frame * max(1, round(duration * encoding.fps)))
+
+
+def plan(input_path: str, start_seconds: float, duration: float, target_bytes: int, width: int, height: int,
+         fps: int, threads: int = None):
+    """
+    Pick the best-looking encoding predicted to fit target_bytes (less a safety
+    margin) from one sampled pass. Returns (encoding, estimated_bytes); if nothing
+    fits, the smallest candidate.
+    """
+    candidates = ladder(fps)
+    windows = getattr(settings, 'TARGET_SIZE_SAMPLE_WINDOWS', 3)
+    window_seconds = min(getattr(settings, 'TARGET_SIZE_WINDOW_SECONDS', 0.5), duration / windows)
+    budget = target_bytes * getattr(settings, 'TARGET_SIZE_MARGIN', 0.9)
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix='chromi-sizing-') as work_dir:
+        paths = [os.path.join(work_dir, f'sample-{index}.gif') for index in range(len(candidates))]
+        cmd = sample_command(input_path, start_seconds, duration, candidates, paths, width, height, windows,
+                             window_seconds)
+        logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
+        governor.run(cmd, threads=threads, check=True, cwd=os.path.dirname(input_path))
+        estimates = []
+        for encoding, path in zip(candidates, paths):
+            estimates.append((encoding, estimate_bytes(gif.read(path), os.path.getsize(path), encoding, duration)))
+    metrics.observe('chromi_stage_seconds', time.monotonic() - started, stage='size_plan')
+
+    encoding, estimated = next(((enc, size) for enc, size in estimates if size <= budget),
+                               min(estimates, key=lambda item: item[1]))
+    logger.info(f"Target {target_bytes} bytes: chose {encoding} (estimated {estimated} bytes) from "
+                + ', '.join(f'{size}' for _enc, size in estimates))
+    return encoding, estimated
+
+
+def record(output_path: str, encoding: Encoding, target_bytes: int, estimated_bytes: int):
+    """Store the chosen parameters in the GIF itself, as a comment right after the header."""
+    details = dict(asdict(encoding), target_bytes=target_bytes, estimated_bytes=estimated_bytes,
+                   encoded_bytes=os.path.getsize(output_path))
+    gif.insert_comment(output_path, COMMENT_PREFIX + json.dumps(details, sort_keys=True).encode())
+
+
+def recorded_encoding(path: str):
+    """The parameters record() stored in a GIF, or None for GIFs encoded without a budget."""
+    try:
+        comment = gif.read_comment(path)
+    except (OSError, gif.GifError):
+        return None
+    if not comment or not comment.startswith(COMMENT_PREFIX):
+        return None
+    try:
+        return json.loads(comment[len(COMMENT_PREFIX):])
+    except ValueError:
+        return None
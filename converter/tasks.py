@@ -1,52 +1,35 @@
 import os
-import uuid
 import logging
-import gc
-import tempfile
 from django.conf import settings
-from moviepy.editor import VideoFileClip
-from django.core.cache import cache
+from . import artifacts, engine, metrics, progress, registry, result_cache, sizing
 
 logger = logging.getLogger(__name__)
 
 
-def convert_video_task(upload_path: str, output_basename: str, start_seconds: int, duration: int):
+def convert_video_task(upload_path: str, output_basename: str, start_seconds: int, duration: int, content_hash: str = None,
+                       job_id: str = None):
     """
     Background task: convert a trimmed segment of a video into a GIF suitable for Chrome backgrounds.
-    Memory-conscious: loads without audio, trims early, downscales early, and ensures resources are closed.
+    Uses the same conversion engine as the request path, so output and cost match the sync view.
+    With a job_id, encoder progress is published for the job's event stream.
     Returns a dict with converted_url on success.
     """
     # Use a secure temporary file for the conversion output
-    output_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.gif')
-    output_path = output_temp.name
-    output_temp.close()
+    output_path = artifacts.create('outputs', '.gif')
 
-    video = None
-    trimmed_video = None
+    converted_url = None
+    reporter = progress.JobProgress(job_id) if job_id else None
     try:
-        video = VideoFileClip(upload_path, audio=False)
+        with metrics.stage('job'):
+            cache_hit = result_cache.convert_cached(upload_path, output_path, start_seconds, duration, content_hash,
+                                                    progress=reporter, background=True)
 
-        if start_seconds >= video.duration:
-            raise ValueError('Start time exceeds video duration')
-
-        end_seconds = min(start_seconds + duration, video.duration)
-        trimmed_video = video.subclip(start_seconds, end_seconds)
-
-        # Early downscale
-        trimmed_video = trimmed_video.resize(width=1280, height=720)
-
-        trimmed_video.write_gif(
-            output_path,
-            fps=24,
-            program='ffmpeg',
-            opt='OptimizePlus',
-            fuzz=1,
-        )
-
-        # Register a one-time download token for the temp output
-        download_token = str(uuid.uuid4())
-        cache.set(f'dl:{download_token}', output_path, timeout=600)
-        converted_url = f"/download/{download_token}/"
+        # Parameters chosen for a byte budget travel inside the GIF; surface them with the result
+        extra = {}
+        if engine.target_bytes_setting():
+            extra['encoding'] = sizing.recorded_encoding(output_path)
+        # Register a one-time download token for the temp output, visible to the web workers
+        converted_url = registry.issue_download(output_path)
         # Optional: if running under RQ, store meta
         try:
             # Import lazily to avoid hard dependency when RQ is not installed
@@ -61,29 +44,66 @@ def convert_video_task(upload_path: str, output_basename: str, start_seconds: in
         except Exception:
             pass
 
-        return {'success': True, 'converted_url': converted_url}
+        if reporter is not None:
+            reporter.finished(converted_url=converted_url, cached=cache_hit, **extra)
+        return dict({'success': True, 'converted_url': converted_url}, **extra)
     except Exception as exc:
         logger.exception("Background conversion failed: %s", exc)
+        if reporter is not None:
+            reporter.failed(str(exc))
         return {'success': False, 'error': str(exc)}
     finally:
+        # Remove the upload temp file
         try:
-            if trimmed_video is not None:
-                trimmed_video.close()
+            if upload_path and os.path.exists(upload_path):
+                os.remove(upload_path)
         except Exception:
             pass
+        # On success the output is served by token and deleted after serving
         try:
-            if video is not None:
-                video.close()
+            if not converted_url and os.path.exists(output_path):
+                os.remove(output_path)
         except Exception:
             pass
-        del trimmed_video
-        del video
-        # Remove the upload temp file
+
+
+def convert_batch_task(upload_path: str, specs, content_hash: str = None, job_id: str = None):
+    """
+    Background task for a batch: every [start, duration, preset] spec becomes its own
+    GIF, all from one decode of the source. Returns a dict with one clip entry
+    (including converted_url) per spec.
+    """
+    clips = [engine.Clip(float(start), float(duration), preset) for start, duration, preset in specs]
+    output_paths = []
+    issued = False
+    reporter = progress.JobProgress(job_id) if job_id else None
+    try:
+        output_paths = [artifacts.create('outputs', '.gif') for _clip in clips]
+        with metrics.stage('job'):
+            hits = result_cache.convert_batch_cached(upload_path, clips, output_paths, content_hash,
+                                                     progress=reporter, background=True)
+        results = [{'start': clip.start, 'duration': clip.duration, 'preset': clip.preset, 'cached': hit,
+                    'converted_url': registry.issue_download(path)}
+                   for clip, hit, path in zip(clips, hits, output_paths)]
+        issued = True
+        if reporter is not None:
+            reporter.finished(clips=results)
+        return {'success': True, 'clips': results}
+    except Exception as exc:
+        logger.exception("Background batch conversion failed: %s", exc)
+        if reporter is not None:
+            reporter.failed(str(exc))
+        return {'success': False, 'error': str(exc)}
+    finally:
         try:
             if upload_path and os.path.exists(upload_path):
                 os.remove(upload_path)
         except Exception:
             pass
-        # Do not remove output here because it is served by token and deleted after serving
-        gc.collect()
-
+        if not issued:
+            for path in output_paths:
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except Exception:
+                    pass
@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import io
+import os
+import json
+import time
+import fcntl
+import fnmatch
+import resource
+import asyncio
+import hashlib
+import uuid
+import shutil
+import signal
+import sys
+import tempfile
+import importlib
+import threading
+import subprocess
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, LiveServerTestCase, TestCase, override_settings
+from django.urls import path
+from django.core.handlers.asgi import ASGIHandler
+
+from . import admission, artifact_storage, artifacts, benchmark, delivery, engine, gif, gifopt, governor, jobs, loadtest, looping, metrics, minify, preview, probe, progress, registry, result_cache, sizing, uploadhandlers, uploads, views, worker
+
+# Two report blocks as written by `ffmpeg -progress pipe:1`
+FFMPEG_PROGRESS = (
+    'frame=0\nfps=0.00\nout_time_us=0\nspeed=N/A\nprogress=continue\n'
+    'frame=45\nfps=30.00\nout_time_us=3000000\nspeed=2.5x\nprogress=end\n'
+)
+
+# Smallest plausible MP4 prefix: an ftyp box followed by the start of mdat
+MP4_HEAD = b'\x00\x00\x00\x14ftypisom\x00\x00\x02\x00isom' + b'\x00\x00\x00\x10mdat' + b'\x00' * 8
+
+
+# Stand-in ffmpeg: prints progress and writes a tiny "GIF" to its last argument
+FAKE_FFMPEG_SCRIPT = f"printf '{FFMPEG_PROGRESS}'\nfor last; do :; done\nprintf GIF > \"$last\"\n"
+
+
+# A 1x1 single-frame GIF; palette is the 6-byte global colour table
+def tiny_gif(palette=b'\x00\x00\x00\xff\xff\xff'):
+    return (b'GIF89a\x01\x00\x01\x00\x80\x00\x00' + palette + b'\x21\xf9\x04\x00\x0a\x00\x00\x00'
+            b'\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b')
+
+
+def fake_ffmpeg(test, body):
+    """Put an `ffmpeg` shell script running body in a temp dir and return the dir for PATH."""
+    bin_dir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, bin_dir)
+    script = os.path.join(bin_dir, 'ffmpeg')
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\n' + body)
+    os.chmod(script, 0o755)
+    return bin_dir
+
+
+def record_start(path):
+    """Pool child body for WorkerPoolTests: note that it ran, then exit."""
+    with open(path, 'a') as f:
+        f.write(f'{os.getpid()}\n')
+
+
+def echo_task(*args):
+    return {'success': True, 'converted_url': f"/download/{args[0]}/"}
+
+
+class PoolJobBackendTests(TestCase):
+    def wait_for(self, backend, job_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = backend.status(job_id)
+            if status['status'] in ('finished', 'failed'):
+                return status
+            time.sleep(0.01)
+        self.fail('job did not finish')
+
+    def test_thread_backend_runs_task_and_reports_result(self):
+        backend = jobs.PoolJobBackend(max_workers=1)
+        job_id = backend.enqueue('converter.tests.echo_task', 'abc')
+        status = self.wait_for(backend, job_id)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual(status['converted_url'], '/download/abc/')
+
+    def test_unknown_job(self):
+        backend = jobs.PoolJobBackend(max_workers=1)
+        self.assertIsNone(backend.status('missing'))
+
+
+class AsyncConvertViewTests(TestCase):
+    @override_settings(USE_RQ=True, RESULT_CACHE_MAX_BYTES=0)
+    def test_convert_enqueues_and_returns_job_id(self):
+        upload = SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4')
+        with mock.patch.object(jobs, 'enqueue_conversion', return_value='job-1') as enqueue, \
+                mock.patch.object(probe, 'preflight'):
+            response = self.client.post('/convert/', {'video': upload, 'start_time': '00:00:05'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job_id'], 'job-1')
+        upload_path = enqueue.call_args[0][0]
+        self.addCleanup(os.remove, upload_path)
+        self.assertTrue(os.path.exists(upload_path))
+        self.assertEqual(enqueue.call_args[0][1:3], (5, 6))
+        self.assertEqual(enqueue.call_args[0][3], hashlib.sha256(MP4_HEAD).hexdigest())
+
+
+class EngineTests(TestCase):
+    @override_settings(GIF_WIDTH=320, GIF_HEIGHT=180, GIF_FPS=10)
+    def test_ffmpeg_command_uses_shared_output_params(self):
+        cmd = engine.FFmpegBackend().build_command('in.mp4', 'out.gif', 3, 6)
+        vf = cmd[cmd.index('-vf') + 1]
+        self.assertIn('fps=10,scale=320:180', vf)
+        self.assertIn('palettegen', vf)
+
+    def test_falls_back_when_primary_backend_missing(self):
+        with mock.patch.object(engine.FFmpegBackend, 'is_available', return_value=False), \
+                mock.patch.object(engine.MoviePyBackend, 'is_available', return_value=True):
+            self.assertIsInstance(engine.get_backend(), engine.MoviePyBackend)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(engine.ConversionError):
+            engine.get_backend('gifski')
+
+
+class ProbeTests(TestCase):
+    def test_rejects_start_past_end(self):
+        with self.assertRaises(probe.ProbeError):
+            probe.plan_seek(probe.VideoInfo(duration=10.0), 10, 6)
+
+    def test_snaps_to_nearby_keyframe_and_clamps_duration(self):
+        info = probe.VideoInfo(duration=12.0, keyframes=[7.9, 10.0])
+        plan = probe.plan_seek(info, 8, 6)
+        self.assertEqual(plan.strategy, 'keyframe')
+        self.assertEqual(plan.start, 7.9)
+        self.assertAlmostEqual(plan.duration, 4.1)
+
+    def test_plain_input_seek_without_nearby_keyframe(self):
+        plan = probe.plan_seek(probe.VideoInfo(duration=60.0, keyframes=[30.0]), 40, 6)
+        self.assertEqual((plan.strategy, plan.start, plan.duration), ('input', 40.0, 6.0))
+
+    def test_rotation_swaps_display_size(self):
+        info = probe.VideoInfo(duration=1.0, width=1920, height=1080, rotation=90)
+        self.assertEqual(info.display_size, (1080, 1920))
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = result_cache.ResultCache(os.path.join(self.tmp, 'cache'), max_bytes=10)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_key_normalizes_trim_values(self):
+        self.assertEqual(result_cache.cache_key('abc', 5, 6), result_cache.cache_key('abc', 5.0, '6'))
+        self.assertNotEqual(result_cache.cache_key('abc', 5, 6), result_cache.cache_key('abd', 5, 6))
+
+    def test_checkout_survives_download_delete(self):
+        self.cache.put('aa11', self.write('out.gif', b'gif'))
+        dest = os.path.join(self.tmp, 'dl.gif')
+        self.assertTrue(self.cache.copy_to('aa11', dest))
+        os.remove(dest)
+        self.assertIsNotNone(self.cache.get('aa11'))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('aa11', self.write('a.gif', b'123456'))
+        os.utime(self.cache.path_for('aa11'), (1, 1))
+        self.cache.put('bb22', self.write('b.gif', b'123456'))
+        self.assertIsNone(self.cache.get('aa11'))
+        self.assertIsNotNone(self.cache.get('bb22'))
+
+    def test_convert_cached_encodes_once(self):
+        src = self.write('in.mp4', b'video')
+
+        def fake_convert(input_path, output_path, start_seconds, duration, **kwargs):
+            with open(output_path, 'wb') as f:
+                f.write(b'gif')
+
+        with mock.patch.object(result_cache, 'get_result_cache', return_value=self.cache), \
+                mock.patch.object(result_cache.engine, 'convert', side_effect=fake_convert) as convert:
+            self.assertFalse(result_cache.convert_cached(src, os.path.join(self.tmp, 'o1.gif'), 0, 6, 'h'))
+            self.assertTrue(result_cache.convert_cached(src, os.path.join(self.tmp, 'o2.gif'), 0, 6, 'h'))
+        self.assertEqual(convert.call_count, 1)
+
+
+class TokenRegistryTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_file_registry_claims_once_across_instances(self):
+        first = registry.FileTokenRegistry(self.tmp)
+        second = registry.FileTokenRegistry(self.tmp)
+        token = first.issue('/tmp/out.gif')
+        self.assertEqual(second.peek(token), '/tmp/out.gif')
+        self.assertEqual(second.claim(token), '/tmp/out.gif')
+        self.assertIsNone(first.claim(token))
+
+    def test_file_registry_prunes_expired_artifacts(self):
+        artifact = os.path.join(self.tmp, 'old.gif')
+        open(artifact, 'wb').close()
+        tokens = registry.FileTokenRegistry(os.path.join(self.tmp, 'tokens'))
+        token = tokens.issue(artifact, ttl=-1)
+        tokens.prune()
+        self.assertIsNone(tokens.claim(token))
+        self.assertFalse(os.path.exists(artifact))
+
+    def test_rejects_path_traversal(self):
+        tokens = registry.FileTokenRegistry(self.tmp)
+        self.assertIsNone(tokens.claim('../../etc/passwd'))
+
+    def test_local_registry(self):
+        tokens = registry.LocalTokenRegistry()
+        token = tokens.issue('/tmp/a.gif')
+        self.assertEqual(tokens.claim(token), '/tmp/a.gif')
+        self.assertIsNone(tokens.claim(token))
+
+
+@override_settings(DOWNLOAD_TOKEN_BACKEND='local')
+class DownloadTests(TestCase):
+    def setUp(self):
+        registry._registry = None
+        self.addCleanup(setattr, registry, '_registry', None)
+        fd, self.path = tempfile.mkstemp(suffix='.gif')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'GIF89a' + bytes(range(10)))
+        self.addCleanup(delivery.remove_file, self.path)
+        self.url = registry.issue_download(self.path)
+
+    def test_full_download_consumes_token_and_deletes_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'GIF89a' + bytes(range(10)))
+        response.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_partial_range_keeps_token(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-5/16')
+        self.assertEqual(b''.join(response.streaming_content), b'GIF89a')
+        response.close()
+        self.assertTrue(os.path.exists(self.path))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=6-')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10)))
+        response.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_conditional_request(self):
+        etag = delivery.make_etag(os.stat(self.path))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(os.path.exists(self.path))
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_OFFLOAD_ROOT=tempfile.gettempdir())
+    def test_proxy_offload(self):
+        with mock.patch.object(delivery, 'schedule_removal') as schedule_removal:
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-downloads/' + os.path.basename(self.path))
+        schedule_removal.assert_called_once_with(self.path)
+
+    def test_offloaded_file_removal_outlives_the_worker(self):
+        pending_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pending_dir)
+        store = artifact_storage.LocalArtifactStorage()
+        store.pending_dir = pending_dir
+        with mock.patch.object(artifact_storage, '_storage', store), self.settings(DOWNLOAD_OFFLOAD_GRACE=10):
+            delivery.schedule_removal(self.path)
+        self.assertTrue(os.path.exists(self.path))
+        # No timer is left behind: a later process finds the record once it is due
+        store = artifact_storage.LocalArtifactStorage()
+        store.pending_dir = pending_dir
+        self.assertEqual(store.sweep_discards(), 0)
+        self.assertEqual(store.sweep_discards(now=time.time() + 11), 1)
+        self.assertEqual((os.path.exists(self.path), os.listdir(pending_dir)), (False, []))
+
+    def test_parse_range(self):
+        self.assertEqual(delivery.parse_range('bytes=-4', 10), (6, 9))
+        self.assertEqual(delivery.parse_range('bytes=20-', 10), 'unsatisfiable')
+        self.assertIsNone(delivery.parse_range('bytes=0-1,3-4', 10))
+
+
+class UploadHandlerTests(TestCase):
+    def test_sniff_container(self):
+        self.assertEqual(uploadhandlers.sniff_container(MP4_HEAD), 'isobmff')
+        self.assertEqual(uploadhandlers.sniff_container(b'\x1a\x45\xdf\xa3rest'), 'matroska')
+        self.assertIsNone(uploadhandlers.sniff_container(b'<html><body>'))
+
+    def test_moov_before_mdat(self):
+        ftyp = MP4_HEAD[:20]
+        self.assertFalse(uploadhandlers.moov_before_mdat(MP4_HEAD))
+        self.assertTrue(uploadhandlers.moov_before_mdat(ftyp + b'\x00\x00\x00\x08free\x00\x00\x10\x00moov'))
+
+    def test_rejects_non_video_content(self):
+        upload = SimpleUploadedFile('clip.mp4', b'<html>' * 1000, content_type='video/mp4')
+        response = self.client.post('/convert/', {'video': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not a valid', response.json()['error'])
+
+    def test_rejects_unsupported_extension(self):
+        upload = SimpleUploadedFile('clip.avi', MP4_HEAD, content_type='video/x-msvideo')
+        response = self.client.post('/convert/', {'video': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('.webm', response.json()['error'])
+
+    def test_spooled_upload_is_taken_over_without_copy(self):
+        upload = SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4')
+        with mock.patch.object(result_cache, 'convert_cached', side_effect=RuntimeError('boom')) as convert:
+            response = self.client.post('/convert/?start_time=00:00:02', {'video': upload})
+        self.assertEqual(response.status_code, 500)
+        upload_path = convert.call_args[0][0]
+        self.assertEqual(convert.call_args[0][2:4], (2, 6))
+        self.assertFalse(os.path.exists(upload_path))
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        overrides = self.settings(UPLOAD_SESSION_DIR=self.tmp, UPLOAD_CHUNK_SIZE=16)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.body = MP4_HEAD + b'x' * 10  # 46 bytes: chunks of 16, 16 and 14
+
+    def create(self):
+        response = self.client.post('/uploads/', json.dumps({'filename': 'clip.mp4', 'size': len(self.body)}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put_chunk(self, upload_id, index):
+        data = self.body[index * 16:(index + 1) * 16]
+        return self.client.put(f'/uploads/{upload_id}/chunks/{index}/', data, content_type='application/octet-stream')
+
+    def test_out_of_order_chunks_resume_and_assemble(self):
+        session = self.create()
+        self.assertEqual(session['chunk_count'], 3)
+        self.assertEqual(self.put_chunk(session['upload_id'], 2).status_code, 200)
+        self.assertEqual(self.put_chunk(session['upload_id'], 0).status_code, 200)
+
+        status = self.client.get(f"/uploads/{session['upload_id']}/").json()
+        self.assertEqual((status['missing'], status['offset']), ([1], 16))
+        self.assertEqual(self.client.post(f"/uploads/{session['upload_id']}/complete/").status_code, 409)
+
+        self.put_chunk(session['upload_id'], 1)
+        status = self.client.post(f"/uploads/{session['upload_id']}/complete/").json()
+        self.assertTrue(status['completed'])
+        loaded = uploads.UploadSession.load(session['upload_id'])
+        with open(loaded.data_path, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(loaded.meta['content_hash'], hashlib.sha256(self.body).hexdigest())
+
+    def test_rejects_bad_first_chunk_and_wrong_length(self):
+        session = self.create()
+        response = self.client.put(f"/uploads/{session['upload_id']}/chunks/0/", b'<html>' + b'x' * 10,
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(f"/uploads/{session['upload_id']}/chunks/1/", b'short',
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_convert_by_upload_id_keeps_session_file(self):
+        session = self.create()
+        for index in range(3):
+            self.put_chunk(session['upload_id'], index)
+        self.client.post(f"/uploads/{session['upload_id']}/complete/")
+        loaded = uploads.UploadSession.load(session['upload_id'])
+
+        def fake_convert(input_path, output_path, start_seconds, duration, content_hash):
+            self.assertEqual((input_path, content_hash), (loaded.data_path, hashlib.sha256(self.body).hexdigest()))
+            return False
+
+        with mock.patch.object(result_cache, 'convert_cached', side_effect=fake_convert), \
+                self.settings(DOWNLOAD_TOKEN_BACKEND='local'):
+            registry._registry = None
+            self.addCleanup(setattr, registry, '_registry', None)
+            response = self.client.post('/convert/', {'upload_id': session['upload_id'], 'start_time': '00:00:01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.exists(loaded.data_path))
+        delivery.remove_file(registry.get_token_registry().claim(response.json()['converted_url'].split('/')[2]))
+
+    def test_unknown_or_incomplete_upload(self):
+        session = self.create()
+        response = self.client.post('/convert/', {'upload_id': session['upload_id']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/uploads/../etc/').status_code, 404)
+
+
+class ProgressTests(TestCase):
+    def setUp(self):
+        overrides = self.settings(USE_RQ=True, PROGRESS_BACKEND='local', PROGRESS_STREAM_SECONDS=1)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        progress._store = None
+        self.addCleanup(setattr, progress, '_store', None)
+
+    def test_parse_progress(self):
+        reports = list(engine.parse_progress(FFMPEG_PROGRESS.splitlines(), duration=6))
+        self.assertEqual(reports[0]['phase'], 'palette')
+        self.assertIsNone(reports[0]['speed'])
+        self.assertEqual((reports[1]['frame'], reports[1]['speed'], reports[1]['out_time']), (45, 2.5, 3.0))
+        self.assertEqual(reports[1]['percent'], 100.0)
+
+    def test_ffmpeg_backend_reports_progress(self):
+        bin_dir = fake_ffmpeg(self, FAKE_FFMPEG_SCRIPT)
+        output_path = os.path.join(bin_dir, 'out.gif')
+        reports = []
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            engine.FFmpegBackend().convert(os.path.join(bin_dir, 'in.mp4'), output_path, 0, 6, progress=reports.append)
+        self.assertEqual([r['phase'] for r in reports], ['palette', 'encoding'])
+        self.assertTrue(reports[-1]['done'])
+
+    def test_long_poll_waits_for_newer_snapshot(self):
+        store = progress.get_progress_store()
+        reporter = progress.JobProgress('job-1')
+        reporter({'phase': 'encoding', 'frame': 10, 'fps': 20.0, 'speed': 1.5, 'out_time': 1.0, 'percent': 16.7,
+                  'done': False})
+        data = self.client.get('/jobs/job-1/events/', {'after': 0, 'timeout': 0}).json()
+        self.assertEqual((data['state'], data['frame'], data['seq']), ('encoding', 10, 1))
+
+        reporter.finished(converted_url='/download/x/')
+        data = self.client.get('/jobs/job-1/events/', {'after': 1}).json()
+        self.assertEqual((data['state'], data['converted_url'], data['seq']), ('finished', '/download/x/', 2))
+        self.assertEqual(store.get('job-1')['percent'], 100.0)
+
+    def test_event_stream_ends_on_terminal_state(self):
+        progress.publish_queued('job-2')
+        progress.JobProgress('job-2').failed('boom')
+        response = self.client.get('/jobs/job-2/events/', HTTP_ACCEPT='text/event-stream',
+                                   HTTP_LAST_EVENT_ID='1')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('id: 2\n', body)
+        self.assertIn('"error": "boom"', body)
+        self.assertNotIn('"queued"', body)
+
+    def test_unknown_job(self):
+        with mock.patch.object(jobs, 'get_job_backend', return_value=jobs.PoolJobBackend(max_workers=1)):
+            self.assertEqual(self.client.get('/jobs/missing/events/').status_code, 404)
+
+    def test_asgi_event_stream_sends_events_as_they_happen(self):
+        class urlconf:
+            urlpatterns = [path('jobs/<str:job_id>/events/', views.job_events_async)]
+
+        progress.publish_queued('job-3')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': '/jobs/job-3/events/', 'raw_path': b'/jobs/job-3/events/',
+                 'root_path': '', 'query_string': b'', 'headers': [(b'accept', b'text/event-stream')],
+                 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+        received = []
+        started = time.monotonic()
+
+        async def receive():
+            if not received:
+                received.append(None)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if b'data: ' in message.get('body', b''):
+                received.append(time.monotonic() - started)
+
+        with self.settings(ROOT_URLCONF=urlconf, PROGRESS_STREAM_SECONDS=1):
+            asyncio.run(ASGIHandler()(scope, receive, send))
+        # The queued snapshot arrives long before the 1 s stream window closes
+        self.assertLess(received[1], 0.5)
+
+
+class AdmissionTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.controller = admission.AdmissionController(self.tmp, slots=1, threads=2, queue_size=1,
+                                                        wait_timeout=0.2, poll_interval=0.01)
+
+    def test_plan_slots_respects_cores_and_memory(self):
+        gib = 1024 ** 3
+        self.assertEqual(admission.plan_slots(8, 64 * gib, gib), (8, 1))
+        self.assertEqual(admission.plan_slots(8, 2 * gib, gib), (2, 4))
+        self.assertEqual(admission.plan_slots(8, 0, gib, slots=3), (3, 2))
+        self.assertEqual(admission.plan_slots(1, gib // 2, gib), (1, 1))
+
+    def test_slot_is_exclusive_across_controllers(self):
+        other = admission.AdmissionController(self.tmp, slots=1, threads=2)
+        with self.controller.acquire() as slot:
+            self.assertEqual(slot.threads, 2)
+            self.assertIsNone(other.try_acquire())
+            self.assertEqual(other.usage()['busy'], 1)
+        with other.try_acquire() as slot:
+            self.assertIsNotNone(slot)
+
+    def test_segmented_jobs_borrow_idle_slots(self):
+        controller = admission.AdmissionController(self.tmp, slots=4, threads=1)
+        with override_settings(SEGMENTED_ENCODE_SEGMENTS=3):
+            wanted = engine.SegmentedFFmpegBackend().wanted_threads()
+        self.assertEqual((wanted, engine.FFmpegBackend().wanted_threads()), (3, 0))
+        with controller.widen(controller.acquire(), wanted) as slot:
+            self.assertEqual((slot.threads, controller.usage()['busy']), (3, 3))
+            # A busy host leaves the next job with its own slot rather than waiting
+            with controller.widen(controller.acquire(), wanted) as other:
+                self.assertEqual(other.threads, 1)
+        self.assertEqual(controller.usage()['busy'], 0)
+
+    def test_times_out_with_503_and_rejects_full_queue_with_429(self):
+        with self.controller.acquire():
+            with self.assertRaises(admission.Saturated) as waited:
+                self.controller.acquire()
+            self.assertEqual(waited.exception.status, 503)
+
+            waiter = self.controller._try_lock('wait', 1)
+            self.addCleanup(os.close, waiter[0])
+            with self.assertRaises(admission.Saturated) as rejected:
+                self.controller.acquire()
+            self.assertEqual(rejected.exception.status, 429)
+
+    def test_ffmpeg_command_gets_thread_budget(self):
+        cmd = engine.FFmpegBackend().build_command('in.mp4', 'out.gif', 0, 6, threads=2)
+        self.assertLess(cmd.index('-threads'), cmd.index('-i'))
+        self.assertEqual(cmd[cmd.index('-filter_threads') + 1], '2')
+
+    @override_settings(RESULT_CACHE_MAX_BYTES=0, DOWNLOAD_TOKEN_BACKEND='local')
+    def test_convert_view_sheds_load(self):
+        upload = SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4')
+        saturated = admission.Saturated('busy', status=429, retry_after=7)
+        with mock.patch.object(engine, 'convert', side_effect=saturated):
+            response = self.client.post('/convert/', {'video': upload})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+@override_settings(ADMISSION_CONTROL=False, RESULT_CACHE_MAX_BYTES=0, DOWNLOAD_TOKEN_BACKEND='local')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        registry._registry = None
+        self.addCleanup(setattr, registry, '_registry', None)
+
+    async def test_convert_async_runs_ffmpeg_subprocess(self):
+        bin_dir = fake_ffmpeg(self, FAKE_FFMPEG_SCRIPT)
+        output_path = os.path.join(bin_dir, 'out.gif')
+        reports = []
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            await engine.convert_async(os.path.join(bin_dir, 'in.mp4'), output_path, 0, 6, progress=reports.append)
+        self.assertEqual(len(reports), 2)
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'GIF')
+
+    async def test_cancelling_kills_ffmpeg(self):
+        bin_dir = fake_ffmpeg(self, 'echo $$ > "${0%/*}/pid"\nexec /bin/sleep 30\n')
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            task = asyncio.ensure_future(engine.convert_async(os.path.join(bin_dir, 'in.mp4'),
+                                                              os.path.join(bin_dir, 'out.gif'), 0, 6))
+            pid_path = os.path.join(bin_dir, 'pid')
+            for _attempt in range(100):
+                if os.path.exists(pid_path) and os.path.getsize(pid_path):
+                    break
+                await asyncio.sleep(0.02)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        with open(pid_path) as f:
+            pid = int(f.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    async def test_async_convert_view(self):
+        async def fake_convert(input_path, output_path, start_seconds, duration, content_hash):
+            self.assertEqual(start_seconds, 2)
+            with open(output_path, 'wb') as f:
+                f.write(b'GIF')
+            return False
+
+        request = AsyncRequestFactory().post('/convert/', {
+            'video': SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4'),
+            'start_time': '00:00:02',
+        })
+        with mock.patch.object(result_cache, 'convert_cached_async', side_effect=fake_convert):
+            response = await views.convert_video_async(request)
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.content)['converted_url'].split('/')[2]
+
+        request = AsyncRequestFactory().get(f'/download/{token}/')
+        response = await views.download_converted_async(request, token)
+        self.assertEqual(response['Content-Length'], '3')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'GIF')
+        response.close()
+        self.assertIsNone(registry.get_token_registry().peek(token))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        overrides = self.settings(METRICS_DIR=self.tmp, METRICS_TOKEN='')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        metrics._registry = None
+        self.addCleanup(setattr, metrics, '_registry', None)
+
+    def test_snapshots_from_all_processes_are_merged(self):
+        other = metrics.Registry(self.tmp)
+        other.observe('chromi_stage_seconds', 0.2, stage='probe')
+        other.inc('chromi_conversions_total', outcome='ok')
+        other.flush()
+        metrics.observe('chromi_stage_seconds', 3, stage='probe')
+        metrics.inc('chromi_conversions_total', outcome='ok')
+
+        body = metrics.render(metrics.get_registry().collect())
+        self.assertIn('chromi_stage_seconds_bucket{stage="probe",le="0.25"} 1\n', body)
+        self.assertIn('chromi_stage_seconds_bucket{stage="probe",le="+Inf"} 2\n', body)
+        self.assertIn('chromi_stage_seconds_sum{stage="probe"} 3.2\n', body)
+        self.assertIn('chromi_conversions_total{outcome="ok"} 2\n', body)
+
+    def test_ffmpeg_rusage_and_output_size_recorded(self):
+        bin_dir = fake_ffmpeg(self, FAKE_FFMPEG_SCRIPT)
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}), self.settings(ADMISSION_CONTROL=False):
+            engine.convert(os.path.join(bin_dir, 'in.mp4'), os.path.join(bin_dir, 'out.gif'), 0, 6)
+        merged = metrics.get_registry().collect()
+        self.assertIn(json.dumps([['stage', 'ffmpeg']]), merged['chromi_stage_seconds'])
+        self.assertEqual(merged['chromi_ffmpeg_peak_rss_bytes']['[]']['count'], 1)
+        self.assertEqual(merged['chromi_output_bytes']['[]']['sum'], 3)
+
+    def test_endpoint_with_token_and_tracemalloc(self):
+        with self.settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            import tracemalloc
+            tracemalloc.start()
+            self.addCleanup(tracemalloc.stop)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE chromi_stage_seconds histogram', body)
+        self.assertIn('chromi_tracemalloc_bytes{kind="peak"}', body)
+
+
+class BenchmarkTests(TestCase):
+    def test_matrix_skips_trims_past_the_end(self):
+        cases = benchmark.build_matrix(['testsrc2'], ['h264'], ['640x360'], [10, 60], [0, 30], ['ffmpeg'])
+        self.assertEqual([case.case_id for case in cases], [
+            'testsrc2-h264-640x360-10s-start0-ffmpeg',
+            'testsrc2-h264-640x360-60s-start0-ffmpeg',
+            'testsrc2-h264-640x360-60s-start30-ffmpeg',
+        ])
+
+    def test_run_case_reports_child_resource_usage(self):
+        bin_dir = fake_ffmpeg(self, FAKE_FFMPEG_SCRIPT)
+        case = benchmark.Case(benchmark.InputSpec('testsrc2', 'h264', '640x360', 10), 0, 'ffmpeg')
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            report = benchmark.run_case(case, os.path.join(bin_dir, 'in.mp4'), bin_dir, repeat=2)
+        self.assertTrue(report['ok'], report.get('error'))
+        self.assertEqual((report['runs'], report['gif_bytes']), (2, 3))
+        self.assertGreater(report['peak_rss_bytes'], 0)
+        self.assertEqual(report['gif_sha256'], hashlib.sha256(b'GIF').hexdigest())
+
+    def test_compare_flags_regressions_by_case_id(self):
+        baseline = {'cases': [{'id': 'a', 'ok': True, 'wall_seconds': 1.0, 'gif_bytes': 100}]}
+        current = {'cases': [{'id': 'a', 'ok': True, 'wall_seconds': 1.05, 'gif_bytes': 150},
+                             {'id': 'b', 'ok': True, 'wall_seconds': 9.0}]}
+        regressions = benchmark.compare(baseline, current, threshold=0.10)
+        self.assertEqual([(item['id'], item['metric']) for item in regressions], [('a', 'gif_bytes')])
+
+
+class LoadTestTests(LiveServerTestCase):
+    def test_percentiles_and_summary(self):
+        self.assertEqual(loadtest.percentile(list(range(1, 101)), 0.95), 95)
+        self.assertEqual(loadtest.percentile([3.0], 0.99), 3.0)
+        results = [loadtest.FlowResult(True, 0, 1.0, {'convert': 0.5}), loadtest.FlowResult(True, 0, 2.0),
+                   loadtest.FlowResult(False, 0, 9.0, stage='convert', status=503, timed_out=True)]
+        summary = loadtest.summarize(results, elapsed=4.0)
+        self.assertEqual((summary['succeeded'], summary['throughput_per_second']), (2, 0.5))
+        self.assertAlmostEqual(summary['timeout_rate'], 1 / 3)
+        self.assertEqual(summary['latency_seconds']['p50'], 1.0)
+        self.assertEqual(summary['errors'], {'convert:503': 1})
+
+    def test_chunked_flow_against_live_server(self):
+        def fake_convert(input_path, output_path, *args, **kwargs):
+            with open(output_path, 'wb') as f:
+                f.write(b'GIF89a')
+            return False
+
+        video_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, video_dir, True)
+        video_path = os.path.join(video_dir, 'clip.mp4')
+        with open(video_path, 'wb') as f:
+            f.write(MP4_HEAD + b'\0' * 1024)
+        with mock.patch.object(result_cache, 'convert_cached', side_effect=fake_convert):
+            result = loadtest.run_flow(self.live_server_url, video_path, 'chunked', timeout=10)
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(sorted(result.stages), ['convert', 'download', 'page', 'upload'])
+
+
+class SegmentedEncodeTests(TestCase):
+    def write(self, directory, name, data):
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_stitch_joins_frames_and_localizes_foreign_palettes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        first = self.write(directory, 'a.gif', tiny_gif())
+        second = self.write(directory, 'b.gif', tiny_gif(b'\xff\x00\x00\x00\x00\xff'))
+        output = os.path.join(directory, 'out.gif')
+        self.assertEqual(gif.stitch([first, second, first], output), 3)
+
+        stitched = gif.read(output)
+        self.assertEqual((stitched.loop, len(stitched.frames)), (0, 3))
+        self.assertEqual(stitched.color_table, b'\x00\x00\x00\xff\xff\xff')
+        self.assertEqual([frame.color_table for frame in stitched.frames],
+                         [b'', b'\xff\x00\x00\x00\x00\xff', b''])
+        self.assertEqual(stitched.frames[1].descriptor[9] & 0x87, 0x80)
+
+    def test_segments_cover_every_frame_once(self):
+        backend = engine.SegmentedFFmpegBackend()
+        with override_settings(GIF_FPS=15, SEGMENTED_MIN_SEGMENT_SECONDS=1):
+            self.assertEqual(backend.plan_segments(6, threads=4), [(0, 22), (22, 23), (45, 22), (67, 23)])
+            # Never slices shorter than the minimum, however many cores were granted
+            self.assertEqual(len(backend.plan_segments(2, threads=16)), 2)
+        # Never more slices than cores, even when SEGMENTED_ENCODE_SEGMENTS asks for them
+        with override_settings(GIF_FPS=15, SEGMENTED_ENCODE_SEGMENTS=8):
+            self.assertEqual(len(backend.plan_segments(6, threads=2)), 2)
+
+    def test_single_slice_falls_back_to_plain_ffmpeg(self):
+        with mock.patch.object(engine.SegmentedFFmpegBackend, 'is_available', return_value=True), \
+                mock.patch.object(engine.FFmpegBackend, 'convert') as plain, \
+                mock.patch.object(engine.SegmentedFFmpegBackend, '_run_parallel') as parallel:
+            engine.SegmentedFFmpegBackend().convert('in.mp4', 'out.gif', 0, 6, threads=1)
+        self.assertEqual(plain.call_args.kwargs['threads'], 1)
+        parallel.assert_not_called()
+
+    @override_settings(GIF_FPS=15, SEGMENTED_ENCODE_SEGMENTS=3)
+    def test_convert_encodes_slices_in_parallel_with_one_palette(self):
+        escaped = ''.join(f'\\{byte:03o}' for byte in tiny_gif())
+        bin_dir = fake_ffmpeg(self, f'echo "$@" >> "${{0%/*}}/calls"\nfor last; do :; done\nprintf \'{escaped}\' > "$last"\n')
+        output_path = os.path.join(bin_dir, 'out.gif')
+        reports = []
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            engine.SegmentedFFmpegBackend().convert(os.path.join(bin_dir, 'in.mp4'), output_path, 1.5, 6,
+                                                    progress=reports.append, threads=3)
+        with open(os.path.join(bin_dir, 'calls')) as f:
+            calls = f.read().splitlines()
+        self.assertIn('palettegen', calls[0])
+        seeks = sorted(float(call.split('-ss ')[1].split()[0]) for call in calls[1:])
+        self.assertEqual(seeks, [1.5, 3.5, 5.5])
+        self.assertEqual(len(gif.read(output_path).frames), 3)
+        self.assertTrue(reports[-1]['done'])
+
+
+
+class BatchConversionTests(TestCase):
+    def test_nearby_clips_share_one_decode(self):
+        clips = [engine.Clip(60, 6), engine.Clip(0, 6, 'small'), engine.Clip(4, 6)]
+        self.assertEqual(engine.group_clips(clips, max_gap=10), [[1, 2], [0]])
+
+        with override_settings(GIF_WIDTH=640, GIF_HEIGHT=360, GIF_FPS=15):
+            cmd = engine.FFmpegBackend().build_batch_command('in.mp4', [clips[1], clips[2]], ['a.gif', 'b.gif'])
+        self.assertEqual(cmd[cmd.index('-ss') + 1:cmd.index('-i')], ['0', '-t', '10'])
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertTrue(graph.startswith('[0:v]split=2[in0][in1];'))
+        self.assertIn('[in0]trim=start=0.000:duration=6.000,setpts=PTS-STARTPTS,fps=12,scale=480:270', graph)
+        self.assertIn('[in1]trim=start=4.000:duration=6.000,setpts=PTS-STARTPTS,fps=15,scale=640:360', graph)
+        self.assertEqual(cmd[-6:], ['-map', '[out1]', '-loop', '0', '-y', 'b.gif'])
+
+    def test_convert_batch_runs_once_per_group_and_caches_each_clip(self):
+        bin_dir = fake_ffmpeg(self, 'echo "$@" >> "${0%/*}/calls"\n'
+                                    'prev=\nfor arg; do [ "$prev" = -y ] && printf GIF > "$arg"; prev=$arg; done\n')
+        clips = [engine.Clip(0, 6), engine.Clip(3, 6, 'hd'), engine.Clip(40, 6)]
+        cache = result_cache.ResultCache(os.path.join(bin_dir, 'cache'), max_bytes=1024)
+
+        def run(name):
+            outputs = [os.path.join(bin_dir, f'{name}{index}.gif') for index in range(len(clips))]
+            return outputs, result_cache.convert_batch_cached(os.path.join(bin_dir, 'in.mp4'), clips, outputs, 'h')
+
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}), \
+                mock.patch.object(result_cache, 'get_result_cache', return_value=cache):
+            outputs, hits = run('first')
+            self.assertEqual(hits, [False, False, False])
+            self.assertTrue(all(os.path.getsize(path) for path in outputs))
+            outputs, hits = run('second')
+            self.assertEqual(hits, [True, True, True])
+        with open(os.path.join(bin_dir, 'calls')) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+    def test_view_returns_one_download_per_clip(self):
+        def fake_batch(input_path, clips, output_paths, content_hash):
+            self.assertEqual([clip.start for clip in clips], [5, 20])
+            for path in output_paths:
+                with open(path, 'wb') as f:
+                    f.write(b'GIF')
+            return [False, True]
+
+        clips = json.dumps([{'start_time': '00:00:05', 'preset': 'small'}, {'start_time': 20, 'duration': 4}])
+        upload = SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4')
+        with mock.patch.object(result_cache, 'convert_batch_cached', side_effect=fake_batch), \
+                self.settings(DOWNLOAD_TOKEN_BACKEND='local'):
+            registry._registry = None
+            self.addCleanup(setattr, registry, '_registry', None)
+            response = self.client.post('/convert/batch/', {'video': upload, 'clips': clips})
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['clips']
+            self.assertEqual([(clip['preset'], clip['cached']) for clip in results], [('small', False), ('chrome', True)])
+            for clip in results:
+                delivery.remove_file(registry.get_token_registry().claim(clip['converted_url'].split('/')[2]))
+
+        for bad in ([], [{'preset': 'huge'}], [{'duration': 60}]):
+            upload = SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='video/mp4')
+            response = self.client.post('/convert/batch/', {'video': upload, 'clips': json.dumps(bad)})
+            self.assertEqual(response.status_code, 400)
+
+
+class PreviewTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        overrides = self.settings(UPLOAD_SESSION_DIR=self.tmp)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.session = uploads.UploadSession.create('clip.mp4', len(MP4_HEAD))
+        self.session.write_chunk(0, MP4_HEAD)
+        self.session.complete()
+
+    def test_sprite_keeps_evenly_spaced_keyframes_at_source_aspect(self):
+        step, times = preview.sprite_plan([float(t) for t in range(250)], 100)
+        self.assertEqual((step, len(times), times[:3]), (3, 84, [0.0, 3.0, 6.0]))
+        rotated = probe.VideoInfo(duration=10, width=1920, height=1080, rotation=90)
+        self.assertEqual(preview.tile_size(rotated, 160), (160, 284))
+        cmd = preview.sprite_command('in.mp4', 'out.jpg', 3, 160, 90, 10, 9)
+        self.assertEqual(cmd[cmd.index('-skip_frame') + 1], 'nokey')
+        self.assertIn("select='not(mod(n,3))',scale=160:90:flags=fast_bilinear,tile=10x9", cmd)
+
+    @override_settings(GIF_WIDTH=640, GIF_HEIGHT=360, PREVIEW_WIDTH=240, PREVIEW_FPS=5)
+    def test_preview_is_encoded_once_per_start_time(self):
+        bin_dir = fake_ffmpeg(self, 'echo "$@" >> "${0%/*}/calls"\nfor last; do :; done\nprintf GIF > "$last"\n')
+        url = f'/uploads/{self.session.upload_id}/preview/'
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}):
+            first = self.client.get(url, {'start_time': '00:00:02'})
+            again = self.client.get(url, {'start_time': '00:00:02'})
+            other = self.client.get(url, {'start_time': '00:00:04', 'duration': '3'})
+        self.assertEqual([r.status_code for r in (first, again, other)], [200, 200, 200])
+        self.assertEqual(b''.join(again.streaming_content), b'GIF')
+        with open(os.path.join(bin_dir, 'calls')) as f:
+            calls = f.read().splitlines()
+        self.assertEqual(len(calls), 2)
+        self.assertIn('fps=5,scale=240:136:flags=fast_bilinear', calls[0])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.session.directory, 'previews'))),
+                         ['2000-6000.gif', '4000-3000.gif'])
+
+    def test_unknown_upload_and_missing_sprite(self):
+        self.assertEqual(self.client.get(f'/uploads/{"0" * 32}/preview/').status_code, 404)
+        self.assertEqual(self.client.get(f'/uploads/{self.session.upload_id}/thumbnails/sprite.jpg').status_code, 404)
+        response = self.client.get(f'/uploads/{self.session.upload_id}/preview/', {'start_time': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ArtifactTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.manager = artifacts.ArtifactManager(self.tmp, {'uploads': 100, 'outputs': 50}, quota_bytes=10, grace=5,
+                                                 sweep_interval=3600)
+        self.manager._last_sweep = time.monotonic()
+
+    def artifact(self, kind, data, age):
+        path = self.manager.create(kind, '.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def test_sweep_expires_then_evicts_oldest_over_quota(self):
+        expired = self.artifact('outputs', b'x' * 4, 60)
+        oldest = self.artifact('uploads', b'x' * 6, 40)
+        older = self.artifact('outputs', b'x' * 6, 30)
+        fresh = self.artifact('outputs', b'x' * 6, 1)
+        shared = self.artifact('uploads', b'x' * 6, 45)
+        os.link(shared, os.path.join(self.tmp, 'cached-copy'))
+
+        report = self.manager.sweep()
+        self.assertEqual(report, {'expired': 1, 'evicted': 2, 'freed_bytes': 16})
+        self.assertEqual([os.path.exists(path) for path in (expired, oldest, older, fresh, shared)],
+                         [False, False, False, True, True])
+        usage = self.manager.usage()
+        self.assertEqual(usage['kinds'], {'uploads': {'files': 1, 'bytes': 6}, 'outputs': {'files': 1, 'bytes': 6},
+                                          'sessions': {'files': 0, 'bytes': 0}})
+        self.assertIn('chromi_artifact_bytes{kind="outputs"} 6', artifacts.render_usage(usage))
+
+    def test_sweep_artifacts_expires_abandoned_upload_sessions(self):
+        def session(age):
+            directory = os.path.join(self.manager.session_dir, uuid.uuid4().hex)
+            os.makedirs(os.path.join(directory, 'parts'))
+            for name in ('meta.json', 'data.mp4', 'sprite.jpg'):
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(b'x')
+            stamp = time.time() - age
+            for name in ('meta.json', 'data.mp4', 'sprite.jpg', 'parts', ''):
+                os.utime(os.path.join(directory, name), (stamp, stamp))
+            return directory
+
+        self.manager.ttls['sessions'] = 100
+        abandoned, active = session(200), session(10)
+        self.assertEqual(self.manager.usage()['kinds']['sessions'], {'files': 2, 'bytes': 6})
+        # No new upload arrives: only the sweeper can reclaim the abandoned session
+        with mock.patch.object(artifacts, '_manager', self.manager):
+            call_command('sweep_artifacts', stdout=io.StringIO())
+        self.assertEqual((os.path.exists(abandoned), os.path.exists(active)), (False, True))
+
+    def test_dry_run_and_concurrent_sweeps_remove_nothing(self):
+        expired = self.artifact('outputs', b'x', 60)
+        self.assertEqual(self.manager.sweep(dry_run=True)['expired'], 1)
+        self.assertTrue(os.path.exists(expired))
+        with open(self.manager.lock_path, 'a') as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            self.assertEqual(self.manager.sweep(), {'skipped': True})
+        self.assertTrue(os.path.exists(expired))
+
+class TargetSizeTests(TestCase):
+    def test_default_encoding_matches_fixed_pipeline(self):
+        cmd = engine.FFmpegBackend().build_command('in.mp4', 'out.gif', 0, 6)
+        vf = cmd[cmd.index('-vf') + 1]
+        self.assertTrue(vf.endswith('[s0]palettegen[p];[s1][p]paletteuse'), vf)
+        budget = sizing.Encoding(10, 64, 'bayer', 'diff')
+        self.assertEqual(budget.palettegen, 'palettegen=max_colors=64:stats_mode=diff')
+        self.assertEqual(budget.paletteuse, 'paletteuse=dither=bayer:bayer_scale=3:diff_mode=rectangle')
+
+    def test_plan_picks_best_candidate_predicted_to_fit(self):
+        def fake_run(cmd, **kwargs):
+            # Sample i has 3 frames of about (6 - i) * 256 bytes: later candidates compress better
+            outputs = [cmd[index + 1] for index, arg in enumerate(cmd) if arg == '-y']
+            for index, path in enumerate(outputs):
+                sample = gif.parse(tiny_gif())
+                frame = sample.frames[0]
+                padding = b'\xff' + b'\x00' * 255
+                frame = gif.Frame(frame.control, frame.descriptor, b'',
+                                  frame.data[:-1] + padding * (6 - index) + b'\x00')
+                sample.frames = [frame] * 3
+                with open(path, 'wb') as f:
+                    f.write(sample.encode())
+
+        with mock.patch.object(sizing.governor, 'run', side_effect=fake_run):
+            encoding, estimated = sizing.plan('/tmp/in.mp4', 0, 6, 70_000, 640, 360, 15)
+        # The 15 fps candidates predict 95 kB and up; 12 fps with smaller frames fits 90% of 70 kB
+        self.assertEqual(encoding, sizing.Encoding(12, 128, 'bayer', 'diff'))
+        self.assertLessEqual(estimated, 63_000)
+
+    def test_sample_command_scales_only_sampled_frames(self):
+        candidates = sizing.ladder(15)
+        cmd = sizing.sample_command('in.mp4', 0, 6, candidates, [f'{i}.gif' for i in range(len(candidates))],
+                                    640, 360, 3, 0.5)
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertTrue(graph.startswith("[0:v]fps=15,select='lt(mod(t,2.000),0.5)',scale=640:360"), graph)
+        self.assertIn("[in0]split[a0][b0]", graph)
+        self.assertIn("[in3]fps=12,select='lt(mod(t,2.000),0.5)',split[a3][b3]", graph)
+
+    def test_record_round_trips_through_the_gif(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'out.gif')
+        with open(path, 'wb') as f:
+            f.write(tiny_gif())
+        sizing.record(path, sizing.Encoding(10, 64, 'bayer', 'diff'), 50_000, 41_000)
+        recorded = sizing.recorded_encoding(path)
+        self.assertEqual((recorded['fps'], recorded['colors'], recorded['target_bytes']), (10, 64, 50_000))
+        self.assertEqual(len(gif.read(path).frames), 1)
+
+
+class GifOptimizeTests(TestCase):
+    PALETTE = bytes([0, 0, 0, 255, 255, 255, 5, 5, 5, 255, 0, 0])
+
+    def write_full_frames(self, frames):
+        """An unoptimized GIF: every frame full size, as a plain encoder would write it."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'clip.gif')
+        clip = gif.Gif(8, 8, 0x81, 0, 0, self.PALETTE, loop=0)
+        for frame in frames:
+            codes = gif.lzw_encode(frame.tobytes(), 2)
+            clip.frames.append(gif.image_block(0, 0, 8, 8, 2, codes, gif.control_block(10, disposal=0)))
+        with open(path, 'wb') as f:
+            f.write(clip.encode())
+        return path
+
+    def test_lzw_round_trip_and_lossy_tolerance(self):
+        pixels = bytes([0, 2] * 200 + [3] * 50 + list(range(4)) * 30)
+        self.assertEqual(gif.lzw_decode(gif.lzw_encode(pixels, 2), 2, len(pixels)), pixels)
+
+        distance = gifopt.distance_matrix(gifopt.palette_array(self.PALETTE))
+        lossy = gif.lzw_decode(gif.lzw_encode(pixels, 2, lossy=10, distance=distance), 2, len(pixels))
+        self.assertTrue(all(distance[a, b] <= 10 for a, b in zip(pixels, lossy)))
+
+    def test_optimize_crops_changes_and_drops_dither_noise(self):
+        still = np.zeros((8, 8), dtype=np.uint8)
+        moved = still.copy()
+        moved[2:4, 2:4] = 3
+        noisy = moved.copy()
+        noisy[6, ::2] = 2  # near-black dither noise, within the fuzz
+        path = self.write_full_frames([still, moved, noisy])
+
+        with mock.patch.object(gifopt.shutil, 'which', return_value=None):
+            stats = gifopt.optimize(path, fuzz=10, lossy=0, max_changed=1.0)
+        self.assertNotIn('skipped', stats)
+        self.assertLess(stats['after'], stats['before'])
+
+        result = gif.read(path)
+        self.assertEqual([frame.rect for frame in result.frames], [(0, 0, 8, 8), (2, 2, 2, 2)])
+        self.assertEqual([frame.delay for frame in result.frames], [10, 20])
+        frames = gifopt.composite_frames(result)
+        np.testing.assert_array_equal(frames[1], moved)
+        self.assertEqual(result.frames[0].codes(), gif.lzw_encode(still.tobytes(), 2))
+
+    def test_busy_clips_are_left_alone(self):
+        path = self.write_full_frames([np.zeros((8, 8), dtype=np.uint8), np.full((8, 8), 3, dtype=np.uint8)])
+        with mock.patch.object(gifopt.shutil, 'which', return_value=None):
+            stats = gifopt.optimize(path, max_changed=0.5)
+            self.assertEqual(stats['skipped'], 'too much motion')
+            # One full 8x8 rectangle for the LZW coder; the first frame keeps its codes
+            stats = gifopt.optimize(path, max_changed=1.0, max_pixels=50)
+        self.assertEqual((stats['skipped'], stats['pixels']), ('too many pixels to encode', 64))
+
+    @skipUnless(shutil.which('ffmpeg'), 'needs ffmpeg')
+    @override_settings(GIF_OPTIMIZE_MAX_CHANGED=1.0)
+    def test_optimizer_stays_well_under_the_encode(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        input_path = benchmark.ensure_input(benchmark.InputSpec('testsrc2', 'h264', '640x360', 10), directory)
+        output_path = os.path.join(directory, 'out.gif')
+        started = time.monotonic()
+        engine.FFmpegBackend().convert(input_path, output_path, 0, engine.CHROME_GIF_DURATION)
+        encode = time.monotonic() - started
+        started = time.monotonic()
+        gifopt.optimize(output_path)
+        self.assertLess(time.monotonic() - started, encode / 2)
+
+
+class LoopSearchTests(TestCase):
+    def test_best_end_trades_mismatch_against_drift(self):
+        first = np.zeros((2, 4), dtype=np.uint8)
+        candidates = np.stack([np.full((2, 4), 200, np.uint8), np.full((2, 4), 10, np.uint8), first])
+        scores = looping.score_candidates(first, candidates)
+        self.assertEqual(scores.tolist(), [200.0, 10.0, 0.0])
+        self.assertEqual(looping.best_end(scores, [9.9, 10.0, 10.3], target=10.0, bias=2.0), 2)
+        # A near-tie keeps the requested length
+        self.assertEqual(looping.best_end(scores - [0, 10, 0], [9.9, 10.0, 10.3], target=10.0, bias=2.0), 1)
+
+    def test_find_loop_duration_cuts_before_the_matching_frame(self):
+        # 4x2 proxy: the first frame, then three candidates at 1.5s, 1.6s and 1.7s
+        def frame(value):
+            return f'\\{value:03o}' * 8
+
+        bin_dir = fake_ffmpeg(self, f"printf '{frame(16)}{frame(255)}{frame(200)}{frame(17)}'\n")
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}), \
+                self.settings(LOOP_PROXY_WIDTH=4, LOOP_SEARCH_WINDOW=0.5, LOOP_SEARCH_BIAS=2.0):
+            self.assertEqual(looping.find_loop_duration('in.mp4', 0, 2, 640, 360, fps=10), 1.7)
+            # Not enough source after the trim to search
+            self.assertEqual(looping.find_loop_duration('in.mp4', 0, 2, 640, 360, fps=10, video_duration=1.55), 2)
+
+    def test_plan_loop_is_off_by_default(self):
+        with mock.patch.object(looping, 'find_loop_duration') as search:
+            self.assertEqual(engine.plan_loop('in.mp4', 0, 3), 3)
+        search.assert_not_called()
+
+
+class StaticAssetTests(TestCase):
+    def test_minifiers_keep_strings_and_line_breaks(self):
+        css = '/* theme */\n.a  >  .b ,\n.c {\n    content: "a ; b";\n    margin: 0 auto;\n}\n'
+        self.assertEqual(minify.minify_css(css), '.a > .b,.c{content:"a ; b";margin:0 auto}\n')
+        js = "function f() {\n    // note\n\n    return 'a/*b'\n        + 1;\n}\n"
+        self.assertEqual(minify.minify_js(js), "function f() {\nreturn 'a/*b'\n+ 1;\n}\n")
+
+    def test_collectstatic_writes_minified_hashed_and_compressed_files(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        # Before collectstatic the page still renders, with plain names
+        self.assertContains(self.client.get('/'), '/static/js/home.js')
+
+        with self.settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(static_root, 'staticfiles.json')) as f:
+                hashed = json.load(f)['paths']['js/home.js']
+            self.assertRegex(hashed, r'^js/home\.[0-9a-f]{12}\.js$')
+            self.assertTrue(os.path.exists(os.path.join(static_root, hashed + '.gz')))
+            self.assertLess(os.path.getsize(os.path.join(static_root, hashed)),
+                            os.path.getsize(os.path.join(settings.BASE_DIR, 'static', 'js', 'home.js')))
+            self.assertContains(self.client.get('/'), f'/static/{hashed}')
+
+            # A repeat run into the same STATIC_ROOT skips the unchanged copy but keeps it minified
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(static_root, 'staticfiles.json')) as f:
+                self.assertEqual(json.load(f)['paths']['js/home.js'], hashed)
+
+
+class GovernorTests(TestCase):
+    def test_govern_limits_and_deprioritises_the_child(self):
+        bin_dir = fake_ffmpeg(self, 'while :; do :; done\n')
+        process = subprocess.Popen([os.path.join(bin_dir, 'ffmpeg')])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        before = os.getpriority(os.PRIO_PROCESS, process.pid)
+        with self.settings(FFMPEG_MEMORY_LIMIT_BYTES=1 << 30, FFMPEG_CPU_SECONDS=0, CONVERSION_TIMEOUT=10,
+                           FFMPEG_KILL_GRACE=2, FFMPEG_NICE=5):
+            governor.govern(process.pid, threads=2)
+        self.assertEqual(resource.prlimit(process.pid, resource.RLIMIT_AS), (1 << 30, 1 << 30))
+        self.assertEqual(resource.prlimit(process.pid, resource.RLIMIT_CPU), (20, 23))
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, process.pid), min(19, before + 5))
+
+    def test_watchdog_escalates_to_sigkill(self):
+        # Ignores SIGTERM, so only the escalation can stop it
+        bin_dir = fake_ffmpeg(self, "trap '' TERM\nwhile :; do :; done\n")
+        started = time.monotonic()
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}), \
+                self.settings(CONVERSION_TIMEOUT=0.2, FFMPEG_KILL_GRACE=0.2), \
+                self.assertRaisesMessage(engine.ConversionError, 'timed out'):
+            engine.FFmpegBackend().convert(os.path.join(bin_dir, 'in.mp4'), os.path.join(bin_dir, 'out.gif'), 0, 6)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(governor.limit_reason(-signal.SIGXCPU, ''), 'cpu')
+
+    def test_planning_ffmpeg_runs_are_governed(self):
+        bin_dir = fake_ffmpeg(self, "printf sample\nwhile :; do :; done\n")
+        with mock.patch.dict(os.environ, {'PATH': bin_dir}), \
+                self.settings(CONVERSION_TIMEOUT=0.2, FFMPEG_KILL_GRACE=0.2), \
+                mock.patch.object(governor, 'govern') as govern:
+            with self.assertRaises(subprocess.TimeoutExpired) as raised:
+                sizing.plan(os.path.join(bin_dir, 'in.mp4'), 0, 6, 70_000, 640, 360, 15, threads=2)
+        self.assertEqual(raised.exception.output, b'sample')
+        self.assertEqual(govern.call_args.args[1], 2)
+
+    def test_pixel_rate_cap_admits_4k60_and_refuses_4k120(self):
+        self.assertEqual(probe.plan_seek(probe.VideoInfo(duration=30, width=3840, height=2160, fps=60), 0, 6).duration,
+                         6)
+        info = probe.VideoInfo(duration=30, codec='hevc', width=3840, height=2160, fps=120)
+        with self.assertRaisesMessage(probe.ProbeError, 'too demanding'):
+            probe.plan_seek(info, 0, 6)
+        with self.settings(MAX_INPUT_PIXEL_RATE=0):
+            self.assertEqual(probe.plan_seek(info, 0, 6).duration, 6)
+
+
+class ConversionWorkerTests(TestCase):
+    def test_web_process_does_not_import_numpy(self):
+        code = ('import sys, django; django.setup(); import converter.urls, converter.tasks; '
+                'print("numpy" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=settings.BASE_DIR,
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE='chrome_background_converter.settings'))
+        self.assertEqual(result.stdout.strip(), 'False', result.stderr)
+
+    def test_worker_recycles_above_rss(self):
+        rq = importlib.import_module('rq')
+        queue = mock.Mock()
+        conversion_worker = worker.worker_class(rq)([rq.Queue('q', connection=mock.MagicMock())],
+                                                    connection=mock.MagicMock(), max_rss_bytes=100)
+        with mock.patch.object(rq.SimpleWorker, 'execute_job'), \
+                mock.patch.object(worker, 'peak_rss_bytes', return_value=50):
+            conversion_worker.execute_job(mock.Mock(), queue)
+            self.assertFalse(conversion_worker._stop_requested)
+        with mock.patch.object(rq.SimpleWorker, 'execute_job'), \
+                mock.patch.object(worker, 'peak_rss_bytes', return_value=200):
+            conversion_worker.execute_job(mock.Mock(), queue)
+            self.assertTrue(conversion_worker._stop_requested)
+
+    def test_prefetched_jobs_survive_a_killed_worker(self):
+        rq = importlib.import_module('rq')
+        redis = FakeRedisLists({'rq:queue:q': ['a', 'b', 'c']})
+        queue = rq.Queue('q', connection=mock.MagicMock())
+
+        def make_worker():
+            conversion_worker = worker.worker_class(rq)([queue], connection=mock.MagicMock(), prefetch=3)
+            conversion_worker.connection = redis
+            return conversion_worker
+
+        first = make_worker()
+        job_a = mock.Mock(id=redis.lists['rq:queue:q'].pop(0))
+        with mock.patch.object(rq.SimpleWorker, 'dequeue_job_and_maintain_ttl', return_value=(job_a, queue)), \
+                mock.patch.object(first.job_class, 'fetch', side_effect=lambda job_id, **kwargs: mock.Mock(id=job_id)):
+            self.assertEqual(first.dequeue_job_and_maintain_ttl(1)[0].id, 'a')
+        self.assertEqual(redis.lists[f'chromi:worker:prefetch:{first.name}:q'], ['b', 'c'])
+
+        with mock.patch.object(first, 'heartbeat') as heartbeat, mock.patch.object(first, 'set_state'), \
+                mock.patch.object(rq.SimpleWorker, 'execute_job'), mock.patch.object(worker, 'peak_rss_bytes',
+                                                                                     return_value=0):
+            job, job_queue = first.dequeue_job_and_maintain_ttl(1)
+            first.execute_job(job, job_queue)
+        heartbeat.assert_called_once()
+        self.assertEqual(redis.lists[f'chromi:worker:prefetch:{first.name}:q'], ['c'])
+
+        # first is SIGKILLed: its registration expires and the next maintenance pass requeues c
+        with mock.patch.object(rq.SimpleWorker, 'run_maintenance_tasks'):
+            make_worker().run_maintenance_tasks()
+        self.assertEqual(redis.lists['rq:queue:q'], ['c'])
+
+    def test_pool_replaces_children_that_exit(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log = os.path.join(directory, 'starts')
+        pool = worker.WorkerPool(2, record_start, args=(log,), restart_delay=0.05)
+        stopper = threading.Timer(0.5, pool.stop)
+        stopper.start()
+        pool.run()
+        with open(log) as f:
+            self.assertGreater(len(f.read().splitlines()), 2)
+        self.assertFalse(any(child.is_alive() for child in pool.children))
+
+
+class FakeRedisLists:
+    """The Redis list commands ConversionWorker's prefetching uses; no worker is registered."""
+
+    def __init__(self, lists):
+        self.lists = lists
+
+    def lmove(self, source, destination, src, dest):
+        if not self.lists.get(source):
+            return None
+        value = self.lists[source].pop(0 if src == 'LEFT' else -1)
+        target = self.lists.setdefault(destination, [])
+        target.insert(0 if dest == 'LEFT' else len(target), value)
+        return value.encode()
+
+    def lrem(self, key, count, value):
+        if value in self.lists.get(key, []):
+            self.lists[key].remove(value)
+
+    def scan_iter(self, match):
+        return [key.encode() for key, values in self.lists.items() if values and fnmatch.fnmatchcase(key, match)]
+
+    def exists(self, key):
+        return 0
+
+
+class FakeS3Client:
+    """In-memory stand-in for a boto3 S3 client (the MinIO role in tests)."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, path, bucket, key, ExtraArgs=None):
+        with open(path, 'rb') as f:
+            self.objects[(bucket, key)] = (f.read(), ExtraArgs)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}&op={operation}"
+
+    def head_object(self, Bucket, Key):
+        body, extra = self.objects[(Bucket, Key)]
+        return {'ContentLength': len(body), 'ContentType': (extra or {}).get('ContentType')}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class ArtifactStorageTests(TestCase):
+    def setUp(self):
+        self.client_s3 = FakeS3Client()
+        self.pending_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pending_dir)
+        store = artifact_storage.S3ArtifactStorage('gifs', prefix='out/', presign_ttl=30, client=self.client_s3,
+                                                   pending_dir=self.pending_dir)
+        patcher = mock.patch.object(artifact_storage, '_storage', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        registry._registry = None
+        self.addCleanup(setattr, registry, '_registry', None)
+        fd, self.path = tempfile.mkstemp(suffix='.gif')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'GIF89a')
+        self.addCleanup(delivery.remove_file, self.path)
+
+    def test_publish_uploads_and_drops_the_local_copy(self):
+        with self.settings(DOWNLOAD_TOKEN_BACKEND='local'):
+            url = registry.issue_download(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        [((bucket, key), (data, extra))] = self.client_s3.objects.items()
+        self.assertEqual((bucket, data, extra), ('gifs', b'GIF89a', {'ContentType': 'image/gif'}))
+        self.assertTrue(key.startswith('out/') and key.endswith('.gif'))
+        self.assertTrue(url.startswith('/download/'))
+
+    def test_download_redirects_to_a_presigned_url_once(self):
+        with self.settings(DOWNLOAD_TOKEN_BACKEND='local'):
+            url = registry.issue_download(self.path)
+            key = next(iter(self.client_s3.objects))[1]
+            head = self.client.head(url)
+            self.assertEqual((head.status_code, head['Content-Length']), (200, '6'))
+            with mock.patch.object(artifact_storage.S3ArtifactStorage, 'schedule_discard') as schedule_discard:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response['Location'], f'https://s3.test/gifs/{key}?expires=30&op=get_object')
+            self.assertEqual(response['Cache-Control'], 'no-store')
+            schedule_discard.assert_called_once_with(f's3://gifs/{key}')
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_deferred_discard_outlives_the_process_that_scheduled_it(self):
+        pending_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pending_dir)
+        locator = artifact_storage.get_artifact_storage().publish(self.path)
+        with self.settings(DOWNLOAD_OFFLOAD_GRACE=10):
+            artifact_storage.S3ArtifactStorage('gifs', presign_ttl=30, client=self.client_s3,
+                                               pending_dir=pending_dir).schedule_discard(locator)
+        self.assertEqual(len(self.client_s3.objects), 1)
+        # A later process (e.g. `manage.py sweep_artifacts`) finds the record once it is due
+        store = artifact_storage.S3ArtifactStorage('gifs', client=self.client_s3, pending_dir=pending_dir)
+        self.assertEqual(store.sweep_discards(), 0)
+        self.assertEqual(store.sweep_discards(now=time.time() + 41), 1)
+        self.assertEqual((self.client_s3.objects, os.listdir(pending_dir)), ({}, []))
+
+    def test_unclaimed_download_is_discarded_after_its_token_expires(self):
+        with self.settings(DOWNLOAD_TOKEN_BACKEND='local', DOWNLOAD_TOKEN_TTL=600, DOWNLOAD_OFFLOAD_GRACE=10):
+            registry.issue_download(self.path)
+            store = artifact_storage.get_artifact_storage()
+            self.assertEqual(store.sweep_discards(now=time.time() + 600), 0)
+            self.assertEqual(store.sweep_discards(now=time.time() + 641), 1)
+        self.assertEqual(self.client_s3.objects, {})
@@ -0,0 +1,222 @@
+import os
+import time
+import struct
+import hashlib
+import logging
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from . import admission, artifacts, engine, metrics
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FIELD = 'video'
+SUPPORTED_EXTENSIONS = ('.mp4', '.mov', '.webm')
+SNIFF_BYTES = 4096
+
+ISO_BMFF_BOXES = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+
+
+def sniff_container(head: bytes):
+    """Identify the container from its first bytes: 'isobmff' (mp4/mov), 'matroska' (webm) or None."""
+    if head.startswith(EBML_MAGIC):
+        return 'matroska'
+    if len(head) >= 8 and head[4:8] in ISO_BMFF_BOXES:
+        return 'isobmff'
+    return None
+
+
+def moov_before_mdat(head: bytes) -> bool:
+    """
+    Walk the top-level ISO BMFF boxes in head. Only 'faststart' files, whose index
+    (moov) precedes the media data (mdat), can be decoded from a non-seekable pipe.
+    """
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return False
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def parse_start_time(start_time: str) -> int:
+    """Convert 'HH:MM:SS' into seconds."""
+    if not start_time or start_time == '00:00:00':
+        return 0
+    h, m, s = map(int, start_time.split(':'))
+    return h * 3600 + m * 60 + s
+
+
+class VideoUpload(UploadedFile):
+    """
+    The 'video' field as received by VideoUploadHandler. Either spooled to a temp
+    file the view can take over with detach(), or (when `conversion` is set) already
+    streamed into a running ffmpeg process. Unless detached, close() cleans up.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra, path, content_hash, conversion=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.content_hash = content_hash
+        self.conversion = conversion
+        self._detached = False
+
+    def temporary_file_path(self):
+        return self.path
+
+    def detach(self):
+        """Hand ownership of the spooled file (or running conversion) to the caller."""
+        self._detached = True
+        return self.path
+
+    def open(self, mode=None):
+        raise ValueError('Video uploads are consumed through temporary_file_path() or conversion')
+
+    def close(self):
+        if self._detached:
+            return
+        if self.conversion is not None:
+            self.conversion.abort()
+            self.conversion.discard_output()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class VideoUploadHandler(FileUploadHandler):
+    """
+    Upload handler for the 'video' field. It rejects files whose magic bytes do not
+    match a supported container within the first few KB. It hashes the upload as it
+    arrives for the result cache and never holds the file in memory. When the trim
+    is known up front (query string) and the container can be decoded from a pipe,
+    chunks go straight into ffmpeg's stdin so conversion overlaps the upload.
+    Otherwise chunks are spooled to a temp file the view takes over without copying.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name == VIDEO_FIELD
+        if not self.active:
+            return
+        if os.path.splitext(self.file_name or '')[1].lower() not in SUPPORTED_EXTENSIONS:
+            # Reject before spooling a single byte of the body
+            self.active = False
+            if self.request is not None:
+                self.request.upload_rejected = 'Only .mp4, .mov, and .webm files are supported'
+            raise SkipFile()
+        self.started = time.monotonic()
+        self.head = b''
+        self.hash = hashlib.sha256()
+        self.spool = None
+        self.conversion = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.hash.update(raw_data)
+        if self.spool is None and self.conversion is None:
+            self.head += raw_data
+            if len(self.head) < SNIFF_BYTES:
+                return None
+            self._begin(self.head)
+            raw_data, self.head = self.head, b''
+        self._write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if self.spool is None and self.conversion is None:
+            # Upload shorter than the sniff window
+            self._begin(self.head)
+            self._write(self.head)
+
+        path = None
+        if self.spool is not None:
+            path = self.spool.name
+            self.spool.close()
+        else:
+            self.conversion.close_input()
+
+        metrics.observe('chromi_stage_seconds', time.monotonic() - self.started, stage='upload_write')
+        upload = VideoUpload(
+            self.file_name, self.content_type, file_size, self.charset, self.content_type_extra,
+            path, self.hash.hexdigest(), conversion=self.conversion,
+        )
+        self.spool = None
+        self.conversion = None
+        return upload
+
+    def upload_interrupted(self):
+        if getattr(self, 'active', False):
+            self._discard()
+
+    def _begin(self, head: bytes):
+        ext = os.path.splitext(self.file_name or '')[1].lower()
+        container = sniff_container(head)
+        expected = 'matroska' if ext == '.webm' else 'isobmff'
+        if container != expected:
+            logger.info(f"Rejected upload {self.file_name!r}: content does not look like {ext or 'a video'}")
+            if self.request is not None:
+                self.request.upload_rejected = 'The uploaded file is not a valid MP4, MOV or WebM video'
+            raise SkipFile()
+
+        # Only stream when a conversion slot is free right now; never block the upload on one
+        slot = admission.try_acquire() if self._can_stream(container, head) else None
+        if slot is not None:
+            start_seconds = parse_start_time(self.request.GET.get('start_time', '00:00:00'))
+            try:
+                self.conversion = engine.StreamingConversion(start_seconds, engine.CHROME_GIF_DURATION, slot=slot)
+            except Exception:
+                slot.release()
+                raise
+            logger.info(f"Streaming upload {self.file_name!r} directly into ffmpeg")
+        else:
+            self.spool = artifacts.temporary_file('uploads', ext)
+
+    def _can_stream(self, container: str, head: bytes) -> bool:
+        if not getattr(settings, 'STREAM_UPLOADS_TO_FFMPEG', True) or getattr(settings, 'USE_RQ', False):
+            return False
+        if getattr(settings, 'ASYNC_VIEWS', False):
+            # ASGI buffers the whole body before the view runs, so there is nothing to overlap
+            return False
+        if self.request is None or 'start_time' not in self.request.GET:
+            return False
+        if getattr(self.request.resolver_match, 'url_name', None) == 'convert_batch':
+            # A batch needs the whole source on disk, not one clip piped through ffmpeg
+            return False
+        if engine.target_bytes_setting():
+            # Size planning samples the trim before encoding, which a pipe cannot replay
+            return False
+        if getattr(settings, 'LOOP_SEARCH', False):
+            # The loop search reads frames past the requested end before encoding starts
+            return False
+        if not engine.FFmpegBackend().is_available():
+            return False
+        return container == 'matroska' or moov_before_mdat(head)
+
+    def _write(self, data: bytes):
+        if self.conversion is not None:
+            self.conversion.write(data)
+        else:
+            self.spool.write(data)
+
+    def _discard(self):
+        if self.conversion is not None:
+            self.conversion.abort()
+            self.conversion.discard_output()
+            self.conversion = None
+        if self.spool is not None:
+            self.spool.close()
+            os.remove(self.spool.name)
+            self.spool = None
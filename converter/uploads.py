@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+from django.conf import settings
+from . import artifacts, metrics, uploadhandlers
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(ValueError):
+    """Raised for chunks or sessions that cannot be accepted."""
+
+
+def get_session_root() -> str:
+    # Inside ARTIFACT_DIR by default, where the artifact sweeper expires and evicts sessions
+    root = getattr(settings, 'UPLOAD_SESSION_DIR', None) or artifacts.get_artifact_manager().session_dir
+    root = str(root)
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+class UploadSession:
+    """
+    A resumable upload on disk: a preallocated data file written with pwrite() at
+    chunk offsets, plus one marker file per received chunk. Chunks can arrive in any
+    order and in parallel from several workers without any locking.
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.directory = directory
+        self.meta = meta
+
+    @property
+    def upload_id(self) -> str:
+        return os.path.basename(self.directory)
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.directory, 'data' + self.meta['ext'])
+
+    @property
+    def parts_dir(self) -> str:
+        return os.path.join(self.directory, 'parts')
+
+    @property
+    def chunk_count(self) -> int:
+        size, chunk_size = self.meta['size'], self.meta['chunk_size']
+        return max(1, (size + chunk_size - 1) // chunk_size)
+
+    @property
+    def is_complete(self) -> bool:
+        return bool(self.meta.get('content_hash'))
+
+    @classmethod
+    def create(cls, filename: str, size: int):
+        ext = os.path.splitext(filename or '')[1].lower()
+        if ext not in uploadhandlers.SUPPORTED_EXTENSIONS:
+            raise UploadError('Only .mp4, .mov, and .webm files are supported')
+        max_size = getattr(settings, 'UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+        if size <= 0 or size > max_size:
+            raise UploadError(f'File size must be between 1 byte and {max_size // (1024 * 1024)}MB')
+
+        prune_sessions()
+        directory = os.path.join(get_session_root(), uuid.uuid4().hex)
+        os.makedirs(os.path.join(directory, 'parts'))
+        meta = {
+            'filename': os.path.basename(filename),
+            'ext': ext,
+            'size': size,
+            'chunk_size': getattr(settings, 'UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024),
+            'created': time.time(),
+        }
+        session = cls(directory, meta)
+        # Sparse preallocation: chunks are written in place at their final offsets
+        with open(session.data_path, 'wb') as f:
+            f.truncate(size)
+        session._save_meta()
+        return session
+
+    @classmethod
+    def load(cls, upload_id: str):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            return None
+        directory = os.path.join(get_session_root(), upload_id)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                return cls(directory, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.directory, 'meta.json')
+        tmp = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, meta_path)
+
+    def chunk_range(self, index: int):
+        if index < 0 or index >= self.chunk_count:
+            raise UploadError(f'Chunk index must be between 0 and {self.chunk_count - 1}')
+        offset = index * self.meta['chunk_size']
+        return offset, min(self.meta['chunk_size'], self.meta['size'] - offset)
+
+    def write_chunk(self, index: int, data: bytes):
+        if self.is_complete:
+            raise UploadError('Upload already completed')
+        offset, length = self.chunk_range(index)
+        if len(data) != length:
+            raise UploadError(f'Chunk {index} must be exactly {length} bytes, got {len(data)}')
+        if index == 0:
+            container = uploadhandlers.sniff_container(data[:uploadhandlers.SNIFF_BYTES])
+            expected = 'matroska' if self.meta['ext'] == '.webm' else 'isobmff'
+            if container != expected:
+                raise UploadError('The uploaded file is not a valid MP4, MOV or WebM video')
+
+        with metrics.stage('upload_chunk'):
+            fd = os.open(self.data_path, os.O_WRONLY)
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, offset)
+                    view = view[written:]
+                    offset += written
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        # Only mark the chunk received once its bytes are durable
+        open(os.path.join(self.parts_dir, str(index)), 'w').close()
+        # Keep active sessions from expiring mid-upload
+        os.utime(os.path.join(self.directory, 'meta.json'))
+
+    def received(self):
+        indexes = []
+        for name in os.listdir(self.parts_dir):
+            if name.isdigit():
+                indexes.append(int(name))
+        return sorted(indexes)
+
+    def missing(self):
+        received = set(self.received())
+        return [index for index in range(self.chunk_count) if index not in received]
+
+    def contiguous_offset(self) -> int:
+        """Bytes received without gaps from the start, for simple sequential resumes."""
+        received = set(self.received())
+        index = 0
+        while index in received:
+            index += 1
+        return min(index * self.meta['chunk_size'], self.meta['size'])
+
+    def complete(self) -> str:
+        """Verify every chunk arrived, hash the assembled file and mark the session done."""
+        if self.is_complete:
+            return self.meta['content_hash']
+        missing = self.missing()
+        if missing:
+            raise UploadError(f'{len(missing)} chunk(s) still missing')
+        content_hash = hashlib.sha256()
+        with open(self.data_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                content_hash.update(block)
+        self.meta['content_hash'] = content_hash.hexdigest()
+        self.meta['completed'] = time.time()
+        self._save_meta()
+        return self.meta['content_hash']
+
+    def status(self) -> dict:
+        return {
+            'upload_id': self.upload_id,
+            'size': self.meta['size'],
+            'chunk_size': self.meta['chunk_size'],
+            'chunk_count': self.chunk_count,
+            'received': self.received(),
+            'missing': self.missing(),
+            'offset': self.contiguous_offset(),
+            'completed': self.is_complete,
+        }
+
+    def link_copy(self) -> str:
+        """
+        Return a private hardlink (or copy) of the assembled file for a consumer that
+        deletes its input when done, such as the background task. The session keeps
+        its own copy so the same upload can be converted again with another trim.
+        """
+        path = artifacts.create('uploads', self.meta['ext'])
+        os.remove(path)
+        try:
+            os.link(self.data_path, path)
+        except OSError:
+            shutil.copyfile(self.data_path, path)
+        return path
+
+    def delete(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def prune_sessions():
+    """Remove upload sessions older than UPLOAD_SESSION_TTL."""
+    ttl = getattr(settings, 'UPLOAD_SESSION_TTL', 3600)
+    cutoff = time.time() - ttl
+    root = get_session_root()
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        try:
+            if os.path.getmtime(os.path.join(directory, 'meta.json')) < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+                logger.info(f"Pruned expired upload session {name}")
+        except OSError:
+            continue
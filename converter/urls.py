@@ -1,12 +1,31 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'converter'
 
+# Under ASGI the long-running endpoints have native async implementations
+if getattr(settings, 'ASYNC_VIEWS', False):
+    convert_view, download_view = views.convert_video_async, views.download_converted_async
+    events_view = views.job_events_async
+else:
+    convert_view, download_view = views.convert_video, views.download_converted
+    events_view = views.job_events
+
 urlpatterns = [
     path('', views.home, name='home'),
-    path('convert/', views.convert_video, name='convert_video'),
+    path('convert/', convert_view, name='convert_video'),
+    path('convert/batch/', views.convert_batch, name='convert_batch'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<str:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('uploads/<str:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<str:upload_id>/complete/', views.upload_complete, name='upload_complete'),
+    path('uploads/<str:upload_id>/thumbnails/', views.upload_thumbnails, name='upload_thumbnails'),
+    path('uploads/<str:upload_id>/thumbnails/sprite.jpg', views.upload_sprite, name='upload_sprite'),
+    path('uploads/<str:upload_id>/preview/', views.upload_preview, name='upload_preview'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('jobs/<str:job_id>/', views.job_status, name='job_status'),
-    path('download/<str:token>/', views.download_converted, name='download_converted'),
+    path('jobs/<str:job_id>/events/', events_view, name='job_events'),
+    path('download/<str:token>/', download_view, name='download_converted'),
 ]
\ No newline at end of file
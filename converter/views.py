@@ -1,15 +1,14 @@
 import os
-import uuid
+import json
+import time
+import asyncio
+import hashlib
 import logging
-import tempfile
-import subprocess
-import shutil
 from django.shortcuts import render
-from django.http import JsonResponse, StreamingHttpResponse
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.conf import settings
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.core.cache import cache
-import importlib
+from . import admission, artifact_storage, artifacts, delivery, engine, jobs, metrics, preview, probe, progress, registry, result_cache, sizing, uploadhandlers, uploads
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -26,170 +25,654 @@ def health_check(request):
     """Simple health check endpoint."""
     return JsonResponse({'status': 'healthy', 'message': 'Chromi is running!'})
 
-def convert_with_ffmpeg(input_path, output_path, start_seconds, duration):
-    """Convert video to GIF using FFmpeg directly - more reliable than MoviePy."""
-    
-    # Check if ffmpeg is available
-    if not shutil.which('ffmpeg'):
-        raise Exception("FFmpeg not found on system")
-    
-    try:
-        # FFmpeg command for high-quality GIF conversion
-        cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-ss', str(start_seconds),  # Start time in seconds
-            '-t', str(duration),        # Duration in seconds
-            '-vf', 'fps=15,scale=640:360:flags=lanczos,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse',
-            '-loop', '0',               # Loop forever (Chrome requirement)
-            '-y',                       # Overwrite output file
-            output_path
-        ]
-        
-        logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
-        
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            timeout=120,  # 2 minute timeout
-            cwd=os.path.dirname(input_path)
-        )
-        
-        if result.returncode != 0:
-            logger.error(f"FFmpeg stderr: {result.stderr}")
-            raise Exception(f"FFmpeg failed with return code {result.returncode}: {result.stderr}")
-        
-        # Check if output file was created and has content
-        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-            raise Exception("FFmpeg did not create a valid output file")
-            
-        logger.info(f"FFmpeg conversion successful. Output file size: {os.path.getsize(output_path)} bytes")
-        return True
-        
-    except subprocess.TimeoutExpired:
-        logger.error("FFmpeg conversion timed out")
-        raise Exception("Video conversion timed out after 2 minutes")
-    except Exception as e:
-        logger.error(f"FFmpeg conversion error: {str(e)}")
-        raise Exception(f"Video conversion failed: {str(e)}")
+def save_upload(video_file, file_ext):
+    """
+    Return (path, content_hash) for the uploaded video. Uploads received by
+    VideoUploadHandler are already on disk and hashed, so we just take the file over.
+    """
+    if isinstance(video_file, uploadhandlers.VideoUpload):
+        return video_file.detach(), video_file.content_hash
+
+    # Save uploaded file temporarily, hashing it as it streams for the result cache
+    upload_temp = artifacts.temporary_file('uploads', file_ext)
+    content_hash = hashlib.sha256()
+    with metrics.stage('upload_write'), upload_temp as destination:
+        for chunk in video_file.chunks():
+            content_hash.update(chunk)
+            destination.write(chunk)
+    return upload_temp.name, content_hash.hexdigest()
+
+def _conversion_result(output_path: str, cache_hit: bool) -> dict:
+    """Response fields for a finished conversion, including the encoding a byte budget chose."""
+    result = {'success': True, 'cached': cache_hit}
+    if engine.target_bytes_setting():
+        result['encoding'] = sizing.recorded_encoding(output_path)
+    return result
+
 
 def convert_video(request):
-    """Convert uploaded video to Chrome-compatible background format (GIF) using FFmpeg only."""
-    if request.method == 'POST' and request.FILES.get('video'):
+    """
+    Convert a video to Chrome-compatible background format (GIF) via the conversion engine.
+    The source is either a multipart 'video' file or the upload_id of a completed resumable upload.
+    """
+    upload_id = None
+    if request.method == 'POST':
+        # Parsing the body runs VideoUploadHandler, which may reject the file early
+        upload_id = request.POST.get('upload_id') or request.GET.get('upload_id')
+        rejected = getattr(request, 'upload_rejected', None)
+        if rejected:
+            return JsonResponse({'error': rejected}, status=400)
+
+    if request.method == 'POST' and (request.FILES.get('video') or upload_id):
         upload_path = None
         output_path = None
-        download_token = None
+        converted_url = None
 
         try:
-            video_file = request.FILES['video']
-            file_ext = os.path.splitext(video_file.name)[1].lower()
+            # Trim parameters (the query string wins: streamed uploads start encoding before the form fields arrive)
+            start_time = request.GET.get('start_time') or request.POST.get('start_time', '00:00:00')
+            duration = engine.CHROME_GIF_DURATION  # Chrome requirement
+            start_seconds = uploadhandlers.parse_start_time(start_time)
 
-            if file_ext not in ['.mp4', '.mov', '.webm']:
-                return JsonResponse({'error': 'Only .mp4, .mov, and .webm files are supported'}, status=400)
+            session = None
+            if upload_id:
+                session = uploads.UploadSession.load(upload_id)
+                if session is None or not session.is_complete:
+                    return JsonResponse({'error': 'Upload not found or not completed'}, status=400)
+                # The session keeps its file so the same upload can be converted again
+                source_path = session.data_path
+                content_hash = session.meta['content_hash']
+            else:
+                video_file = request.FILES['video']
+                file_ext = os.path.splitext(video_file.name)[1].lower()
+
+                if file_ext not in uploadhandlers.SUPPORTED_EXTENSIONS:
+                    return JsonResponse({'error': 'Only .mp4, .mov, and .webm files are supported'}, status=400)
 
-            # Save uploaded file temporarily
-            upload_temp = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-            upload_path = upload_temp.name
-            with upload_temp as destination:
-                for chunk in video_file.chunks():
-                    destination.write(chunk)
+                conversion = getattr(video_file, 'conversion', None)
+                if conversion is not None:
+                    # The upload was piped straight into ffmpeg; it has been encoding all along
+                    video_file.detach()
+                    try:
+                        output_path = conversion.output_path
+                        conversion.wait()
+                    finally:
+                        conversion.abort()
+                    cached = result_cache.get_result_cache()
+                    if cached is not None:
+                        cached.put(result_cache.cache_key(video_file.content_hash, start_seconds, duration), output_path)
+                    converted_url = registry.issue_download(output_path)
+                    return JsonResponse({'success': True, 'converted_url': converted_url, 'cached': False})
+
+                upload_path, content_hash = save_upload(video_file, file_ext)
+                source_path = upload_path
 
             # Prepare output file
-            output_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.gif')
-            output_path = output_temp.name
-            output_temp.close()
+            output_path = artifacts.create('outputs', '.gif')
 
-            # Trim parameters
-            start_time = request.POST.get('start_time', '00:00:00')
-            duration = int(request.POST.get('duration', 6))
-            duration = 6  # Chrome requirement
+            cache_hit = False
+            if getattr(settings, 'USE_RQ', False):
+                cached = result_cache.get_result_cache()
+                key = result_cache.cache_key(content_hash, start_seconds, duration)
+                cache_hit = cached is not None and cached.copy_to(key, output_path)
+                if not cache_hit:
+                    # Async mode: hand the upload to the job backend and return immediately.
+                    # The task owns the upload file from here on and removes it when done.
+                    # Reject impossible trims now instead of after a trip through the queue.
+                    probe.preflight(source_path, start_seconds, duration)
+                    if session is not None:
+                        upload_path = session.link_copy()
+                    job_id = jobs.enqueue_conversion(upload_path, start_seconds, duration, content_hash)
+                    upload_path = None
+                    return JsonResponse({
+                        'success': True,
+                        'job_id': job_id,
+                        'status_url': f"/jobs/{job_id}/",
+                        'events_url': f"/jobs/{job_id}/events/",
+                    }, status=202)
+            else:
+                cache_hit = result_cache.convert_cached(source_path, output_path, start_seconds, duration, content_hash)
 
-            start_seconds = 0
-            if start_time and start_time != '00:00:00':
-                h, m, s = map(int, start_time.split(':'))
-                start_seconds = h * 3600 + m * 60 + s
+            result = _conversion_result(output_path, cache_hit)
+            # Generate a one-time download token, visible to every worker
+            converted_url = registry.issue_download(output_path)
 
-            # 🔥 Use FFmpeg directly
-            convert_with_ffmpeg(upload_path, output_path, start_seconds, duration)
+            return JsonResponse(dict(result, converted_url=converted_url))
 
-            # Generate download token
-            download_token = str(uuid.uuid4())
-            cache.set(f'dl:{download_token}', output_path, timeout=600)
-            converted_url = f"/download/{download_token}/"
+        except probe.ProbeError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
-            return JsonResponse({'success': True, 'converted_url': converted_url})
+        except admission.Saturated as e:
+            # Shed load quickly instead of letting every conversion crawl to the timeout
+            response = JsonResponse({'error': str(e)}, status=e.status)
+            response['Retry-After'] = str(e.retry_after)
+            return response
 
         except Exception as e:
-            logger.error(f"FFmpeg conversion error: {str(e)}")
+            logger.error(f"Conversion error: {str(e)}")
             return JsonResponse({'error': f'Conversion failed: {str(e)}'}, status=500)
 
         finally:
             if upload_path and os.path.exists(upload_path):
                 os.remove(upload_path)
 
-            if not download_token and output_path and os.path.exists(output_path):
+            if not converted_url and output_path and os.path.exists(output_path):
                 os.remove(output_path)
 
     return JsonResponse({'error': 'No video file provided'}, status=400)
 
+def _parse_clips(raw) -> list:
+    """Validate a batch's clip specs ({start_time, duration, preset}) into engine.Clip objects."""
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('clips must be a non-empty list')
+    max_clips = getattr(settings, 'BATCH_MAX_CLIPS', 8)
+    if len(raw) > max_clips:
+        raise ValueError(f'At most {max_clips} clips per batch')
+    max_seconds = getattr(settings, 'BATCH_MAX_CLIP_SECONDS', engine.CHROME_GIF_DURATION)
+    clips = []
+    for spec in raw:
+        if not isinstance(spec, dict):
+            raise ValueError('Each clip must be an object')
+        start_time = spec.get('start_time', '00:00:00')
+        start = float(start_time) if isinstance(start_time, (int, float)) else uploadhandlers.parse_start_time(start_time)
+        duration = float(spec.get('duration', engine.CHROME_GIF_DURATION))
+        preset = spec.get('preset', 'chrome')
+        if start < 0 or not 0 < duration <= max_seconds:
+            raise ValueError(f'Clip durations must be between 0 and {max_seconds} seconds')
+        if preset not in engine.presets():
+            raise ValueError(f'Unknown preset: {preset}')
+        clips.append(engine.Clip(start, duration, preset))
+    return clips
+
+def convert_batch(request):
+    """
+    Convert several clips of one video in a single pass. Expects the source as
+    upload_id or a multipart 'video' file, plus 'clips': a JSON list of
+    {start_time, duration, preset}. Returns one download URL per clip, in order.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+        upload_id, raw_clips = data.get('upload_id'), data.get('clips')
+    else:
+        upload_id, raw_clips = request.POST.get('upload_id'), request.POST.get('clips')
+        rejected = getattr(request, 'upload_rejected', None)
+        if rejected:
+            return JsonResponse({'error': rejected}, status=400)
+    try:
+        clips = _parse_clips(json.loads(raw_clips) if isinstance(raw_clips, str) else raw_clips)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    upload_path = None
+    output_paths = []
+    issued = False
+    try:
+        session = None
+        if upload_id:
+            session = uploads.UploadSession.load(upload_id)
+            if session is None or not session.is_complete:
+                return JsonResponse({'error': 'Upload not found or not completed'}, status=400)
+            source_path = session.data_path
+            content_hash = session.meta['content_hash']
+        elif request.FILES.get('video'):
+            video_file = request.FILES['video']
+            file_ext = os.path.splitext(video_file.name)[1].lower()
+            if file_ext not in uploadhandlers.SUPPORTED_EXTENSIONS:
+                return JsonResponse({'error': 'Only .mp4, .mov, and .webm files are supported'}, status=400)
+            upload_path, content_hash = save_upload(video_file, file_ext)
+            source_path = upload_path
+        else:
+            return JsonResponse({'error': 'No video file provided'}, status=400)
+
+        if getattr(settings, 'USE_RQ', False):
+            if session is not None:
+                upload_path = session.link_copy()
+            job_id = jobs.enqueue_batch(upload_path, clips, content_hash)
+            upload_path = None
+            return JsonResponse({
+                'success': True,
+                'job_id': job_id,
+                'status_url': f"/jobs/{job_id}/",
+                'events_url': f"/jobs/{job_id}/events/",
+            }, status=202)
+
+        output_paths = [artifacts.create('outputs', '.gif') for _clip in clips]
+        hits = result_cache.convert_batch_cached(source_path, clips, output_paths, content_hash)
+        results = [{'start': clip.start, 'duration': clip.duration, 'preset': clip.preset, 'cached': hit,
+                    'converted_url': registry.issue_download(path)}
+                   for clip, hit, path in zip(clips, hits, output_paths)]
+        issued = True
+        return JsonResponse({'success': True, 'clips': results})
+
+    except probe.ProbeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    except admission.Saturated as e:
+        response = JsonResponse({'error': str(e)}, status=e.status)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+
+    except Exception as e:
+        logger.error(f"Batch conversion error: {str(e)}")
+        return JsonResponse({'error': f'Conversion failed: {str(e)}'}, status=500)
+
+    finally:
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+        if not issued:
+            for path in output_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+def upload_create(request):
+    """Start a resumable chunked upload. Expects JSON {filename, size}."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        data = json.loads(request.body or b'{}')
+        session = uploads.UploadSession.create(data.get('filename', ''), int(data.get('size', 0)))
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(session.status(), status=201)
+
+def upload_detail(request, upload_id: str):
+    """Report which chunks of an upload have arrived, so clients can resume."""
+    session = uploads.UploadSession.load(upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found or expired'}, status=404)
+    return JsonResponse(session.status())
+
+def upload_chunk(request, upload_id: str, index: int):
+    """Store one chunk (raw request body) of a resumable upload at its offset."""
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'PUT required'}, status=405)
+    session = uploads.UploadSession.load(upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found or expired'}, status=404)
+    try:
+        _offset, length = session.chunk_range(index)
+        # Read the stream directly: request.body would be capped by DATA_UPLOAD_MAX_MEMORY_SIZE
+        session.write_chunk(index, request.read(length + 1))
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'upload_id': upload_id, 'index': index, 'received': True})
+
+def upload_complete(request, upload_id: str):
+    """Assemble a resumable upload once every chunk has arrived."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    session = uploads.UploadSession.load(upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found or expired'}, status=404)
+    try:
+        session.complete()
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e), 'missing': session.missing()}, status=409)
+    return JsonResponse(session.status())
+
+def _completed_upload(upload_id: str):
+    session = uploads.UploadSession.load(upload_id)
+    if session is None or not session.is_complete:
+        return None
+    return session
+
+def upload_thumbnails(request, upload_id: str):
+    """Keyframe sprite sheet metadata for the trim timeline: tile size, grid and each tile's time."""
+    session = _completed_upload(upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found or not completed'}, status=404)
+    try:
+        sheet = preview.thumbnails(session)
+    except probe.ProbeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except admission.Saturated as e:
+        response = JsonResponse({'error': str(e)}, status=e.status)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    except engine.ConversionError as e:
+        logger.error(f"Thumbnail error: {str(e)}")
+        return JsonResponse({'error': f'Thumbnails failed: {str(e)}'}, status=500)
+    return JsonResponse(dict(sheet, sprite_url=f'/uploads/{upload_id}/thumbnails/sprite.jpg'))
+
+def upload_sprite(request, upload_id: str):
+    """The sprite sheet image built by upload_thumbnails."""
+    session = _completed_upload(upload_id)
+    if session is None or not os.path.exists(preview.sprite_path(session)):
+        return JsonResponse({'error': 'Thumbnails not found'}, status=404)
+    response = delivery.serve_file(request, preview.sprite_path(session), 'thumbnails.jpg', content_type='image/jpeg')
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+def upload_preview(request, upload_id: str):
+    """
+    Low-res, low-fps GIF of a trim (?start_time=HH:MM:SS&duration=N) of a completed
+    upload, cached per upload so scrubbing back to a start time is instant.
+    """
+    session = _completed_upload(upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found or not completed'}, status=404)
+    try:
+        start_seconds = uploadhandlers.parse_start_time(request.GET.get('start_time', '00:00:00'))
+        duration = float(request.GET.get('duration', engine.CHROME_GIF_DURATION))
+        if not 0 < duration <= getattr(settings, 'BATCH_MAX_CLIP_SECONDS', engine.CHROME_GIF_DURATION):
+            raise ValueError('duration out of range')
+    except ValueError:
+        return JsonResponse({'error': 'start_time must be HH:MM:SS and duration a number of seconds'}, status=400)
+    try:
+        path = preview.preview(session, start_seconds, duration)
+    except probe.ProbeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except admission.Saturated as e:
+        response = JsonResponse({'error': str(e)}, status=e.status)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    except engine.ConversionError as e:
+        logger.error(f"Preview error: {str(e)}")
+        return JsonResponse({'error': f'Preview failed: {str(e)}'}, status=500)
+    response = delivery.serve_file(request, path, 'preview.gif', content_type='image/gif')
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 def job_status(request, job_id: str):
-    """Return RQ job status and result URL if available."""
+    """Return background job status and result URL if available."""
     use_rq = getattr(settings, 'USE_RQ', False)
     if not use_rq:
-        return JsonResponse({'error': 'RQ not enabled'}, status=400)
+        return JsonResponse({'error': 'Async conversion not enabled'}, status=400)
 
     try:
-        rq_job_module = importlib.import_module('rq.job')
-        redis_module = importlib.import_module('redis')
-    except Exception:
-        return JsonResponse({'error': 'RQ/Redis not available'}, status=400)
+        backend = jobs.get_job_backend()
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = backend.status(job_id)
+    if response is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(response)
 
-    Redis = getattr(redis_module, 'Redis')
-    Job = getattr(rq_job_module, 'Job')
-    redis_url = getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
-    redis_conn = Redis.from_url(redis_url)
+def _backend_progress(job_id: str):
+    """
+    Progress snapshot derived from the job backend, for jobs that never published
+    one or died without reporting a terminal state (worker crash, job timeout).
+    """
     try:
-        job = Job.fetch(job_id, connection=redis_conn)
+        status = jobs.get_job_backend().status(job_id)
     except Exception:
+        return None
+    if status is None:
+        return None
+    result = status.get('result') or {}
+    state = {'job_id': job_id, 'seq': 0, 'state': status['status']}
+    if status['status'] == 'finished' and result.get('success') is not False:
+        state['converted_url'] = status.get('converted_url') or result.get('converted_url')
+        if result.get('clips'):
+            state['clips'] = result['clips']
+    elif status['status'] in ('finished', 'failed', 'stopped', 'canceled'):
+        state['state'] = 'failed'
+        state['error'] = result.get('error') or 'Conversion job failed'
+    return state
+
+def _sse_event(state: dict) -> str:
+    return f"id: {state['seq']}\ndata: {json.dumps(state)}\n\n"
+
+def _progress_events(job_id: str, after: int, window: float):
+    """Yield server-sent events for each new snapshot until the job ends or the window closes."""
+    store = progress.get_progress_store()
+    deadline = time.monotonic() + window
+    # Reconnect quickly once we close the stream; EventSource resends Last-Event-ID
+    yield "retry: 1000\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        state = store.wait(job_id, after, min(remaining, 10))
+        if state is not None and state['seq'] > after:
+            after = state['seq']
+            yield _sse_event(state)
+        else:
+            # Comment line: keeps proxies from timing out an idle connection
+            yield ": keepalive\n\n"
+        if state is not None and state.get('state') in progress.TERMINAL_STATES:
+            return
+
+    fallback = _backend_progress(job_id)
+    if fallback is not None and fallback['state'] in progress.TERMINAL_STATES:
+        fallback['seq'] = after + 1
+        yield _sse_event(fallback)
+
+def _event_stream(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _job_events_args(request, job_id: str):
+    """Validate a job_events request: (after, timeout, window), or the JsonResponse refusing it."""
+    use_rq = getattr(settings, 'USE_RQ', False)
+    if not use_rq:
+        return JsonResponse({'error': 'Async conversion not enabled'}, status=400)
+
+    store = progress.get_progress_store()
+    if store.get(job_id) is None and _backend_progress(job_id) is None:
         return JsonResponse({'error': 'Job not found'}, status=404)
 
-    response = {
-        'id': job.id,
-        'status': job.get_status(),
-    }
-    # Include result or meta if present
-    if job.is_finished and job.result:
-        response['result'] = job.result
-    if getattr(job, 'meta', None) and 'converted_url' in job.meta:
-        response['converted_url'] = job.meta['converted_url']
-    return JsonResponse(response)
+    window = getattr(settings, 'PROGRESS_STREAM_SECONDS', 25)
+    try:
+        after = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('after') or 0)
+        timeout = min(float(request.GET.get('timeout', window)), window)
+    except ValueError:
+        return JsonResponse({'error': 'after and timeout must be numbers'}, status=400)
+    return after, timeout, window
 
+def job_events(request, job_id: str):
+    """
+    Live progress for a background job: frame count, speed, encoded time and percent.
+    EventSource clients (Accept: text/event-stream) get a server-sent event stream;
+    anything else long-polls, getting JSON as soon as seq exceeds ?after= or on timeout.
+    """
+    args = _job_events_args(request, job_id)
+    if isinstance(args, JsonResponse):
+        return args
+    after, timeout, window = args
 
-def download_converted(request, token: str):
-    """Stream the converted GIF by a one-time token and delete after streaming."""
-    key = f'dl:{token}'
-    path = cache.get(key)
+    if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+        return _event_stream(_progress_events(job_id, after, window))
+
+    store = progress.get_progress_store()
+    state = store.wait(job_id, after, max(timeout, 0))
+    if state is None or state.get('state') not in progress.TERMINAL_STATES:
+        # The job may have died without publishing its end state
+        fallback = _backend_progress(job_id)
+        if fallback is not None and (state is None or fallback['state'] in progress.TERMINAL_STATES):
+            fallback['seq'] = max(after, state['seq'] if state else 0) + 1
+            state = fallback
+    if state is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(state)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint: per-stage histograms merged across every worker on
+    the host, plus top tracemalloc allocation sites when ENABLE_TRACEMALLOC is on.
+    """
+    expected = getattr(settings, 'METRICS_TOKEN', '')
+    if expected and request.META.get('HTTP_AUTHORIZATION', '') != f'Bearer {expected}':
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    body = metrics.render(metrics.get_registry().collect())
+    body += '\n'.join(artifacts.render_usage(artifacts.get_artifact_manager().usage())) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _redirect_download(request, tokens, token: str, locator: str, filename: str):
+    """Send the client to a presigned URL for an artifact in object storage."""
+    store = artifact_storage.get_artifact_storage()
+    if request.method == 'HEAD':
+        # A URL presigned for GET refuses HEAD, so answer from the object's metadata; the token stays
+        try:
+            head = store.head(locator)
+        except Exception:
+            return JsonResponse({'error': 'File not found or expired'}, status=404)
+        response = HttpResponse(content_type=head.get('ContentType') or 'image/gif')
+        response['Content-Length'] = str(head['ContentLength'])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+    if tokens.claim(token) != locator:
+        return JsonResponse({'error': 'File not found or expired'}, status=404)
+    # The object outlives its URL briefly
+    store.schedule_discard(locator)
+    response = HttpResponseRedirect(store.download_url(locator, filename))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _download_response(request, token: str, asynchronous: bool = False):
+    tokens = registry.get_token_registry()
+    path = tokens.peek(token)
+    filename = 'chromi_background.gif'
+    if artifact_storage.is_remote(path):
+        return _redirect_download(request, tokens, token, path, filename)
     if not path or not os.path.exists(path):
         return JsonResponse({'error': 'File not found or expired'}, status=404)
 
-    # One-time: remove cache entry now
-    cache.delete(key)
+    if not delivery.delivers_final_byte(request, path):
+        # HEAD, revalidation or a mid-file range: serve it without consuming the token
+        return delivery.serve_file(request, path, filename, content_type='image/gif', asynchronous=asynchronous)
 
-    def stream_and_delete(file_path: str, chunk_size: int = 8192):
-        try:
-            with open(file_path, 'rb') as f:
-                while True:
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-        finally:
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
+    # One-time: atomically consume the token so only one request completes delivery
+    if tokens.claim(token) != path:
+        return JsonResponse({'error': 'File not found or expired'}, status=404)
 
-    response = StreamingHttpResponse(stream_and_delete(path), content_type='image/gif')
-    response['Content-Disposition'] = 'attachment; filename="chromi_background.gif"'
-    return response
+    offload = getattr(settings, 'DOWNLOAD_OFFLOAD', '')
+    if offload:
+        delivery.schedule_removal(path)
+        return delivery.offload_response(path, filename, 'image/gif', offload)
+
+    return delivery.serve_file(request, path, filename, content_type='image/gif',
+                               on_complete=lambda: delivery.remove_file(path), asynchronous=asynchronous)
+
+def download_converted(request, token: str):
+    """Serve the converted GIF by a one-time token and delete it once fully delivered."""
+    return _download_response(request, token)
+
+
+# Native async views, routed instead of convert_video/download_converted when
+# ASYNC_VIEWS is on (the uvicorn gunicorn profile). A waiting conversion or a slow
+# download then holds a coroutine instead of one of the worker's few threads.
+
+async def convert_video_async(request):
+    """
+    convert_video for ASGI: ffmpeg runs as an asyncio subprocess and is killed if the
+    client disconnects (Django cancels the view task). Queueing in USE_RQ mode only
+    involves short blocking steps, so it reuses the sync view in a worker thread.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'No video file provided'}, status=400)
+    if getattr(settings, 'USE_RQ', False):
+        return await asyncio.to_thread(convert_video, request)
+
+    # Multipart parsing spools the upload to disk: keep it off the event loop
+    upload_id = await asyncio.to_thread(lambda: request.POST.get('upload_id') or request.GET.get('upload_id'))
+    rejected = getattr(request, 'upload_rejected', None)
+    if rejected:
+        return JsonResponse({'error': rejected}, status=400)
+    if not request.FILES.get('video') and not upload_id:
+        return JsonResponse({'error': 'No video file provided'}, status=400)
+
+    upload_path = None
+    output_path = None
+    converted_url = None
+    try:
+        start_time = request.GET.get('start_time') or request.POST.get('start_time', '00:00:00')
+        duration = engine.CHROME_GIF_DURATION  # Chrome requirement
+        start_seconds = uploadhandlers.parse_start_time(start_time)
+
+        if upload_id:
+            session = uploads.UploadSession.load(upload_id)
+            if session is None or not session.is_complete:
+                return JsonResponse({'error': 'Upload not found or not completed'}, status=400)
+            source_path = session.data_path
+            content_hash = session.meta['content_hash']
+        else:
+            video_file = request.FILES['video']
+            file_ext = os.path.splitext(video_file.name)[1].lower()
+            if file_ext not in uploadhandlers.SUPPORTED_EXTENSIONS:
+                return JsonResponse({'error': 'Only .mp4, .mov, and .webm files are supported'}, status=400)
+            upload_path, content_hash = await asyncio.to_thread(save_upload, video_file, file_ext)
+            source_path = upload_path
+
+        output_path = artifacts.create('outputs', '.gif')
+
+        cache_hit = await result_cache.convert_cached_async(source_path, output_path, start_seconds, duration,
+                                                            content_hash)
+        result = await asyncio.to_thread(_conversion_result, output_path, cache_hit)
+        converted_url = await asyncio.to_thread(registry.issue_download, output_path)
+        return JsonResponse(dict(result, converted_url=converted_url))
+
+    except probe.ProbeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    except admission.Saturated as e:
+        response = JsonResponse({'error': str(e)}, status=e.status)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+
+    except Exception as e:
+        logger.error(f"Conversion error: {str(e)}")
+        return JsonResponse({'error': f'Conversion failed: {str(e)}'}, status=500)
+
+    finally:
+        # Also runs when the client disconnected and the task was cancelled
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+        if not converted_url and output_path and os.path.exists(output_path):
+            os.remove(output_path)
+
+async def _progress_events_async(job_id: str, after: int, window: float):
+    """_progress_events as an async generator, so ASGI sends each event as soon as it is yielded."""
+    store = progress.get_progress_store()
+    deadline = time.monotonic() + window
+    yield "retry: 1000\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Stores block (file polling, Redis); each wait holds a worker thread, not the event loop
+        state = await asyncio.to_thread(store.wait, job_id, after, min(remaining, 10))
+        if state is not None and state['seq'] > after:
+            after = state['seq']
+            yield _sse_event(state)
+        else:
+            yield ": keepalive\n\n"
+        if state is not None and state.get('state') in progress.TERMINAL_STATES:
+            return
+
+    fallback = await asyncio.to_thread(_backend_progress, job_id)
+    if fallback is not None and fallback['state'] in progress.TERMINAL_STATES:
+        fallback['seq'] = after + 1
+        yield _sse_event(fallback)
+
+async def job_events_async(request, job_id: str):
+    """
+    job_events for ASGI. Django has to drain a sync iterator before sending it, which
+    would deliver a whole window of events at once, so the stream is an async generator.
+    """
+    if 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+        # A long-poll is a single response: run it in a worker thread
+        return await asyncio.to_thread(job_events, request, job_id)
+    args = await asyncio.to_thread(_job_events_args, request, job_id)
+    if isinstance(args, JsonResponse):
+        return args
+    after, _timeout, window = args
+    return _event_stream(_progress_events_async(job_id, after, window))
+
+async def download_converted_async(request, token: str):
+    """download_converted for ASGI: the body is streamed without holding a thread."""
+    # Token lookups may hit Redis; only the body streaming needs the event loop
+    return await asyncio.to_thread(_download_response, request, token, True)
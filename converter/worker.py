@@ -0,0 +1,213 @@
+import os
+import gc
+import time
+import signal
+import shutil
+import logging
+import resource
+import importlib
+import subprocess
+import multiprocessing
+from multiprocessing.connection import wait
+from django.conf import settings
+from django.db import connections
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Imported once in the supervisor so every forked child starts with them loaded
+PREWARM_MODULES = ('numpy', 'converter.tasks', 'converter.gifopt', 'converter.looping', 'converter.sizing')
+
+# Redis list of the job ids a worker has prefetched from a queue: PREFETCH_KEY<worker>:<queue>
+PREFETCH_KEY = 'chromi:worker:prefetch:'
+
+
+def prewarm():
+    """
+    Import the conversion stack and run ffmpeg/ffprobe once, so shared libraries are
+    mapped and in the page cache before the first job. gc.freeze() then moves all of
+    it out of the collector's reach, so forked children never write to those pages
+    and keep sharing them with the supervisor.
+    """
+    started = time.monotonic()
+    for name in PREWARM_MODULES:
+        importlib.import_module(name)
+    for binary in ('ffmpeg', 'ffprobe'):
+        if shutil.which(binary):
+            subprocess.run([binary, '-version'], stdin=subprocess.DEVNULL, capture_output=True)
+        else:
+            logger.warning(f"{binary} not found; jobs needing it will fail")
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Worker prewarmed in {time.monotonic() - started:.2f}s")
+
+
+def peak_rss_bytes() -> int:
+    """This process's resident memory high-water mark."""
+    sample = metrics.sample_process(os.getpid())
+    if sample is not None:
+        return sample[1]
+    # Linux reports ru_maxrss in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def worker_class(rq):
+    """
+    An RQ SimpleWorker (jobs run in the worker itself, no fork per job) that dequeues
+    up to prefetch jobs per pull and stops once its memory high-water mark passes
+    max_rss_bytes, so the pool replaces it with a fresh child. Prefetched job ids are
+    LMOVEd into a Redis list of their own rather than only held in memory, so jobs a
+    killed worker never ran are pushed back by the next worker's maintenance pass.
+    """
+
+    class ConversionWorker(rq.SimpleWorker):
+        def __init__(self, *args, max_rss_bytes: int = 0, prefetch: int = 1, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.max_rss_bytes = max_rss_bytes
+            self.prefetch = max(1, prefetch)
+            self._prefetched = []
+
+        def _prefetch_key(self, queue_name: str) -> str:
+            return f'{PREFETCH_KEY}{self.name}:{queue_name}'
+
+        def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+            if self._prefetched:
+                # What the base class does on every pull: show as idle, keep the registration alive
+                self.set_state(rq.worker.WorkerStatus.IDLE)
+                self.heartbeat()
+                if self.should_run_maintenance_tasks:
+                    self.run_maintenance_tasks()
+                return self._prefetched.pop(0)
+            result = super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+            # Only jobs already waiting are taken; an empty queue never blocks here
+            while result is not None and len(self._prefetched) < self.prefetch - 1:
+                extra = self._prefetch_one()
+                if extra is None:
+                    break
+                self._prefetched.append(extra)
+            return result
+
+        def _prefetch_one(self):
+            for queue in self._ordered_queues:
+                key = self._prefetch_key(queue.name)
+                job_id = self.connection.lmove(queue.key, key, 'LEFT', 'RIGHT')
+                if job_id is None:
+                    continue
+                job_id = rq.utils.as_text(job_id)
+                try:
+                    job = self.job_class.fetch(job_id, connection=self.connection, serializer=self.serializer)
+                except rq.exceptions.NoSuchJobError:
+                    self.connection.lrem(key, 1, job_id)
+                    continue
+                return job, queue
+            return None
+
+        def requeue_prefetched(self, worker_name: str) -> int:
+            """Move a worker's prefetched job ids back to the front of their queues, in order."""
+            prefix = f'{PREFETCH_KEY}{worker_name}:'
+            moved = 0
+            for key in map(rq.utils.as_text, self.connection.scan_iter(match=f'{prefix}*')):
+                queue_key = self.queue_class.redis_queue_namespace_prefix + key[len(prefix):]
+                while self.connection.lmove(key, queue_key, 'RIGHT', 'LEFT') is not None:
+                    moved += 1
+            return moved
+
+        def run_maintenance_tasks(self):
+            super().run_maintenance_tasks()
+            # A worker's registration expires once it stops heartbeating (SIGKILL, OOM kill)
+            for key in map(rq.utils.as_text, self.connection.scan_iter(match=f'{PREFETCH_KEY}*')):
+                worker_name = key[len(PREFETCH_KEY):].split(':', 1)[0]
+                if worker_name == self.name or self.connection.exists(self.redis_worker_namespace_prefix + worker_name):
+                    continue
+                moved = self.requeue_prefetched(worker_name)
+                if moved:
+                    logger.warning(f"Requeued {moved} job(s) prefetched by dead worker {worker_name}")
+
+        def execute_job(self, job, queue):
+            # From here RQ's started registry tracks the job
+            self.connection.lrem(self._prefetch_key(queue.name), 1, job.id)
+            super().execute_job(job, queue)
+            rss = peak_rss_bytes()
+            if self.max_rss_bytes and rss > self.max_rss_bytes:
+                logger.info(f"Worker {os.getpid()} reached {rss} bytes RSS (limit {self.max_rss_bytes}), recycling")
+                metrics.inc('chromi_worker_recycles_total', reason='memory')
+                self._stop_requested = True
+
+        def teardown(self):
+            # Prefetched jobs this worker will not run go back to the front of their queues
+            self.requeue_prefetched(self.name)
+            self._prefetched = []
+            super().teardown()
+
+    return ConversionWorker
+
+
+def run_worker(queue_names, max_rss_bytes: int = 0, prefetch: int = 1, burst: bool = False):
+    """Body of one pool child: an RQ worker on its own Redis and database connections."""
+    # The supervisor's handlers came along with the fork; RQ installs its own in work()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Sockets inherited from the supervisor must not be shared between processes
+    connections.close_all()
+    try:
+        redis_module = importlib.import_module('redis')
+        rq = importlib.import_module('rq')
+    except Exception as exc:
+        raise RuntimeError('RQ/Redis not available') from exc
+    connection = redis_module.Redis.from_url(getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'))
+    queues = [rq.Queue(name, connection=connection) for name in queue_names]
+    worker = worker_class(rq)(queues, connection=connection, max_rss_bytes=max_rss_bytes, prefetch=prefetch)
+    try:
+        worker.work(burst=burst)
+    finally:
+        # multiprocessing children skip atexit, where the registry would flush
+        metrics.get_registry().flush()
+
+
+class WorkerPool:
+    """
+    Supervisor for size forked children each running target(*args). A child that
+    exits (recycled, crashed) is replaced until stop() is called; stop() sends
+    SIGTERM, which RQ treats as a warm shutdown after the current job.
+    """
+
+    def __init__(self, size: int, target, args=(), restart_delay: float = 1.0):
+        self.size = size
+        self.target = target
+        self.args = args
+        self.restart_delay = restart_delay
+        self.children = []
+        self.spawned = 0
+        self._stopping = False
+        self._context = multiprocessing.get_context('fork')
+
+    def _spawn(self):
+        child = self._context.Process(target=self.target, args=self.args, daemon=False)
+        child.start()
+        self.spawned += 1
+        self.children.append(child)
+
+    def run(self):
+        for _index in range(self.size):
+            self._spawn()
+        last_restart = 0.0
+        while not self._stopping:
+            wait([child.sentinel for child in self.children], timeout=1.0)
+            for child in [child for child in self.children if not child.is_alive()]:
+                child.join()
+                self.children.remove(child)
+                if child.exitcode not in (0, None):
+                    logger.warning(f"Worker {child.pid} exited with code {child.exitcode}")
+            while not self._stopping and len(self.children) < self.size:
+                # A child dying at startup (e.g. Redis down) must not turn into a fork loop
+                time.sleep(max(0.0, last_restart + self.restart_delay - time.monotonic()))
+                last_restart = time.monotonic()
+                self._spawn()
+        for child in self.children:
+            child.join()
+
+    def stop(self, *_args):
+        self._stopping = True
+        for child in self.children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
@@ -0,0 +1,43 @@
+# Gunicorn configuration for the ASGI profile:
+#   gunicorn chrome_background_converter.asgi:application -c gunicorn_asgi.conf.py
+# Uvicorn workers run the async conversion and download views, so a waiting
+# conversion or a slow download holds a coroutine instead of a thread and one
+# worker can keep hundreds of connections open. ffmpeg concurrency is still
+# capped by admission control (ADMISSION_* settings).
+import os
+
+# Must be set before Django loads settings: routes /convert/ and /download/ to the async views
+os.environ.setdefault('ASYNC_VIEWS', 'true')
+
+# Server socket: Render provides PORT env var
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+backlog = 2048
+
+# One event loop per worker; each can hold many idle connections
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+# Only covers worker heartbeats here; long requests do not block the loop
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Restart workers after this many requests, to help prevent memory leaks
+max_requests = 1000
+max_requests_jitter = 50
+
+# Logging
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+# Process naming
+proc_name = "chromi-asgi"
+
+# Server mechanics
+daemon = False
+pidfile = None
+umask = 0
+user = None
+group = None
+tmp_upload_dir = None
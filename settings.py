@@ -109,8 +109,14 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-# File upload size limit (100MB)
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600
+# Uploads: the 'video' field is sniffed, hashed and spooled to disk (or piped straight
+# into ffmpeg), so no upload is ever held whole in memory
+FILE_UPLOAD_HANDLERS = [
+    'converter.uploadhandlers.VideoUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # Django default (2.5MB) for any other file fields
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -132,4 +138,3 @@ LOGGING = {
 USE_RQ = config('USE_RQ', default=False, cast=bool)
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
 ENABLE_TRACEMALLOC = config('ENABLE_TRACEMALLOC', default=False, cast=bool)
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600
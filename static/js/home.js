@@ -0,0 +1,494 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Get DOM elements
+    const dropArea = document.getElementById('drop-area');
+    const fileInput = document.getElementById('videoInput');
+    const videoPreviewContainer = document.getElementById('video-preview-container');
+    const videoPreview = document.getElementById('video-preview');
+    const fileName = document.getElementById('file-name');
+    const convertBtn = document.getElementById('convert-btn');
+    const conversionStatus = document.getElementById('conversion-status');
+    const downloadContainer = document.getElementById('download-container');
+    const downloadBtn = document.getElementById('download-btn');
+    const newConversionBtn = document.getElementById('new-conversion-btn');
+    const errorContainer = document.getElementById('error-container');
+    const errorMessage = document.getElementById('error-message');
+    const errorRetryBtn = document.getElementById('error-retry-btn');
+
+    // Trim controls
+    const startTimeSlider = document.getElementById('start-time-slider');
+    const startTimeValue = document.getElementById('start-time-value');
+    const durationSlider = document.getElementById('duration-slider');
+    const durationValue = document.getElementById('duration-value');
+    const previewTrimBtn = document.getElementById('preview-trim-btn');
+
+    // CSRF token - Safe access
+    const csrfTokenInput = document.querySelector('[name=csrfmiddlewaretoken]');
+    const csrfToken = csrfTokenInput ? csrfTokenInput.value : '';
+
+    // Current file and trim settings
+    let currentFile = null;
+    let convertedFileUrl = null;
+    let startTime = "00:00:00";
+    let duration = 5; // Default duration in seconds
+    let isTrimPreview = false;
+    let originalVideoTime = 0;
+    let trimPreviewTimeout = null;
+
+    // Resumable upload tuning
+    const UPLOAD_CONCURRENCY = 4;
+    const UPLOAD_RETRIES = 3;
+
+    // Defensive check: If essential elements are missing, stop execution to prevent errors
+    if (!dropArea || !fileInput || !videoPreview || !convertBtn) {
+        console.warn('Essential DOM elements for video converter not found. Script execution stopped.');
+        return;
+    }
+
+    // Ensure file input has correct attributes even if HTML is malformed
+    if (fileInput) {
+        if (!fileInput.getAttribute('accept')) {
+            fileInput.setAttribute('accept', 'video/*');
+        }
+    }
+
+    // Prevent default drag behaviors
+    ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
+        dropArea.addEventListener(eventName, preventDefaults, false);
+        document.body.addEventListener(eventName, preventDefaults, false);
+    });
+
+    // Highlight drop area when item is dragged over it
+    ['dragenter', 'dragover'].forEach(eventName => {
+        dropArea.addEventListener(eventName, highlight, false);
+    });
+
+    ['dragleave', 'drop'].forEach(eventName => {
+        dropArea.addEventListener(eventName, unhighlight, false);
+    });
+
+    // Handle dropped files
+    dropArea.addEventListener('drop', handleDrop, false);
+
+    // Handle file input change
+    if (fileInput) {
+        fileInput.addEventListener('change', handleFiles, false);
+    }
+
+    // Handle convert button click
+    if (convertBtn) {
+        convertBtn.addEventListener('click', convertVideo, false);
+    }
+
+    // Handle download button click
+    if (downloadBtn) {
+        downloadBtn.addEventListener('click', downloadConvertedVideo, false);
+    }
+
+    // Handle new conversion button click
+    if (newConversionBtn) {
+        newConversionBtn.addEventListener('click', resetConverter, false);
+    }
+
+    // Handle error retry button click
+    if (errorRetryBtn) {
+        errorRetryBtn.addEventListener('click', resetConverter, false);
+    }
+
+    // Handle start time slider change
+    if (startTimeSlider) {
+        startTimeSlider.addEventListener('input', updateStartTimeValue, false);
+    }
+
+    // Handle duration slider change
+    if (durationSlider) {
+        durationSlider.addEventListener('input', updateDurationValue, false);
+    }
+
+    // Handle preview trim button click
+    if (previewTrimBtn) {
+        previewTrimBtn.addEventListener('click', previewTrimmedClip, false);
+    }
+
+    // Initialize video metadata
+    if (videoPreview) {
+        videoPreview.addEventListener('loadedmetadata', initializeVideoControls, false);
+         // Handle video end event to reset preview
+        videoPreview.addEventListener('ended', function() {
+            if (isTrimPreview) {
+                isTrimPreview = false;
+            }
+        });
+    }
+
+    function preventDefaults(e) {
+        e.preventDefault();
+        e.stopPropagation();
+    }
+
+    function highlight() {
+        if (dropArea) dropArea.classList.add('highlight');
+    }
+
+    function unhighlight() {
+        if (dropArea) dropArea.classList.remove('highlight');
+    }
+
+    function handleDrop(e) {
+        const dt = e.dataTransfer;
+        const files = dt.files;
+        handleFiles({ target: { files: files } });
+    }
+
+    function handleFiles(e) {
+        const files = e.target.files; // Accesses .files correctly
+        if (files && files.length) {
+            const file = files[0];
+            console.log("File selected:", file.name, "Type:", file.type, "Size:", file.size);
+
+            // Check file type (MIME type OR extension)
+            const fileType = file.type;
+            const fileNameFn = file.name.toLowerCase();
+            const validExtensions = ['.mp4', '.mov'];
+            const isValidExtension = validExtensions.some(ext => fileNameFn.endsWith(ext));
+
+            // Relaxed validation: Accept if MIME type matches OR extension matches
+            if ((fileType !== 'video/mp4' && fileType !== 'video/quicktime') && !isValidExtension) {
+                console.error("Invalid file type:", fileType, "Extension valid:", isValidExtension);
+                showError('Please upload an MP4 or MOV video file.');
+                return;
+            }
+
+            // Check file size (100MB limit)
+            if (file.size > 100 * 1024 * 1024) {
+                console.error("File too large:", file.size);
+                showError('File size exceeds 100MB limit.');
+                return;
+            }
+
+            currentFile = file;
+            try {
+                displayVideoPreview(file);
+            } catch (e) {
+                 console.error("Error displaying preview:", e);
+                 showError("Could not display video preview. Please try another file.");
+            }
+        }
+    }
+
+    function displayVideoPreview(file) {
+         if (!videoPreview || !fileName || !dropArea || !videoPreviewContainer || !errorContainer) return;
+
+        // Create object URL for the file
+        const objectUrl = URL.createObjectURL(file);
+
+        // Set video source and display preview
+        videoPreview.src = objectUrl;
+        fileName.textContent = file.name;
+
+        // Show preview container, hide drop area
+        dropArea.classList.add('hidden');
+        videoPreviewContainer.classList.remove('hidden');
+        errorContainer.classList.add('hidden');
+    }
+
+    function convertVideo() {
+        if (!currentFile) return;
+
+        if (!videoPreviewContainer || !conversionStatus) return;
+
+        // Show conversion status
+        videoPreviewContainer.classList.add('hidden');
+        conversionStatus.classList.remove('hidden');
+
+        if (!csrfToken) {
+            console.error("CSRF token missing");
+            showError("Security token missing. Please refresh the page.");
+            return;
+        }
+
+        // Upload in resumable chunks first, then convert the completed upload by id
+        uploadInChunks(currentFile)
+        .then(uploadId => {
+            const formData = new FormData();
+            formData.append('upload_id', uploadId);
+            formData.append('csrfmiddlewaretoken', csrfToken);
+            formData.append('start_time', startTime);
+            formData.append('duration', duration);
+            setLoaderText('Converting your video...');
+            return fetch('/convert/', {
+                method: 'POST',
+                body: formData,
+                credentials: 'same-origin'
+            });
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success && data.job_id) {
+                // Async mode: follow the job's live progress, or poll where EventSource is missing
+                if (window.EventSource && data.events_url) {
+                    watchJobEvents(data.events_url, data.status_url);
+                } else {
+                    pollJobStatus(data.status_url);
+                }
+            } else if (data.success) {
+                convertedFileUrl = data.converted_url;
+                showDownloadOptions();
+            } else {
+                showError(data.error || 'An error occurred during conversion.');
+            }
+        })
+        .catch(error => {
+            showError('An error occurred during conversion. Please try again.');
+            console.error('Error:', error);
+        });
+    }
+
+    function apiRequest(url, options, headers) {
+        return fetch(url, Object.assign({
+            credentials: 'same-origin',
+            headers: Object.assign({ 'X-CSRFToken': csrfToken }, headers || {})
+        }, options))
+        .then(response => response.json().then(data => {
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed');
+            }
+            return data;
+        }));
+    }
+
+    function setLoaderText(text) {
+        const loaderText = document.querySelector('#conversion-status .loader-text');
+        if (loaderText) loaderText.textContent = text;
+    }
+
+    function uploadInChunks(file) {
+        setLoaderText('Uploading your video...');
+        return apiRequest('/uploads/', {
+            method: 'POST',
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        }, { 'Content-Type': 'application/json' })
+        .then(session => sendMissingChunks(file, session, 0));
+    }
+
+    function sendMissingChunks(file, session, attempt) {
+        const uploadUrl = '/uploads/' + session.upload_id + '/';
+        const queue = session.missing.slice();
+        let done = session.chunk_count - queue.length;
+
+        // A few chunks in flight at once; each worker pulls the next missing index
+        function worker() {
+            if (!queue.length) return Promise.resolve();
+            const index = queue.shift();
+            const start = index * session.chunk_size;
+            const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+            return apiRequest(uploadUrl + 'chunks/' + index + '/', { method: 'PUT', body: chunk })
+            .then(() => {
+                done += 1;
+                setLoaderText('Uploading your video... ' + Math.round(done / session.chunk_count * 100) + '%');
+                return worker();
+            });
+        }
+
+        const workers = [];
+        for (let i = 0; i < UPLOAD_CONCURRENCY; i++) {
+            workers.push(worker());
+        }
+        return Promise.all(workers)
+        .then(() => apiRequest(uploadUrl + 'complete/', { method: 'POST' }))
+        .then(status => status.upload_id)
+        .catch(error => {
+            if (attempt >= UPLOAD_RETRIES) throw error;
+            // Resume: ask the server which chunks it still needs and send only those
+            return new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)))
+            .then(() => apiRequest(uploadUrl, { method: 'GET' }))
+            .then(status => sendMissingChunks(file, status, attempt + 1));
+        });
+    }
+
+    function describeProgress(state) {
+        if (state.state === 'queued') return 'Waiting for a free converter...';
+        if (state.state === 'palette') return 'Analysing colours...';
+        if (state.state === 'encoding') {
+            const speed = state.speed ? ' (' + state.speed.toFixed(1) + 'x)' : '';
+            return 'Encoding GIF... ' + Math.round(state.percent || 0) + '%' + speed;
+        }
+        return 'Converting your video...';
+    }
+
+    function watchJobEvents(eventsUrl, statusUrl) {
+        const source = new EventSource(eventsUrl);
+        let settled = false;
+        source.onmessage = event => {
+            const state = JSON.parse(event.data);
+            if (state.state === 'finished') {
+                settled = true;
+                source.close();
+                convertedFileUrl = state.converted_url;
+                showDownloadOptions();
+            } else if (state.state === 'failed') {
+                settled = true;
+                source.close();
+                showError(state.error || 'An error occurred during conversion.');
+            } else {
+                setLoaderText(describeProgress(state));
+            }
+        };
+        source.onerror = () => {
+            // Streams end every few seconds and reconnect on their own; only a
+            // closed source (e.g. 404) means the endpoint is unusable
+            if (!settled && source.readyState === EventSource.CLOSED) {
+                settled = true;
+                pollJobStatus(statusUrl);
+            }
+        };
+    }
+
+    function pollJobStatus(statusUrl) {
+        fetch(statusUrl, { credentials: 'same-origin' })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'finished') {
+                const result = data.result || {};
+                if (result.success === false) {
+                    showError(result.error || 'An error occurred during conversion.');
+                    return;
+                }
+                convertedFileUrl = data.converted_url || result.converted_url;
+                showDownloadOptions();
+            } else if (data.status === 'failed' || data.error) {
+                const result = data.result || {};
+                showError(result.error || data.error || 'An error occurred during conversion.');
+            } else {
+                setTimeout(() => pollJobStatus(statusUrl), 1500);
+            }
+        })
+        .catch(error => {
+            showError('An error occurred during conversion. Please try again.');
+            console.error('Error:', error);
+        });
+    }
+
+    function updateDurationValue() {
+        if (!durationSlider || !durationValue) return;
+        duration = parseInt(durationSlider.value);
+        durationValue.textContent = duration + ' seconds';
+    }
+
+    function updateStartTimeValue() {
+        if (!videoPreview || !startTimeSlider || !startTimeValue) return;
+
+        // Calculate start time based on slider percentage and video duration
+        if (videoPreview.duration) {
+            const percentage = parseInt(startTimeSlider.value) / 100;
+            const seconds = Math.floor(percentage * videoPreview.duration);
+            const minutes = Math.floor(seconds / 60);
+            const remainingSeconds = seconds % 60;
+            startTimeValue.textContent = minutes + ':' + (remainingSeconds < 10 ? '0' : '') + remainingSeconds;
+
+            // Format for backend: HH:MM:SS
+            const hours = Math.floor(minutes / 60);
+            const remainingMinutes = minutes % 60;
+            startTime = (hours < 10 ? '0' : '') + hours + ':' + 
+                       (remainingMinutes < 10 ? '0' : '') + remainingMinutes + ':' + 
+                       (remainingSeconds < 10 ? '0' : '') + remainingSeconds;
+        }
+    }
+
+    function initializeVideoControls() {
+        if (!videoPreview || !startTimeSlider) return;
+
+        originalVideoTime = videoPreview.currentTime;
+        // Set max value for start time slider based on video duration
+        // Leave 10 seconds at the end to ensure there's enough video for the minimum duration
+        const maxPercentage = Math.max(0, (videoPreview.duration - 10) / videoPreview.duration * 100);
+        startTimeSlider.max = Math.floor(maxPercentage);
+        updateStartTimeValue();
+    }
+
+    function previewTrimmedClip() {
+        if (!startTimeSlider || !videoPreview) return;
+
+        // Get start time from slider
+        const percentage = parseInt(startTimeSlider.value) / 100;
+        const totalSeconds = Math.floor(percentage * videoPreview.duration);
+
+        // Set video to start time
+        videoPreview.currentTime = totalSeconds;
+
+        // Play the video for the specified duration
+        videoPreview.play();
+        isTrimPreview = true;
+
+        // Stop after the duration
+        if (trimPreviewTimeout) {
+            clearTimeout(trimPreviewTimeout);
+        }
+
+        trimPreviewTimeout = setTimeout(() => {
+            videoPreview.pause();
+            isTrimPreview = false;
+        }, duration * 1000);
+    }
+
+    function showDownloadOptions() {
+        if (conversionStatus && downloadContainer) {
+            conversionStatus.classList.add('hidden');
+            downloadContainer.classList.remove('hidden');
+        }
+    }
+
+    // preview feature removed: no modal or preview button present
+
+    function downloadConvertedVideo() {
+        if (convertedFileUrl) {
+            const link = document.createElement('a');
+            link.href = convertedFileUrl;
+            link.download = 'chromi_background.gif';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+        }
+    }
+
+    function resetConverter() {
+        // Reset all states
+        currentFile = null;
+        convertedFileUrl = null;
+
+        if (videoPreview) videoPreview.src = '';
+        if (fileName) fileName.textContent = '';
+        if (fileInput) fileInput.value = '';
+
+        if (startTimeSlider) startTimeSlider.value = 0;
+        if (startTimeValue) startTimeValue.textContent = '0:00';
+        if (durationSlider) durationSlider.value = 5;
+        if (durationValue) durationValue.textContent = '5 seconds';
+
+        startTime = "00:00:00";
+        duration = 5;
+        isTrimPreview = false;
+        originalVideoTime = 0;
+
+        if (trimPreviewTimeout) {
+            clearTimeout(trimPreviewTimeout);
+            trimPreviewTimeout = null;
+        }
+
+        setLoaderText('Converting your video...');
+
+        // Show drop area, hide other containers
+        if (dropArea) dropArea.classList.remove('hidden');
+        if (videoPreviewContainer) videoPreviewContainer.classList.add('hidden');
+        if (conversionStatus) conversionStatus.classList.add('hidden');
+        if (downloadContainer) downloadContainer.classList.add('hidden');
+        if (errorContainer) errorContainer.classList.add('hidden');
+    }
+
+    function showError(message) {
+        if (errorMessage) errorMessage.textContent = message;
+        if (videoPreviewContainer) videoPreviewContainer.classList.add('hidden');
+        if (conversionStatus) conversionStatus.classList.add('hidden');
+        if (downloadContainer) downloadContainer.classList.add('hidden');
+        if (errorContainer) errorContainer.classList.remove('hidden');
+    }
+});